@@ -28,16 +28,115 @@ app_configs = {
     "REDIS_SSL_ENABLED": os.environ.get("REDIS_SSL_ENABLED", "true").lower() == "true",
     "REDIS_DB": int(os.environ.get("REDIS_DB", "0")),
     "CUSTOM_WEBHOOK_URL": os.environ.get("CUSTOM_WEBHOOK_URL", ""), # 新增：自定义通知 Webhook URL
+    # LLM 端点池: JSON 列表，例如 [{"base_url": "https://x/v1", "api_key": "sk-...", "weight": 2}]，与主端点共同组成负载均衡池
+    "OPENAI_ENDPOINT_POOL": os.environ.get("OPENAI_ENDPOINT_POOL", ""),
+    "OPENAI_ENDPOINT_POOL_STRATEGY": os.environ.get("OPENAI_ENDPOINT_POOL_STRATEGY", "least_outstanding"),  # least_outstanding 或 weighted
+    # 对冲请求 (需要端点池): 非流式请求超过最近耗时的该百分位仍未返回时，在另一个成员上发起相同请求；每个任务最多对冲的次数
+    "LLM_HEDGE_ENABLED": os.environ.get("LLM_HEDGE_ENABLED", "false").lower() == "true",
+    "LLM_HEDGE_LATENCY_PERCENTILE": int(os.environ.get("LLM_HEDGE_LATENCY_PERCENTILE", "95")),
+    "LLM_HEDGE_MAX_PER_JOB": int(os.environ.get("LLM_HEDGE_MAX_PER_JOB", "3")),
+    # 执行对冲请求 (首个请求及其副本) 的线程数，首次对冲时读取
+    "LLM_HEDGE_MAX_WORKERS": int(os.environ.get("LLM_HEDGE_MAX_WORKERS", "32")),
+    # LLM 审查结果缓存 (基于 Redis，按 模型 + System Prompt + 输入 的哈希寻址)
+    "LLM_REVIEW_CACHE_ENABLED": os.environ.get("LLM_REVIEW_CACHE_ENABLED", "true").lower() == "true",
+    "LLM_REVIEW_CACHE_TTL_SECONDS": int(os.environ.get("LLM_REVIEW_CACHE_TTL_SECONDS", str(60 * 60 * 24 * 7))),
+    "LLM_REVIEW_CACHE_MAX_ENTRIES": int(os.environ.get("LLM_REVIEW_CACHE_MAX_ENTRIES", "10000")),
+    # 模型路由: JSON 规则列表，按文件路径/扩展名/变更行数把简单变更路由到更便宜的模型，例如
+    # [{"name": "docs", "model": "gpt-4o-mini", "extensions": [".md", ".txt"]}, {"model": "gpt-4o-mini", "max_lines_changed": 10}]
+    "LLM_ROUTING_RULES": os.environ.get("LLM_ROUTING_RULES", ""),
+    # 增量审查: PR/MR 新推送时仅审查自上次已审查提交以来发生变化的文件
+    "INCREMENTAL_REVIEW_ENABLED": os.environ.get("INCREMENTAL_REVIEW_ENABLED", "true").lower() == "true",
+    # 大文件分片: 单个文件变更超过该估算 token 数时按变更块 (hunk) 切分后并发审查
+    "LLM_CHUNK_MAX_TOKENS": int(os.environ.get("LLM_CHUNK_MAX_TOKENS", "6000")),
+    # 小文件批量审查: 多个小文件合并为一次请求，单次请求估算 token 上限 (0 表示不打包) 及文件数上限
+    "LLM_BATCH_MAX_TOKENS": int(os.environ.get("LLM_BATCH_MAX_TOKENS", "4000")),
+    "LLM_BATCH_MAX_FILES": int(os.environ.get("LLM_BATCH_MAX_FILES", "10")),
+    # 流式输出: 详细审查以 stream=True 请求，每解析出一条审查意见就立即发表评论
+    # 详细审查发送给 LLM 的 diff 编码格式: json (逐行 JSON 对象) 或 compact (紧凑的带行号 diff 文本)，可按仓库覆盖
+    "LLM_DIFF_FORMAT": os.environ.get("LLM_DIFF_FORMAT", "json"),
+    "LLM_STREAMING_ENABLED": os.environ.get("LLM_STREAMING_ENABLED", "true").lower() == "true",
+    # 流式请求是否附带 stream_options.include_usage 以获取 token 用量 (含前缀缓存命中数)；部分兼容网关不支持该参数，默认关闭
+    "LLM_STREAM_INCLUDE_USAGE": os.environ.get("LLM_STREAM_INCLUDE_USAGE", "false").lower() == "true",
+    # LLM 输出的 JSON 无法修复时，是否把损坏的输出发回模型要求重新输出合法 JSON (仅一次)
+    "LLM_JSON_REASK_ENABLED": os.environ.get("LLM_JSON_REASK_ENABLED", "true").lower() == "true",
+    # LLM 重试: 限流 (429)、服务端错误 (5xx) 与连接错误各自的重试次数，指数退避的基础/最大等待秒数，以及单个审查任务的截止时间
+    "LLM_RETRY_MAX_ATTEMPTS_RATE_LIMIT": int(os.environ.get("LLM_RETRY_MAX_ATTEMPTS_RATE_LIMIT", "5")),
+    "LLM_RETRY_MAX_ATTEMPTS_SERVER_ERROR": int(os.environ.get("LLM_RETRY_MAX_ATTEMPTS_SERVER_ERROR", "3")),
+    "LLM_RETRY_MAX_ATTEMPTS_CONNECTION": int(os.environ.get("LLM_RETRY_MAX_ATTEMPTS_CONNECTION", "3")),
+    "LLM_RETRY_BASE_DELAY_SECONDS": int(os.environ.get("LLM_RETRY_BASE_DELAY_SECONDS", "1")),
+    "LLM_RETRY_MAX_DELAY_SECONDS": int(os.environ.get("LLM_RETRY_MAX_DELAY_SECONDS", "60")),
+    # 单个审查任务 (拉取变更、LLM 请求、发表评论) 的截止时间，超时后只发表已完成部分的结果
+    "LLM_JOB_DEADLINE_SECONDS": int(os.environ.get("LLM_JOB_DEADLINE_SECONDS", "900")),
+    # 同一 PR/MR 有新的提交时，取消仍在排队或运行中的旧提交审查任务
+    "REVIEW_CANCEL_SUPERSEDED_ENABLED": os.environ.get("REVIEW_CANCEL_SUPERSEDED_ENABLED", "true").lower() == "true",
+    # 审查事件防抖窗口 (秒)：同一 PR/MR 连续推送时只审查窗口内最后一次推送 (0 表示不防抖)，可按仓库覆盖
+    "REVIEW_DEBOUNCE_SECONDS": int(os.environ.get("REVIEW_DEBOUNCE_SECONDS", "0")),
+    # 集群级 LLM 限流 (基于 Redis 令牌桶，所有副本共享): 每分钟请求数与 token 数上限 (0 表示不限制)，以及等待名额的最长时间
+    "LLM_RATE_LIMIT_RPM": int(os.environ.get("LLM_RATE_LIMIT_RPM", "0")),
+    "LLM_RATE_LIMIT_TPM": int(os.environ.get("LLM_RATE_LIMIT_TPM", "0")),
+    "LLM_RATE_LIMIT_MAX_WAIT_SECONDS": int(os.environ.get("LLM_RATE_LIMIT_MAX_WAIT_SECONDS", "120")),
+    # 预过滤: 锁定文件、生成的文件、第三方代码等不发送给 LLM；新增行长度超过阈值的文件视为压缩文件 (0 表示不按行长过滤)
+    "REVIEW_PREFILTER_ENABLED": os.environ.get("REVIEW_PREFILTER_ENABLED", "true").lower() == "true",
+    "REVIEW_PREFILTER_MAX_LINE_LENGTH": int(os.environ.get("REVIEW_PREFILTER_MAX_LINE_LENGTH", "1000")),
+    # 去除仅有空白/格式变化的变更块 (Python 使用 AST 比较)，全部为格式变化的文件不送审
+    "REVIEW_SKIP_FORMATTING_ONLY": os.environ.get("REVIEW_SKIP_FORMATTING_ONLY", "true").lower() == "true",
+    # LLM 熔断: 连续失败次数阈值、熔断持续秒数、任务因熔断重新排队的最大次数
+    "LLM_CIRCUIT_FAILURE_THRESHOLD": int(os.environ.get("LLM_CIRCUIT_FAILURE_THRESHOLD", "5")),
+    "LLM_CIRCUIT_OPEN_SECONDS": int(os.environ.get("LLM_CIRCUIT_OPEN_SECONDS", "60")),
+    "LLM_CIRCUIT_MAX_REQUEUES": int(os.environ.get("LLM_CIRCUIT_MAX_REQUEUES", "10")),
+    # LLM 并发配置
+    "LLM_MAX_CONCURRENT_FILES_PER_JOB": int(os.environ.get("LLM_MAX_CONCURRENT_FILES_PER_JOB", "5")),  # 单个审查任务内并发审查的文件数
+    "LLM_MAX_CONCURRENT_REQUESTS": int(os.environ.get("LLM_MAX_CONCURRENT_REQUESTS", "10")),  # 全局同时进行的 LLM 请求数上限
+    # GitHub/GitLab/通知 Webhook 的 HTTP 连接池: 每个主机保持的最大连接数 (应不小于同时访问该主机的线程数)，以及缓存的主机连接池数
+    "HTTP_POOL_MAXSIZE": int(os.environ.get("HTTP_POOL_MAXSIZE", "20")),
+    "HTTP_POOL_CONNECTIONS": int(os.environ.get("HTTP_POOL_CONNECTIONS", "10")),
+    # 获取 PR/MR 变更的方式: files (逐文件 JSON 条目) 或 full_diff (一次请求获取完整 diff 并流式切分)
+    "VCS_DIFF_FETCH_MODE": os.environ.get("VCS_DIFF_FETCH_MODE", "files"),
+    # 通用审查拉取文件旧内容的并发: 单个任务内的并发数，以及每个主机同时进行的请求数上限 (所有任务共享)
+    "VCS_FETCH_MAX_CONCURRENCY": int(os.environ.get("VCS_FETCH_MAX_CONCURRENCY", "8")),
+    "HTTP_MAX_CONCURRENT_PER_HOST": int(os.environ.get("HTTP_MAX_CONCURRENT_PER_HOST", "8")),
+    # 文件内容缓存 (按 仓库 + 提交 SHA + 路径，内容不可变): 进程内 LRU 的内存上限 (MB)，以及 Redis 中压缩条目的过期时间
+    "FILE_CONTENT_CACHE_ENABLED": os.environ.get("FILE_CONTENT_CACHE_ENABLED", "true").lower() == "true",
+    "FILE_CONTENT_CACHE_MEMORY_MB": int(os.environ.get("FILE_CONTENT_CACHE_MEMORY_MB", "64")),
+    "FILE_CONTENT_CACHE_TTL_SECONDS": int(os.environ.get("FILE_CONTENT_CACHE_TTL_SECONDS", str(60 * 60 * 24 * 7))),
 }
 # --- ---
 
+
+def get_int_config(key: str, default: int) -> int:
+    """读取整数类型的配置项。通过管理 API 更新的值可能是字符串，这里统一转换，无效时回退到默认值。"""
+    value = app_configs.get(key, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        logger.warning(f"配置项 {key} 的值 '{value}' 不是有效整数，使用默认值 {default}。")
+        return default
+
+
+def get_bool_config(key: str, default: bool) -> bool:
+    """读取布尔类型的配置项。兼容通过管理 API 写入的字符串值 (如 "true"/"false")。"""
+    value = app_configs.get(key, default)
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes", "on")
+    return bool(value)
+
+
 # --- Redis 客户端实例 ---
 redis_client = None
 REDIS_KEY_PREFIX = "ai_code_review_helper:"
 REDIS_GITHUB_CONFIGS_KEY = f"{REDIS_KEY_PREFIX}github_repo_configs"
 REDIS_GITLAB_CONFIGS_KEY = f"{REDIS_KEY_PREFIX}gitlab_project_configs"
 REDIS_PROCESSED_COMMITS_SET_KEY = f"{REDIS_KEY_PREFIX}processed_commits_set"
+REDIS_ACTIVE_REVIEW_SHA_KEY_PREFIX = f"{REDIS_KEY_PREFIX}active_review_sha:"
+REDIS_REVIEW_DEBOUNCE_KEY_PREFIX = f"{REDIS_KEY_PREFIX}review_debounce:"
 REDIS_REVIEW_RESULTS_KEY_PREFIX = f"{REDIS_KEY_PREFIX}review_results:"
+REDIS_LLM_REVIEW_CACHE_KEY_PREFIX = f"{REDIS_KEY_PREFIX}llm_review_cache:"
+REDIS_FILE_CONTENT_CACHE_KEY_PREFIX = f"{REDIS_KEY_PREFIX}file_content_cache:"
+REDIS_LLM_RATE_LIMIT_KEY_PREFIX = f"{REDIS_KEY_PREFIX}llm_rate_limit:"
+REDIS_LLM_USAGE_STATS_KEY = f"{REDIS_KEY_PREFIX}llm_usage_stats"
+REDIS_LLM_JSON_REPAIR_STATS_KEY = f"{REDIS_KEY_PREFIX}llm_json_repair_stats"
 
 
 def init_redis_client():
@@ -207,8 +306,14 @@ def _get_review_results_redis_key(vcs_type: str, identifier: str, pr_mr_id: str)
     return f"{REDIS_REVIEW_RESULTS_KEY_PREFIX}{vcs_type}:{identifier}:{str(pr_mr_id)}"
 
 
-def save_review_results(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str, review_json_string: str, project_name: str = None):
-    """将 AI 审查结果保存到 Redis。"""
+def _get_review_metadata_field(commit_sha: str) -> str:
+    """审查元数据 (如模型路由决策) 与审查结果存放在同一个 HASH 中，字段名以 "_meta:" 开头以区别于 commit sha。"""
+    return f"_meta:{commit_sha}"
+
+
+def save_review_results(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str, review_json_string: str, project_name: str = None,
+                        review_metadata: dict = None):
+    """将 AI 审查结果保存到 Redis。review_metadata 为可选的附加信息 (例如各文件的模型路由决策)，与结果一同保存。"""
     # global redis_client # redis_client is already global
     if not redis_client:
         logger.warning("Redis 客户端不可用，无法保存 AI 审查结果。")
@@ -222,6 +327,8 @@ def save_review_results(vcs_type: str, identifier: str, pr_mr_id: str, commit_sh
         # 使用 pipeline 保证原子性
         pipe = redis_client.pipeline()
         pipe.hset(redis_key, commit_sha, review_json_string)
+        if review_metadata:
+            pipe.hset(redis_key, _get_review_metadata_field(commit_sha), json.dumps(review_metadata, ensure_ascii=False))
         if vcs_type.startswith('gitlab') and project_name: # 确保 'gitlab' 和 'gitlab_general' 都能保存项目名
             # 仅在首次或需要更新时设置项目名称
             # 如果 _project_name 已存在且不同，可以选择是否覆盖，这里简单覆盖
@@ -256,12 +363,17 @@ def get_review_results(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha
         else: # 获取 PR/MR 的所有 commits 的审查结果
             all_results_bytes = redis_client.hgetall(redis_key)
             decoded_results = {}
+            decoded_metadata = {}
             project_name_for_pr_mr = None
             for field_bytes, value_bytes in all_results_bytes.items():
                 field_str = field_bytes.decode('utf-8')
                 try:
                     if field_str == "_project_name":
                         project_name_for_pr_mr = value_bytes.decode('utf-8')
+                    elif field_str.startswith("_meta:"):
+                        decoded_metadata[field_str[len("_meta:"):]] = json.loads(value_bytes.decode('utf-8'))
+                    elif field_str.startswith("_"):
+                        continue  # 其他内部字段，不是 commit 结果
                     else: # 这是一个 commit sha
                         decoded_results[field_str] = json.loads(value_bytes.decode('utf-8'))
                 except (UnicodeDecodeError, json.JSONDecodeError) as e:
@@ -272,6 +384,8 @@ def get_review_results(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha
             final_result = {"commits": decoded_results}
             if project_name_for_pr_mr:
                 final_result["project_name"] = project_name_for_pr_mr
+            if decoded_metadata:
+                final_result["metadata"] = decoded_metadata
             return final_result
     except redis.exceptions.RedisError as e:
         logger.error(f"从 Redis 获取 AI 审查结果时出错 (Key: {redis_key}): {e}")
@@ -281,6 +395,21 @@ def get_review_results(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha
         return None if commit_sha else {}
 
 
+def get_review_metadata(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str):
+    """从 Redis 获取特定 commit 的审查元数据 (见 save_review_results 的 review_metadata)。不存在或出错时返回 None。"""
+    if not redis_client:
+        return None
+    redis_key = _get_review_results_redis_key(vcs_type, identifier, pr_mr_id)
+    try:
+        metadata_bytes = redis_client.hget(redis_key, _get_review_metadata_field(commit_sha))
+        return json.loads(metadata_bytes.decode('utf-8')) if metadata_bytes else None
+    except redis.exceptions.RedisError as e:
+        logger.error(f"从 Redis 获取审查元数据时出错 (Key: {redis_key}, Commit: {commit_sha}): {e}")
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        logger.error(f"解析 Redis 中的审查元数据时出错 (Key: {redis_key}, Commit: {commit_sha}): {e}")
+    return None
+
+
 def get_all_reviewed_prs_mrs_keys():
     """获取所有已存储 AI 审查结果的 PR/MR 的 Redis Key 列表。"""
     # global redis_client # redis_client is already global
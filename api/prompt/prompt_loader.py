@@ -1,3 +1,5 @@
+import hashlib
+import threading
 import yaml
 import os
 import logging
@@ -5,43 +7,101 @@ import logging
 logger = logging.getLogger(__name__)
 
 _PROMPTS = None
+# 每个模板 ("prompt_key.sub_key") 的版本信息: {"hash": 内容 SHA-256 前 12 位, "version": 内容变化次数 (从 1 开始)}
+_PROMPT_VERSIONS = {}
+# 已加载文件的 mtime，文件被修改后在下一次 get_prompt 时重新加载
+_PROMPT_FILE_MTIME = None
+_PROMPT_LOCK = threading.Lock()
 # __file__ 是当前 prompt_loader.py 的路径
 # os.path.dirname(__file__) 是 api/prompt/ 目录
 # prompt_templates.yml 与 prompt_loader.py 在同一目录 api/prompt/ 下
 _PROMPT_FILE_PATH = os.path.join(os.path.dirname(__file__), 'prompt_templates.yml')
 
+
+def _hash_prompt(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+
+
+def _update_prompt_versions(prompts: dict):
+    """为每个模板计算内容哈希；内容与上次加载不同的模板版本号加 1。"""
+    global _PROMPT_VERSIONS
+    new_versions = {}
+    changed_keys = []
+    for prompt_key, section in prompts.items():
+        if not isinstance(section, dict):
+            continue
+        for sub_key, value in section.items():
+            if not isinstance(value, str):
+                continue
+            template_key = f"{prompt_key}.{sub_key}"
+            content_hash = _hash_prompt(value)
+            previous = _PROMPT_VERSIONS.get(template_key)
+            if previous is None:
+                version = 1
+            elif previous["hash"] != content_hash:
+                version = previous["version"] + 1
+                changed_keys.append(template_key)
+            else:
+                version = previous["version"]
+            new_versions[template_key] = {"hash": content_hash, "version": version}
+    if _PROMPT_VERSIONS and changed_keys:
+        logger.info(f"以下 Prompt 模板内容已变化: {', '.join(changed_keys)}")
+    _PROMPT_VERSIONS = new_versions
+
+
+def _get_prompt_file_mtime():
+    try:
+        return os.stat(_PROMPT_FILE_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
 def _load_prompts_if_needed():
-    """按需加载 Prompt，仅在 _PROMPTS 为 None 时执行加载操作。"""
-    global _PROMPTS
-    if _PROMPTS is None:
+    """按需加载 Prompt: 首次调用或 prompt_templates.yml 的 mtime 变化时重新加载。
+    重新加载失败时保留上一次成功加载的 Prompt。"""
+    global _PROMPTS, _PROMPT_FILE_MTIME
+    current_mtime = _get_prompt_file_mtime()
+    if _PROMPTS is not None and current_mtime == _PROMPT_FILE_MTIME:
+        return
+    with _PROMPT_LOCK:
+        if _PROMPTS is not None and current_mtime == _PROMPT_FILE_MTIME:
+            return
+        is_reload = _PROMPTS is not None
+        _PROMPT_FILE_MTIME = current_mtime
         try:
             with open(_PROMPT_FILE_PATH, 'r', encoding='utf-8') as f:
-                _PROMPTS = yaml.safe_load(f)
-            if _PROMPTS:
-                logger.info(f"Prompts loaded successfully from {_PROMPT_FILE_PATH}")
+                loaded_prompts = yaml.safe_load(f)
+            if loaded_prompts and isinstance(loaded_prompts, dict):
+                _PROMPTS = loaded_prompts
+                _update_prompt_versions(loaded_prompts)
+                logger.info(f"Prompts {'reloaded' if is_reload else 'loaded'} successfully from {_PROMPT_FILE_PATH}")
             else:
                 logger.warning(f"Prompt file loaded but was empty or invalid: {_PROMPT_FILE_PATH}")
-                _PROMPTS = {} # Ensure it's an empty dict, not None
+                if not is_reload:
+                    _PROMPTS = {} # Ensure it's an empty dict, not None
         except FileNotFoundError:
             logger.error(f"CRITICAL: Prompt template file not found: {_PROMPT_FILE_PATH}. Prompts will not be available.")
-            _PROMPTS = {} # Fallback to empty dict
+            if not is_reload:
+                _PROMPTS = {} # Fallback to empty dict
         except yaml.YAMLError as e:
             logger.error(f"CRITICAL: Error parsing prompt template file {_PROMPT_FILE_PATH}: {e}. Prompts may be incomplete.")
-            _PROMPTS = {} # Fallback
+            if not is_reload:
+                _PROMPTS = {} # Fallback
         except Exception as e:
             logger.error(f"CRITICAL: An unexpected error occurred while loading prompts from {_PROMPT_FILE_PATH}: {e}")
-            _PROMPTS = {} # Fallback
+            if not is_reload:
+                _PROMPTS = {} # Fallback
 
 
 def get_prompt(prompt_key: str, sub_key: str = 'system_prompt') -> str:
     """
-    获取指定的 Prompt 内容。
+    获取指定的 Prompt 内容。prompt_templates.yml 被修改后会自动重新加载。
 
     :param prompt_key: Prompt 的主键 (例如 'detailed_review')。
     :param sub_key: Prompt 的次级键 (默认为 'system_prompt')。
     :return: Prompt 字符串。如果找不到，则返回一个错误提示字符串。
     """
-    _load_prompts_if_needed() # 确保 Prompts 已加载
+    _load_prompts_if_needed() # 确保 Prompts 已加载且为最新
 
     prompt_section = _PROMPTS.get(prompt_key, {})
     value = prompt_section.get(sub_key)
@@ -54,5 +114,17 @@ def get_prompt(prompt_key: str, sub_key: str = 'system_prompt') -> str:
         return f"Error: Prompt '{prompt_key}.{sub_key}' could not be loaded. Check logs."
     return value
 
+
+def get_prompt_version(prompt_key: str, sub_key: str = 'system_prompt'):
+    """返回指定 Prompt 模板的版本信息 {"hash": ..., "version": ...}；模板不存在时返回 None。"""
+    _load_prompts_if_needed()
+    return _PROMPT_VERSIONS.get(f"{prompt_key}.{sub_key}")
+
+
+def get_prompt_registry_status() -> dict:
+    """返回所有已加载 Prompt 模板的版本信息，供管理接口查看。"""
+    _load_prompts_if_needed()
+    return {"file": _PROMPT_FILE_PATH, "templates": dict(_PROMPT_VERSIONS)}
+
 # Initialize prompts on module load
 _load_prompts_if_needed()
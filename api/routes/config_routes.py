@@ -9,15 +9,44 @@ from api.app_factory import app
 from api.core_config import (
     app_configs, github_repo_configs, gitlab_project_configs,
     REDIS_GITHUB_CONFIGS_KEY, REDIS_GITLAB_CONFIGS_KEY,
-    get_all_reviewed_prs_mrs_keys, get_review_results, delete_review_results_for_pr_mr # 新增导入
+    get_all_reviewed_prs_mrs_keys, get_review_results, get_review_metadata, delete_review_results_for_pr_mr # 新增导入
 )
 import api.core_config as core_config_module  # 访问 redis_client 的推荐方式
 from api.utils import require_admin_key
-from api.services.llm_service import initialize_openai_client
+from api.services.llm_service import initialize_openai_client, get_llm_endpoint_pool_status, get_llm_circuit_breaker_status
+from api.services.llm_review_cache import get_review_cache_stats
+from api.services.llm_service import SUPPORTED_DIFF_FORMATS
+from api.services.llm_usage_stats import get_llm_usage_stats
+from api.services.json_repair import get_json_repair_stats
+from api.services.http_session_pool import get_http_pool_stats
+from api.services.file_content_cache import get_file_content_cache_stats
+from api.prompt.prompt_loader import get_prompt_registry_status
 
 logger = logging.getLogger(__name__)
 
 
+def _validate_prefilter_rules(prefilter_rules):
+    """校验仓库配置中可选的 prefilter 字段，返回错误信息；合法时返回 None。"""
+    if prefilter_rules is None:
+        return None
+    if not isinstance(prefilter_rules, dict):
+        return "prefilter must be an object"
+    for key in ("include_globs", "exclude_globs", "exclude_regexes"):
+        value = prefilter_rules.get(key)
+        if value is not None and (not isinstance(value, list) or not all(isinstance(item, str) for item in value)):
+            return f"prefilter.{key} must be a list of strings"
+    return None
+
+
+def _validate_debounce_seconds(debounce_seconds):
+    """校验仓库配置中可选的 debounce_seconds 字段，返回错误信息；合法时返回 None。"""
+    if debounce_seconds is None:
+        return None
+    if isinstance(debounce_seconds, bool) or not isinstance(debounce_seconds, int) or debounce_seconds < 0:
+        return "debounce_seconds must be a non-negative integer"
+    return None
+
+
 # GitHub Configuration Management
 @app.route('/config/github/repo', methods=['POST'])
 @require_admin_key
@@ -27,10 +56,27 @@ def add_or_update_github_repo_config():
     repo_full_name = data.get('repo_full_name')
     secret = data.get('secret')
     token = data.get('token')
+    diff_format = data.get('diff_format')  # 可选，覆盖全局 LLM_DIFF_FORMAT
+    prefilter_rules = data.get('prefilter')  # 可选，预过滤规则
+    debounce_seconds = data.get('debounce_seconds')  # 可选，覆盖全局 REVIEW_DEBOUNCE_SECONDS
     if not repo_full_name or not secret or not token:
         return jsonify({"error": "Missing required fields: repo_full_name, secret, token"}), 400
+    if diff_format and diff_format not in SUPPORTED_DIFF_FORMATS:
+        return jsonify({"error": f"Invalid diff_format. Supported: {', '.join(SUPPORTED_DIFF_FORMATS)}"}), 400
+    prefilter_error = _validate_prefilter_rules(prefilter_rules)
+    if prefilter_error:
+        return jsonify({"error": prefilter_error}), 400
+    debounce_error = _validate_debounce_seconds(debounce_seconds)
+    if debounce_error:
+        return jsonify({"error": debounce_error}), 400
 
     config_data = {"secret": secret, "token": token}
+    if diff_format:
+        config_data["diff_format"] = diff_format
+    if prefilter_rules:
+        config_data["prefilter"] = prefilter_rules
+    if debounce_seconds is not None:
+        config_data["debounce_seconds"] = debounce_seconds
     github_repo_configs[repo_full_name] = config_data
 
     if core_config_module.redis_client:
@@ -78,14 +124,31 @@ def add_or_update_gitlab_project_config():
     secret = data.get('secret')
     token = data.get('token')
     instance_url = data.get('instance_url')  # 新增
+    diff_format = data.get('diff_format')  # 可选，覆盖全局 LLM_DIFF_FORMAT
+    prefilter_rules = data.get('prefilter')  # 可选，预过滤规则
+    debounce_seconds = data.get('debounce_seconds')  # 可选，覆盖全局 REVIEW_DEBOUNCE_SECONDS
 
     if not project_id or not secret or not token:  # instance_url 是可选的
         return jsonify({"error": "Missing required fields: project_id, secret, token"}), 400
+    if diff_format and diff_format not in SUPPORTED_DIFF_FORMATS:
+        return jsonify({"error": f"Invalid diff_format. Supported: {', '.join(SUPPORTED_DIFF_FORMATS)}"}), 400
+    prefilter_error = _validate_prefilter_rules(prefilter_rules)
+    if prefilter_error:
+        return jsonify({"error": prefilter_error}), 400
+    debounce_error = _validate_debounce_seconds(debounce_seconds)
+    if debounce_error:
+        return jsonify({"error": debounce_error}), 400
 
     project_id_str = str(project_id)
     config_data = {"secret": secret, "token": token}
     if instance_url:  # 只有当用户提供时才存储
         config_data["instance_url"] = instance_url
+    if diff_format:
+        config_data["diff_format"] = diff_format
+    if prefilter_rules:
+        config_data["prefilter"] = prefilter_rules
+    if debounce_seconds is not None:
+        config_data["debounce_seconds"] = debounce_seconds
 
     gitlab_project_configs[project_id_str] = config_data
     if core_config_module.redis_client:
@@ -150,7 +213,8 @@ def update_global_settings():
             if app_configs[key] != data[key]:  # Check if value actually changed
                 app_configs[key] = data[key]
                 updated_keys.append(key)
-                if key in ["OPENAI_API_BASE_URL", "OPENAI_API_KEY", "OPENAI_MODEL"]:
+                if key in ["OPENAI_API_BASE_URL", "OPENAI_API_KEY", "OPENAI_MODEL",
+                           "OPENAI_ENDPOINT_POOL", "OPENAI_ENDPOINT_POOL_STRATEGY"]:
                     openai_config_changed = True
 
     if openai_config_changed:
@@ -165,6 +229,52 @@ def update_global_settings():
         return jsonify({"message": "No settings were updated or values provided matched existing configuration."}), 200
 
 
+@app.route('/config/llm_pool/status', methods=['GET'])
+@require_admin_key
+def get_llm_pool_status():
+    """查看 LLM 端点池各成员的健康与负载状态。"""
+    pool_status = get_llm_endpoint_pool_status()
+    if pool_status is None:
+        return jsonify({"enabled": False, "members": []}), 200
+    return jsonify({"enabled": True, "members": pool_status}), 200
+
+
+@app.route('/config/llm_circuit_breaker/status', methods=['GET'])
+@require_admin_key
+def get_llm_circuit_status():
+    """查看 LLM 熔断器的状态 (closed / open / half_open)。"""
+    return jsonify(get_llm_circuit_breaker_status()), 200
+
+
+@app.route('/config/llm_cache/stats', methods=['GET'])
+@require_admin_key
+def get_llm_cache_stats():
+    """查看 LLM 审查缓存的命中/未命中统计。"""
+    return jsonify(get_review_cache_stats()), 200
+
+
+@app.route('/config/llm_usage/stats', methods=['GET'])
+@require_admin_key
+def get_llm_usage():
+    """查看累计的 LLM token 用量及 Prompt 前缀缓存命中情况、JSON 输出修复统计，以及当前 Prompt 模板的版本。"""
+    return jsonify({"usage": get_llm_usage_stats(), "json_repair": get_json_repair_stats(),
+                    "prompts": get_prompt_registry_status()}), 200
+
+
+@app.route('/config/http_pool/stats', methods=['GET'])
+@require_admin_key
+def get_http_pool_status():
+    """查看访问 GitHub/GitLab/通知 Webhook 的 HTTP 连接池统计 (当前进程)：各主机的请求数、新建连接数及连接复用率。"""
+    return jsonify({"hosts": get_http_pool_stats()}), 200
+
+
+@app.route('/config/file_cache/stats', methods=['GET'])
+@require_admin_key
+def get_file_cache_stats():
+    """查看文件内容缓存 (当前进程) 的命中统计及进程内缓存占用。"""
+    return jsonify(get_file_content_cache_stats()), 200
+
+
 # --- AI Code Review Results Endpoints ---
 @app.route('/config/review_results/list', methods=['GET'])
 @require_admin_key
@@ -180,7 +290,7 @@ def list_reviewed_prs_mrs():
 @require_admin_key
 def get_specific_review_results(vcs_type, identifier, pr_mr_id):
     """
-    获取特定 PR/MR 的 AI 审查结果。
+    获取特定 PR/MR 的 AI 审查结果，以及审查时记录的元数据 (如各文件的模型路由决策、预过滤跳过的文件)。
     可以通过查询参数 ?commit_sha=<sha> 来获取特定 commit 的结果。
     """
     commit_sha = request.args.get('commit_sha', None)
@@ -217,10 +327,15 @@ def get_specific_review_results(vcs_type, identifier, pr_mr_id):
 
     if commit_sha: # 请求特定 commit 的结果
         # results 在这里不为 None，意味着找到了该 commit 的数据
-        return jsonify({"commit_sha": commit_sha, "review_data": results}), 200
+        response_data = {"commit_sha": commit_sha, "review_data": results}
+        review_metadata = get_review_metadata(vcs_type, identifier, pr_mr_id, commit_sha)
+        if review_metadata:
+            response_data["metadata"] = review_metadata
+        return jsonify(response_data), 200
     else: # 请求 PR/MR 的所有 commits 的结果 (results 是一个字典，可能包含 "commits" 和 "project_name")
         all_commits_reviews = results.get("commits", {})
         project_name = results.get("project_name")
+        metadata_by_commit = results.get("metadata", {})
 
         if not all_commits_reviews and not project_name:
              # 如果 "commits" 和 "project_name" 都不存在，且 results 不是 None (例如是 {})
@@ -230,6 +345,7 @@ def get_specific_review_results(vcs_type, identifier, pr_mr_id):
             response_data = {
                 "pr_mr_id": pr_mr_id,
                 "all_reviews_by_commit": {},
+                "metadata_by_commit": metadata_by_commit,
                 "display_identifier": identifier # 默认显示标识符
             }
             if vcs_type == 'gitlab' and project_name: # 即使 all_commits_reviews 为空，也可能想显示项目名
@@ -239,7 +355,8 @@ def get_specific_review_results(vcs_type, identifier, pr_mr_id):
 
         response_data = {
             "pr_mr_id": pr_mr_id,
-            "all_reviews_by_commit": all_commits_reviews
+            "all_reviews_by_commit": all_commits_reviews,
+            "metadata_by_commit": metadata_by_commit
         }
         if project_name:
             response_data["project_name"] = project_name
@@ -1,10 +1,117 @@
+import contextvars
+import json
 import logging
-from api.core_config import save_review_results
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from api.core_config import save_review_results, is_commit_processed, get_bool_config, get_int_config
+from api.app_factory import executor, handle_async_task_exception
+from api.services.concurrency_service import ReviewJobCancelled, ReviewJobDeadlineExceeded
+from api.services.job_context import review_job_context, get_current_job
+from api.services.llm_circuit_breaker import llm_circuit_breaker, LLMCircuitOpenError
+from api.services.review_job_registry import register_review_job, get_superseding_sha, watch_for_supersession
+from api.services.review_debounce import record_review_event, claim_review_event
 
 logger = logging.getLogger(__name__)
 
 
-def _save_review_results_and_log(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str, review_json_string: str, project_name_for_gitlab: str = None):
+def _submit_review_job(process_func, review_target: tuple, debounce_seconds: int = 0, event_time: str = None, **kwargs):
+    """
+    登记审查任务，并在防抖窗口结束后提交到 executor。
+    review_target 为 (vcs_type, identifier, pr_mr_id, head_sha)：登记为该 PR/MR 的最新提交后，
+    同一 PR/MR 旧提交的任务 (排队中或运行中) 会被取消，见 review_job_registry。event_time 为负载中 PR/MR 的 updated_at，
+    用于识别乱序到达的旧事件 (它不会取消新提交的任务)。
+    debounce_seconds > 0 时，窗口内同一 PR/MR 的后续事件会合并本次事件 (见 review_debounce)，只审查最后一个事件。
+    等待中的任务只保存在本进程的定时器中，窗口内进程重启会丢失这次审查，因此 REVIEW_DEBOUNCE_SECONDS 默认为 0。
+    """
+    register_review_job(*review_target, event_time=event_time)
+    vcs_type, identifier, pr_mr_id, head_sha = review_target
+    debounce_token = record_review_event(vcs_type, identifier, pr_mr_id, debounce_seconds) if debounce_seconds > 0 else None
+    if debounce_token is None:
+        _submit_to_executor(process_func, review_target, kwargs)
+        return
+
+    def _submit_if_latest():
+        if claim_review_event(vcs_type, identifier, pr_mr_id, debounce_token):
+            _submit_to_executor(process_func, review_target, kwargs)
+        else:
+            logger.info(f"{vcs_type} {identifier}#{pr_mr_id}: 提交 {(head_sha or '')[:7]} 的审查事件已被之后的事件合并，不单独审查。")
+
+    timer = threading.Timer(debounce_seconds, _submit_if_latest)
+    timer.daemon = True
+    timer.start()
+    logger.info(f"{vcs_type} {identifier}#{pr_mr_id}: 提交 {(head_sha or '')[:7]} 的审查将在 {debounce_seconds} 秒内无新事件后开始。")
+
+
+def _submit_to_executor(process_func, review_target: tuple, kwargs: dict):
+    future = executor.submit(_run_review_job, process_func, _review_target=review_target, **kwargs)
+    future.add_done_callback(handle_async_task_exception)
+
+
+def _run_review_job(process_func, _requeue_count: int = 0, _review_target: tuple = None, _posted_comments=None, **kwargs):
+    """
+    在后台线程中执行审查任务的入口 (由 _submit_review_job 提交)。
+    为整个任务创建任务上下文 (见 job_context)，截止时间为 LLM_JOB_DEADLINE_SECONDS：拉取变更、LLM 请求及其重试都不会超过该时间，
+    超时后未完成的文件被放弃，已完成的结果照常发表 (见 _get_job_timeout_note)。
+    任务所审查的提交已被同一 PR/MR 的新提交取代时，排队中的任务直接跳过，运行中的任务在下一阶段开始前停止。
+    LLM 端点熔断时任务会被中止，并在熔断器进入半开状态后重新排队 (最多 LLM_CIRCUIT_MAX_REQUEUES 次)，
+    而不是产出 "无问题" 的审查结果。中止前已 (流式) 发表评论的位置随任务传递 (_posted_comments)，
+    重新运行时这些位置的评论不再重复发表 (见 ReviewCommentPoster)。
+    """
+    if _review_target is not None:
+        superseding_sha = get_superseding_sha(*_review_target)
+        if superseding_sha:
+            logger.info(f"审查任务 {process_func.__name__} ({_review_target[0]} {_review_target[1]}#{_review_target[2]}) "
+                        f"的提交 {_review_target[3][:7]} 已被 {superseding_sha[:7]} 取代，跳过。")
+            return None
+    circuit_retry_after = llm_circuit_breaker.get_retry_after_seconds()
+    if circuit_retry_after is not None:
+        # 熔断中的任务无需先拉取 diff，直接延后
+        _requeue_review_job(process_func, _requeue_count, circuit_retry_after, _review_target, kwargs, _posted_comments)
+        return None
+    job = None
+    try:
+        with review_job_context(process_func.__name__, get_int_config("LLM_JOB_DEADLINE_SECONDS", 900),
+                                _posted_comments) as job:
+            if _review_target is not None:
+                watch_for_supersession(job, *_review_target)
+            return process_func(**kwargs)
+    except LLMCircuitOpenError as e:
+        logger.warning(f"审查任务 {process_func.__name__} 因 LLM 端点熔断被中止: {e}")
+        _requeue_review_job(process_func, _requeue_count, e.retry_after_seconds, _review_target, kwargs,
+                            job.posted_comments if job is not None else _posted_comments)
+        return None
+    except ReviewJobCancelled as e:
+        logger.info(f"审查任务 {process_func.__name__} 已停止: {e}")
+        return None
+    except ReviewJobDeadlineExceeded as e:
+        # 审查开始前 (拉取变更阶段) 就已超时，没有可发表的结果
+        logger.warning(f"审查任务 {process_func.__name__} 在拉取变更时超时，未产生审查结果: {e}")
+        return None
+
+
+def _requeue_review_job(process_func, requeue_count: int, delay_seconds: float, review_target: tuple, kwargs: dict,
+                        posted_comments=None):
+    """在 delay_seconds 后 (加随机抖动，避免所有任务同时涌向半开探测) 将审查任务重新提交到 executor。"""
+    max_requeues = get_int_config("LLM_CIRCUIT_MAX_REQUEUES", 10)
+    if requeue_count >= max_requeues:
+        logger.error(f"审查任务 {process_func.__name__} 已因 LLM 端点熔断重新排队 {requeue_count} 次，放弃该任务。")
+        return
+    delay_seconds = max(1.0, delay_seconds) + random.uniform(0, 10)
+
+    def _submit():
+        future = executor.submit(_run_review_job, process_func, _requeue_count=requeue_count + 1,
+                                 _review_target=review_target, _posted_comments=posted_comments, **kwargs)
+        future.add_done_callback(handle_async_task_exception)
+
+    timer = threading.Timer(delay_seconds, _submit)
+    timer.daemon = True
+    timer.start()
+    logger.info(f"审查任务 {process_func.__name__} 将在 {delay_seconds:.0f} 秒后重新排队 (第 {requeue_count + 1} 次)。")
+
+
+def _save_review_results_and_log(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str, review_json_string: str, project_name_for_gitlab: str = None,
+                                 review_metadata: dict = None):
     """统一保存审查结果到 Redis 并记录日志。"""
     if not commit_sha:
         logger.warning(f"警告: {vcs_type.capitalize()} {identifier}#{pr_mr_id} 的 commit_sha 为空。无法保存审查结果。")
@@ -13,9 +120,10 @@ def _save_review_results_and_log(vcs_type: str, identifier: str, pr_mr_id: str,
     try:
         # 统一处理所有 github* 和 gitlab* 类型
         if vcs_type.startswith('github'): # 包括 'github' 和 'github_general'
-            save_review_results(vcs_type, identifier, pr_mr_id, commit_sha, review_json_string)
+            save_review_results(vcs_type, identifier, pr_mr_id, commit_sha, review_json_string, review_metadata=review_metadata)
         elif vcs_type.startswith('gitlab'): # 包括 'gitlab' 和 'gitlab_general'
-            save_review_results(vcs_type, identifier, pr_mr_id, commit_sha, review_json_string, project_name=project_name_for_gitlab)
+            save_review_results(vcs_type, identifier, pr_mr_id, commit_sha, review_json_string, project_name=project_name_for_gitlab,
+                                review_metadata=review_metadata)
         else:
             logger.error(f"未知的 VCS 类型 '{vcs_type}'，无法保存审查结果。")
             return
@@ -27,3 +135,137 @@ def _save_review_results_and_log(vcs_type: str, identifier: str, pr_mr_id: str,
     except Exception as e:
         # save_review_results 内部已经有错误日志，这里可以捕获更通用的错误或决定是否需要额外日志
         logger.error(f"调用 save_review_results 时发生意外错误 ({vcs_type} {identifier}#{pr_mr_id}, Commit: {commit_sha}): {e}")
+
+
+def _get_incremental_review_paths(vcs_type: str, identifier: str, pr_mr_id: str, head_sha: str, candidate_previous_shas: list, fetch_changed_paths):
+    """
+    判断本次审查能否以增量模式进行。
+    从 candidate_previous_shas (从新到旧) 中找到最近一个已审查过的提交，并通过 fetch_changed_paths(previous_sha)
+    获取它与 head_sha 之间内容发生变化的文件路径集合。
+    返回 (previous_sha, changed_paths)；不适用增量审查时返回 (None, None)。
+    """
+    if not get_bool_config("INCREMENTAL_REVIEW_ENABLED", True):
+        return None, None
+
+    previous_sha = None
+    for candidate_sha in candidate_previous_shas or []:
+        if candidate_sha and candidate_sha != head_sha and is_commit_processed(vcs_type, identifier, pr_mr_id, candidate_sha):
+            previous_sha = candidate_sha
+            break
+    if not previous_sha:
+        return None, None
+
+    changed_paths = fetch_changed_paths(previous_sha)
+    if changed_paths is None:
+        logger.info(f"{vcs_type.capitalize()} {identifier}#{pr_mr_id}: 无法确定自 {previous_sha[:7]} 以来的变更文件，回退到全量审查。")
+        return None, None
+    logger.info(f"{vcs_type.capitalize()} {identifier}#{pr_mr_id}: 启用增量审查，基于上次已审查的提交 {previous_sha[:7]}。")
+    return previous_sha, changed_paths
+
+
+def _get_incremental_review_note(previous_sha: str, reviewed_count: int, total_count: int) -> str:
+    """生成附加在总结评论中的增量审查说明。"""
+    return f"增量审查：仅审查了自上次审查的提交 `{previous_sha[:7]}` 以来发生变化的 {reviewed_count}/{total_count} 个文件。"
+
+
+def _get_model_routing_note(routing_decisions: dict, default_model: str):
+    """当有文件被路由到非默认模型时，生成附加在总结评论中的说明；否则返回 None。"""
+    files_by_model = {}
+    for decision in routing_decisions.values():
+        if decision.get("model") != default_model:
+            files_by_model[decision["model"]] = files_by_model.get(decision["model"], 0) + 1
+    if not files_by_model:
+        return None
+    routed = "、".join(f"「{model}」{count} 个文件" for model, count in files_by_model.items())
+    return f"模型路由：按复杂度规则，{routed}使用了其他模型审查。"
+
+
+def _get_prefilter_note(skipped_files: dict, max_listed: int = 10):
+    """生成预过滤跳过文件的说明 (附加在总结评论中)；没有跳过的文件时返回 None。"""
+    if not skipped_files:
+        return None
+    listed = "、".join(f"`{path}` ({reason})" for path, reason in list(skipped_files.items())[:max_listed])
+    if len(skipped_files) > max_listed:
+        listed += " 等"
+    return f"预过滤：{len(skipped_files)} 个文件未发送给 AI 审查：{listed}。"
+
+
+def _get_job_timeout_note(max_listed: int = 5):
+    """当前审查任务因超时放弃了部分审查时，生成附加在总结评论中的说明；否则返回 None。"""
+    job = get_current_job()
+    if job is None or not job.timed_out:
+        return None
+    abandoned = job.abandoned_stages
+    listed = "、".join(abandoned[:max_listed]) + (" 等" if len(abandoned) > max_listed else "")
+    return (f"审查超时：任务超过了 {get_int_config('LLM_JOB_DEADLINE_SECONDS', 900)} 秒的时间限制，"
+            f"{len(abandoned)} 项审查未完成 ({listed})，以上为部分结果。")
+
+
+class ReviewCommentPoster:
+    """
+    在后台单线程中按到达顺序发表审查评论，使流式审查解析出的意见可以在模型仍在生成时就开始发表。
+    相同的审查意见 (文件、行号、分析内容均相同) 只会发表一次，因此流式回调和最终结果可以都提交给它。
+    任务因 LLM 熔断被中止并重新运行时，之前的运行已发表评论的位置 (文件、行号) 会被跳过：
+    重新生成的分析措辞不同，无法按内容去重。
+    """
+
+    def __init__(self, post_func, description: str):
+        """
+        :param post_func: 发表单条评论的函数，接收审查意见字典，返回是否成功。
+        :param description: 用于日志的描述，例如 "GitHub (详细审查)"。
+        """
+        self._post_func = post_func
+        self._description = description
+        self._lock = threading.Lock()
+        self._submitted_keys = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="comment-poster")
+        self._job = get_current_job()
+        self.comments_added = 0
+        self.comments_failed = 0
+
+    @staticmethod
+    def _review_key(review: dict) -> str:
+        return json.dumps([review.get("file"), review.get("lines"), review.get("analysis")], sort_keys=True, ensure_ascii=False)
+
+    @staticmethod
+    def _location_key(review: dict) -> str:
+        return json.dumps([review.get("file"), review.get("lines")], sort_keys=True, ensure_ascii=False)
+
+    def submit(self, review: dict):
+        """提交一条审查意见等待发表；重复的意见会被忽略。可在任意线程中调用。"""
+        if not isinstance(review, dict):
+            logger.warning(f"{self._description}: 跳过无效的审查项: {review}")
+            return
+        if self._job is not None and self._location_key(review) in self._job.previously_posted_comments:
+            logger.info(f"{self._description}: {review.get('file')} {review.get('lines')} 的评论已在任务之前的运行中发表，跳过。")
+            return
+        review_key = self._review_key(review)
+        with self._lock:
+            if review_key in self._submitted_keys:
+                return
+            self._submitted_keys.add(review_key)
+        self._executor.submit(contextvars.copy_context().run, self._post, review)
+
+    def _post(self, review: dict):
+        try:
+            success = self._post_func(review)
+        except ReviewJobCancelled:
+            success = False
+        except Exception:
+            logger.exception(f"{self._description}: 发表审查评论时出错:")
+            success = False
+        if success and self._job is not None:
+            self._job.record_posted_comment(self._location_key(review))
+        with self._lock:
+            if success:
+                self.comments_added += 1
+            else:
+                self.comments_failed += 1
+
+    def finish(self, reviews: list = None):
+        """提交最终结果中尚未发表的意见，并等待所有评论发表完成。返回 (成功数, 失败数)。"""
+        for review in reviews or []:
+            self.submit(review)
+        self._executor.shutdown(wait=True)
+        logger.info(f"{self._description}: 添加评论完成: {self.comments_added} 成功, {self.comments_failed} 失败。")
+        return self.comments_added, self.comments_failed
@@ -1,7 +1,7 @@
 from flask import request, abort, jsonify
 import json
 import logging
-from api.app_factory import app, executor, handle_async_task_exception # 导入 executor 和回调
+from api.app_factory import app
 from api.core_config import (
     github_repo_configs, gitlab_project_configs, app_configs,
     is_commit_processed, mark_commit_as_processed, remove_processed_commit_entries_for_pr_mr
@@ -11,14 +11,21 @@ from api.services.vcs_service import (
     get_github_pr_changes, add_github_pr_comment, 
     get_gitlab_mr_changes, add_gitlab_mr_comment,
     add_github_pr_general_comment, # Used for final summary
-    add_gitlab_mr_general_comment  # Used for final summary
+    add_gitlab_mr_general_comment,  # Used for final summary
+    get_github_changed_files_between, get_gitlab_changed_files_between # 增量审查
 )
 # 注意：get_openai_code_review 仍被 GitLab 逻辑使用，所以保留
-# 新增导入 get_openai_detailed_review_for_file 用于 GitHub 的逐文件审查
-from api.services.llm_service import get_openai_code_review, get_openai_detailed_review_for_file, get_openai_client
+# get_openai_detailed_reviews 用于 GitHub 的逐文件并发审查
+from api.services.llm_service import get_openai_code_review, get_openai_detailed_reviews, get_openai_client, route_file_reviews
 from api.services.notification_service import send_notifications
 from api.services.common_service import get_final_summary_comment_text
-from .webhook_helpers import _save_review_results_and_log
+from .webhook_helpers import (
+    _submit_review_job, _save_review_results_and_log, _get_incremental_review_paths, _get_incremental_review_note,
+    _get_model_routing_note, _get_prefilter_note, _get_job_timeout_note, ReviewCommentPoster
+)
+from api.services.job_context import is_job_timed_out
+from api.services.review_prefilter import prefilter_structured_changes
+from api.services.review_debounce import get_review_debounce_seconds
 
 logger = logging.getLogger(__name__)
 
@@ -50,7 +57,7 @@ def _get_wecom_summary_line(num_reviews, vcs_type):
 # --- End Helper Functions ---
 
 
-def _process_github_detailed_payload(access_token, owner, repo_name, pull_number, head_sha, repo_full_name, pr_title, pr_html_url, repo_web_url, pr_source_branch, pr_target_branch):
+def _process_github_detailed_payload(access_token, owner, repo_name, pull_number, head_sha, repo_full_name, pr_title, pr_html_url, repo_web_url, pr_source_branch, pr_target_branch, before_sha=None):
     """实际处理 GitHub 详细审查的核心逻辑 (逐文件审查和评论)。"""
     logger.info("GitHub (详细审查): 正在获取并解析 PR 变更...")
     structured_changes = get_github_pr_changes(owner, repo_name, pull_number, access_token)
@@ -58,13 +65,37 @@ def _process_github_detailed_payload(access_token, owner, repo_name, pull_number
     if structured_changes is None:
         logger.warning("GitHub (详细审查): 获取或解析 diff 内容失败。中止审查。")
         return
+
+    summary_notes = []
+    previous_sha, changed_paths = _get_incremental_review_paths(
+        'github', repo_full_name, str(pull_number), head_sha, [before_sha],
+        lambda base_sha: get_github_changed_files_between(owner, repo_name, base_sha, head_sha, access_token)
+    )
+    if changed_paths is not None:
+        total_files = len(structured_changes)
+        structured_changes = {
+            path: data for path, data in structured_changes.items()
+            if path in changed_paths or data.get("old_path") in changed_paths
+        }
+        logger.info(f"GitHub (详细审查): 增量审查将只处理 {len(structured_changes)}/{total_files} 个文件。")
+        summary_notes.append(_get_incremental_review_note(previous_sha, len(structured_changes), total_files))
+
+    # 锁定文件、生成的文件和第三方代码不发送给 LLM
+    repo_config = github_repo_configs.get(repo_full_name) or {}
+    structured_changes, prefilter_skipped = prefilter_structured_changes(structured_changes, repo_config.get("prefilter"))
+    summary_notes.append(_get_prefilter_note(prefilter_skipped))
+
     if not structured_changes:
-        logger.info("GitHub (详细审查): 解析后未检测到变更。无需审查。")
+        logger.info("GitHub (详细审查): 解析后未检测到变更 (或均被预过滤)。无需审查。")
         _save_review_results_and_log(
             vcs_type='github', identifier=repo_full_name, pr_mr_id=str(pull_number),
-            commit_sha=head_sha, review_json_string=json.dumps([])
+            commit_sha=head_sha, review_json_string=json.dumps([]),
+            review_metadata={"prefilter_skipped": prefilter_skipped} if prefilter_skipped else None
         )
         mark_commit_as_processed('github', repo_full_name, str(pull_number), head_sha)
+        if prefilter_skipped:
+            add_github_pr_general_comment(owner, repo_name, pull_number, access_token,
+                                          get_final_summary_comment_text(summary_notes))
         return
 
     all_reviews_for_redis = []
@@ -78,32 +109,44 @@ def _process_github_detailed_payload(access_token, owner, repo_name, pull_number
         return
     current_model = app_configs.get("OPENAI_MODEL", "gpt-4o")
 
-    logger.info(f'GitHub (详细审查): 将对 {len(structured_changes)} 个文件逐一发送给 {current_model} 进行审查...')
+    def _post_github_review(review_item):
+        # 确保 review_item 中包含 old_path (如果适用)
+        file_data = structured_changes.get(review_item.get("file")) or {}
+        if "old_path" not in review_item and file_data.get("old_path"):
+            review_item["old_path"] = file_data["old_path"]
+        return add_github_pr_comment(owner, repo_name, pull_number, access_token, review_item, head_sha)
+
+    # 流式模式下审查意见一经解析即开始发表评论，无需等待所有文件审查完成
+    comment_poster = ReviewCommentPoster(_post_github_review, "GitHub (详细审查)")
+
+    routing_decisions = route_file_reviews(structured_changes, current_model)
+    summary_notes.append(_get_model_routing_note(routing_decisions, current_model))
+
+    logger.info(f'GitHub (详细审查): 将对 {len(structured_changes)} 个文件并发发送给 {current_model} 进行审查...')
+    reviews_by_file = get_openai_detailed_reviews(
+        structured_changes, client, current_model,
+        on_review=lambda file_path, review: comment_poster.submit(review),
+        model_by_path={file_path: decision["model"] for file_path, decision in routing_decisions.items()},
+        diff_format=repo_config.get("diff_format")
+    )
 
+    # 按文件原始顺序汇总，保证存储的结果顺序稳定
     for file_path, file_data in structured_changes.items():
-        logger.info(f"GitHub (详细审查): 正在处理文件: {file_path}")
-        reviews_for_file_list = get_openai_detailed_review_for_file(file_path, file_data, client, current_model)
-
+        reviews_for_file_list = reviews_by_file.get(file_path, [])
         if reviews_for_file_list: # reviews_for_file_list 是一个 Python 列表
-            all_reviews_for_redis.extend(reviews_for_file_list)
-            logger.info(f"GitHub (详细审查): 文件 {file_path} 发现 {len(reviews_for_file_list)} 个问题。正在尝试添加评论...")
-            
-            file_comments_added, file_comments_failed = 0, 0
             for review_item in reviews_for_file_list:
-                # 确保 review_item 中包含 old_path (如果适用)
                 if "old_path" not in review_item and file_data.get("old_path"):
                     review_item["old_path"] = file_data["old_path"]
-                
-                success = add_github_pr_comment(owner, repo_name, pull_number, access_token, review_item, head_sha)
-                if success:
-                    file_comments_added += 1
-                    total_comments_posted_successfully +=1
-                else:
-                    file_comments_failed += 1
-            logger.info(f"GitHub (详细审查): 文件 {file_path} 评论添加完成: {file_comments_added} 成功, {file_comments_failed} 失败。")
+            all_reviews_for_redis.extend(reviews_for_file_list)
+            logger.info(f"GitHub (详细审查): 文件 {file_path} 发现 {len(reviews_for_file_list)} 个问题。")
         else:
             logger.info(f"GitHub (详细审查): 文件 {file_path} 未发现问题或审查时出错。")
 
+    summary_notes.append(_get_job_timeout_note())
+
+    # 发表流式阶段尚未发表的评论 (例如来自缓存的结果)，并等待全部发表完成
+    total_comments_posted_successfully, _ = comment_poster.finish(all_reviews_for_redis)
+
     # 所有文件处理完毕后
     logger.info("--- GitHub (详细审查): 所有文件处理完毕 ---")
     logger.info(f"总共收集到 {len(all_reviews_for_redis)} 条审查意见用于存储。")
@@ -122,11 +165,12 @@ def _process_github_detailed_payload(access_token, owner, repo_name, pull_number
         identifier=repo_full_name,
         pr_mr_id=str(pull_number),
         commit_sha=head_sha,
-        review_json_string=final_review_json_for_redis
+        review_json_string=final_review_json_for_redis,
+        review_metadata={"model_routing": routing_decisions, "prefilter_skipped": prefilter_skipped}
     )
 
     # 如果没有任何评论被成功发布 (或 all_reviews_for_redis 为空)
-    if not all_reviews_for_redis: # 或者 total_comments_posted_successfully == 0
+    if not all_reviews_for_redis and not is_job_timed_out(): # 或者 total_comments_posted_successfully == 0
         _post_no_issues_comment(
             vcs_type='github',
             comment_function=add_github_pr_comment,
@@ -152,12 +196,14 @@ def _process_github_detailed_payload(access_token, owner, repo_name, pull_number
         # send_to_wecom_bot(summary_content) # 旧调用 - 已被 send_notifications 替代
         send_notifications(summary_content) # 新调用
 
-    if head_sha:
+    if is_job_timed_out():
+        logger.warning(f"GitHub (详细审查): PR {repo_full_name}#{pull_number} 的审查因超时未完成，不标记为已处理。")
+    elif head_sha:
         mark_commit_as_processed('github', repo_full_name, str(pull_number), head_sha)
     else:
         logger.warning(f"警告: GitHub (详细审查) PR {repo_full_name}#{pull_number} 的 head_sha 为空。无法标记为已处理。")
 
-    final_comment_text = get_final_summary_comment_text()
+    final_comment_text = get_final_summary_comment_text(summary_notes)
     add_github_pr_general_comment(owner, repo_name, pull_number, access_token, final_comment_text)
 
 
@@ -232,8 +278,11 @@ def github_webhook():
         return "提交已处理", 200
 
     # 调用提取出来的核心处理逻辑函数 (异步执行)
-    future = executor.submit(
+    _submit_review_job(
         _process_github_detailed_payload,
+        ('github', repo_full_name, str(pull_number), head_sha),
+        debounce_seconds=get_review_debounce_seconds(config),
+        event_time=pr_data.get('updated_at'),
         access_token=access_token,
         owner=owner,
         repo_name=repo_name,
@@ -244,9 +293,9 @@ def github_webhook():
         pr_html_url=pr_html_url,
         repo_web_url=repo_web_url,
         pr_source_branch=pr_source_branch,
-        pr_target_branch=pr_target_branch
+        pr_target_branch=pr_target_branch,
+        before_sha=payload_data.get('before') if action == 'synchronize' else None
     )
-    future.add_done_callback(handle_async_task_exception)
     
     logger.info(f"GitHub (详细审查): PR {repo_full_name}#{pull_number} 的处理任务已提交到后台执行。")
     return jsonify({"message": "GitHub Detailed Webhook processing task accepted."}), 202
@@ -267,18 +316,62 @@ def _process_gitlab_detailed_payload(access_token, project_id_str, mr_iid, head_
     if structured_changes is None:
         logger.warning("GitLab (详细审查): 获取或解析 diff 内容失败。中止审查。")
         return
+
+    summary_notes = []
+    current_head_sha = head_sha_payload or position_info.get("head_sha")
+    previous_sha, changed_paths = _get_incremental_review_paths(
+        'gitlab', project_id_str, str(mr_iid), current_head_sha,
+        [mr_attrs.get('oldrev')] + position_info.get("previous_head_shas", []),
+        lambda base_sha: get_gitlab_changed_files_between(project_id_str, base_sha, current_head_sha, access_token)
+    )
+    if changed_paths is not None:
+        total_files = len(structured_changes)
+        structured_changes = {
+            path: data for path, data in structured_changes.items()
+            if path in changed_paths or data.get("old_path") in changed_paths
+        }
+        logger.info(f"GitLab (详细审查): 增量审查将只处理 {len(structured_changes)}/{total_files} 个文件。")
+        summary_notes.append(_get_incremental_review_note(previous_sha, len(structured_changes), total_files))
+
+    # 锁定文件、生成的文件和第三方代码不发送给 LLM
+    project_config = gitlab_project_configs.get(project_id_str) or {}
+    structured_changes, prefilter_skipped = prefilter_structured_changes(structured_changes, project_config.get("prefilter"))
+    summary_notes.append(_get_prefilter_note(prefilter_skipped))
+
     if not structured_changes:
-        logger.info("GitLab (详细审查): 解析后未检测到变更。无需审查。")
+        logger.info("GitLab (详细审查): 解析后未检测到变更 (或均被预过滤)。无需审查。")
         _save_review_results_and_log(
             vcs_type='gitlab', identifier=project_id_str, pr_mr_id=str(mr_iid),
             commit_sha=head_sha_payload, review_json_string=json.dumps([]),
-            project_name_for_gitlab=project_name_from_payload
+            project_name_for_gitlab=project_name_from_payload,
+            review_metadata={"prefilter_skipped": prefilter_skipped} if prefilter_skipped else None
         )
         mark_commit_as_processed('gitlab', project_id_str, str(mr_iid), head_sha_payload)
+        if prefilter_skipped:
+            add_gitlab_mr_general_comment(project_id_str, mr_iid, access_token,
+                                          get_final_summary_comment_text(summary_notes))
         return
 
-    logger.info(f'GitLab (详细审查): 正在发送变更给 {app_configs.get("OPENAI_MODEL", "gpt-4o")} 进行审查...')
-    review_result_json = get_openai_code_review(structured_changes)
+    def _post_gitlab_review(review):
+        file_path = review.get("file")
+        if file_path in structured_changes:
+            review["old_path"] = structured_changes[file_path].get("old_path")
+        return add_gitlab_mr_comment(project_id_str, mr_iid, access_token, review, position_info)
+
+    # 流式模式下审查意见一经解析即开始发表评论，无需等待所有文件审查完成
+    comment_poster = ReviewCommentPoster(_post_gitlab_review, "GitLab (详细审查)")
+
+    current_model = app_configs.get("OPENAI_MODEL", "gpt-4o")
+    routing_decisions = route_file_reviews(structured_changes, current_model)
+    summary_notes.append(_get_model_routing_note(routing_decisions, current_model))
+
+    logger.info(f'GitLab (详细审查): 正在发送变更给 {current_model} 进行审查...')
+    review_result_json = get_openai_code_review(
+        structured_changes, on_review=lambda file_path, review: comment_poster.submit(review),
+        model_by_path={file_path: decision["model"] for file_path, decision in routing_decisions.items()},
+        diff_format=project_config.get("diff_format"))
+
+    summary_notes.append(_get_job_timeout_note())
 
     logger.info("--- GitLab (详细审查): AI 代码审查结果 (JSON) ---")
     logger.info(f"{review_result_json}")
@@ -295,7 +388,8 @@ def _process_gitlab_detailed_payload(access_token, project_id_str, mr_iid, head_
         pr_mr_id=str(mr_iid),
         commit_sha=current_commit_sha_for_saving,
         review_json_string=review_result_json,
-        project_name_for_gitlab=project_name_from_payload
+        project_name_for_gitlab=project_name_from_payload,
+        review_metadata={"model_routing": routing_decisions, "prefilter_skipped": prefilter_skipped}
     )
 
     reviews = []
@@ -307,24 +401,12 @@ def _process_gitlab_detailed_payload(access_token, project_id_str, mr_iid, head_
         logger.error(f"GitLab (详细审查): 解析审查结果 JSON 时出错: {e}。原始数据: {review_result_json[:500]}")
 
     if reviews:
-        logger.info(f"GitLab (详细审查): 尝试向 MR 添加 {len(reviews)} 条审查评论...")
-        comments_added, comments_failed = 0, 0
-        for review in reviews:
-            if isinstance(review, dict) and "file" in review:
-                file_path = review["file"]
-                if file_path in structured_changes:
-                    review["old_path"] = structured_changes[file_path].get("old_path")
-            if isinstance(review, dict):
-                success = add_gitlab_mr_comment(project_id_str, mr_iid, access_token, review, position_info)
-                if success:
-                    comments_added += 1
-                else:
-                    comments_failed += 1
-            else:
-                logger.warning(f"GitLab (详细审查): 跳过无效的审查项: {review}");
-                comments_failed += 1
-        logger.info(f"GitLab (详细审查): 添加评论完成: {comments_added} 成功, {comments_failed} 失败。")
+        logger.info(f"GitLab (详细审查): 共 {len(reviews)} 条审查意见，正在发表尚未发表的评论...")
+        comment_poster.finish(reviews)
+    elif is_job_timed_out():
+        comment_poster.finish()
     else:
+        comment_poster.finish()
         _post_no_issues_comment(
             vcs_type='gitlab',
             comment_function=add_gitlab_mr_comment,
@@ -352,14 +434,16 @@ def _process_gitlab_detailed_payload(access_token, project_id_str, mr_iid, head_
         # send_to_wecom_bot(summary_content) # 旧调用
         send_notifications(summary_content) # 新调用
 
-    if head_sha_payload:
+    if is_job_timed_out():
+        logger.warning(f"GitLab (详细审查): MR {project_id_str}!{mr_iid} 的审查因超时未完成，不标记为已处理。")
+    elif head_sha_payload:
         mark_commit_as_processed('gitlab', project_id_str, str(mr_iid), head_sha_payload)
     elif position_info and position_info.get("head_sha"):
         logger.warning(
             f"警告: GitLab (详细审查) head_sha_payload 为空，使用来自 position_info 的 head_sha 进行标记处理: {position_info.get('head_sha')}")
         mark_commit_as_processed('gitlab', project_id_str, str(mr_iid), position_info.get("head_sha"))
 
-    final_comment_text = get_final_summary_comment_text()
+    final_comment_text = get_final_summary_comment_text(summary_notes)
     add_gitlab_mr_general_comment(project_id_str, mr_iid, access_token, final_comment_text)
 
 
@@ -427,8 +511,11 @@ def gitlab_webhook():
         return "提交已处理", 200
 
     # 调用提取出来的核心处理逻辑函数 (异步执行)
-    future = executor.submit(
+    _submit_review_job(
         _process_gitlab_detailed_payload,
+        ('gitlab', project_id_str, str(mr_iid), head_sha_payload),
+        debounce_seconds=get_review_debounce_seconds(config),
+        event_time=mr_attrs.get('updated_at'),
         access_token=access_token,
         project_id_str=project_id_str,
         mr_iid=mr_iid,
@@ -440,7 +527,6 @@ def gitlab_webhook():
         mr_url=mr_url,
         project_name_from_payload=project_name_from_payload
     )
-    future.add_done_callback(handle_async_task_exception)
 
     logger.info(f"GitLab (详细审查): MR {project_id_str}#{mr_iid} 的处理任务已提交到后台执行。")
     return jsonify({"message": "GitLab Detailed Webhook processing task accepted."}), 202
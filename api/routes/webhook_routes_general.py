@@ -1,7 +1,7 @@
 from flask import request, abort, jsonify
 import json
 import logging
-from api.app_factory import app, executor, handle_async_task_exception # 导入 executor 和回调
+from api.app_factory import app
 from api.core_config import (
     github_repo_configs, gitlab_project_configs, app_configs,
     is_commit_processed, mark_commit_as_processed, remove_processed_commit_entries_for_pr_mr
@@ -10,42 +10,83 @@ from api.utils import verify_github_signature, verify_gitlab_signature
 from api.services.vcs_service import (
     get_github_pr_data_for_general_review, add_github_pr_general_comment,
     get_gitlab_mr_data_for_general_review, add_gitlab_mr_general_comment,
-    get_gitlab_mr_changes # 新增导入
+    get_gitlab_mr_changes, # 新增导入
+    get_github_changed_files_between, get_gitlab_changed_files_between # 增量审查
 )
 from api.services.llm_service import get_openai_code_review_general
+from api.services.concurrency_service import run_concurrently, get_per_job_concurrency
 from api.services.notification_service import send_notifications
 from api.services.common_service import get_final_summary_comment_text
-from .webhook_helpers import _save_review_results_and_log
+from api.services.review_prefilter import prefilter_general_file_items
+from api.services.review_debounce import get_review_debounce_seconds
+from .webhook_helpers import (
+    _submit_review_job, _save_review_results_and_log, _get_incremental_review_paths, _get_incremental_review_note,
+    _get_prefilter_note, _get_job_timeout_note
+)
+from api.services.job_context import is_job_timed_out
 
 logger = logging.getLogger(__name__)
 
 
-def _process_github_general_payload(access_token, owner, repo_name, pull_number, pr_data, head_sha, repo_full_name, pr_title, pr_html_url, repo_web_url, pr_source_branch, pr_target_branch):
+def _process_github_general_payload(access_token, owner, repo_name, pull_number, pr_data, head_sha, repo_full_name, pr_title, pr_html_url, repo_web_url, pr_source_branch, pr_target_branch, before_sha=None):
     """实际处理 GitHub 通用审查的核心逻辑。"""
+    summary_notes = []
+    previous_sha, changed_paths = _get_incremental_review_paths(
+        'github_general', repo_full_name, str(pull_number), head_sha, [before_sha],
+        lambda base_sha: get_github_changed_files_between(owner, repo_name, base_sha, head_sha, access_token)
+    )
+    prefilter_skipped = {}
+
+    def _select_files_to_review(file_items):
+        # 增量筛选和预过滤只依赖路径和 diff，在获取旧内容之前进行，被跳过的文件不再拉取内容
+        if changed_paths is not None:
+            total_files = len(file_items)
+            file_items = [item for item in file_items if item.get("file_path") in changed_paths]
+            logger.info(f"GitHub (通用审查): 增量审查将只处理 {len(file_items)}/{total_files} 个文件。")
+            summary_notes.append(_get_incremental_review_note(previous_sha, len(file_items), total_files))
+
+        # 锁定文件、生成的文件和第三方代码不发送给 LLM
+        file_items, skipped = prefilter_general_file_items(
+            file_items, (github_repo_configs.get(repo_full_name) or {}).get("prefilter"))
+        prefilter_skipped.update(skipped)
+        return file_items
+
     logger.info("GitHub (通用审查): 正在获取 PR 数据 (diffs 和文件内容)...")
-    file_data_list = get_github_pr_data_for_general_review(owner, repo_name, pull_number, access_token, pr_data)
+    file_data_list = get_github_pr_data_for_general_review(
+        owner, repo_name, pull_number, access_token, pr_data, file_filter=_select_files_to_review)
 
     if file_data_list is None:
         logger.warning("GitHub (通用审查): 获取 PR 数据失败。中止审查。")
         # 在异步任务中，通常会记录错误，可能不会直接返回 HTTP 响应
         return
+
+    summary_notes.append(_get_prefilter_note(prefilter_skipped))
+    review_metadata = {"prefilter_skipped": prefilter_skipped} if prefilter_skipped else None
+
     if not file_data_list:
-        logger.info("GitHub (通用审查): 未检测到文件变更或数据。无需审查。")
+        logger.info("GitHub (通用审查): 未检测到文件变更或数据 (或均被预过滤)。无需审查。")
         _save_review_results_and_log( # 保存空列表表示已处理且无内容
             vcs_type='github_general', identifier=repo_full_name, pr_mr_id=str(pull_number),
-            commit_sha=head_sha, review_json_string=json.dumps([])
+            commit_sha=head_sha, review_json_string=json.dumps([]), review_metadata=review_metadata
         )
+        if prefilter_skipped:
+            add_github_pr_general_comment(owner, repo_name, pull_number, access_token,
+                                          get_final_summary_comment_text(summary_notes))
         return
 
     aggregated_general_reviews_for_storage = []
     files_with_issues_details = [] # {file_path: str, issues_text: str}
 
-    logger.info(f'GitHub (通用审查): 将对 {len(file_data_list)} 个文件逐一发送给 {app_configs.get("OPENAI_MODEL", "gpt-4o")} 进行审查...')
+    logger.info(f'GitHub (通用审查): 将对 {len(file_data_list)} 个文件并发发送给 {app_configs.get("OPENAI_MODEL", "gpt-4o")} 进行审查...')
+    review_texts = run_concurrently(
+        get_openai_code_review_general, file_data_list,
+        max_workers=get_per_job_concurrency(), task_description="GitHub (通用审查)", default=""
+    )
+    summary_notes.append(_get_job_timeout_note())
 
-    for file_item in file_data_list:
+    # 按文件原始顺序处理审查结果，保证评论和存储结果的顺序稳定
+    for file_item, review_text_for_file in zip(file_data_list, review_texts):
         current_file_path = file_item.get("file_path", "Unknown File")
-        logger.info(f"GitHub (通用审查): 正在对文件 {current_file_path} 进行 LLM 审查...")
-        review_text_for_file = get_openai_code_review_general(file_item) # Pass single file_item
 
         logger.info(f"GitHub (通用审查): 文件 {current_file_path} 的 LLM 原始输出:\n{review_text_for_file}")
 
@@ -81,18 +122,21 @@ def _process_github_general_payload(access_token, owner, repo_name, pull_number,
             identifier=repo_full_name,
             pr_mr_id=str(pull_number),
             commit_sha=head_sha,
-            review_json_string=review_json_string_for_storage
+            review_json_string=review_json_string_for_storage,
+            review_metadata=review_metadata
         )
     else:
         logger.info("GitHub (通用审查): 所有被检查的文件均未发现问题。")
         no_issues_text = f"AI General Code Review 已完成，对 {len(file_data_list)} 个文件的检查均未发现主要问题或无审查建议。"
-        add_github_pr_general_comment(owner, repo_name, pull_number, access_token, no_issues_text)
+        if not is_job_timed_out():
+            add_github_pr_general_comment(owner, repo_name, pull_number, access_token, no_issues_text)
         _save_review_results_and_log(
             vcs_type='github_general',
             identifier=repo_full_name,
             pr_mr_id=str(pull_number),
             commit_sha=head_sha,
-            review_json_string=json.dumps([]) # Save empty list
+            review_json_string=json.dumps([]), # Save empty list
+            review_metadata=review_metadata
         )
 
     if app_configs.get("WECOM_BOT_WEBHOOK_URL"):
@@ -115,11 +159,11 @@ def _process_github_general_payload(access_token, owner, repo_name, pull_number,
         # send_to_wecom_bot(summary_content) # 旧调用
         send_notifications(summary_content) # 新调用
 
-    if head_sha:
+    if head_sha and not is_job_timed_out():
         mark_commit_as_processed('github_general', repo_full_name, str(pull_number), head_sha)
 
     # 添加最终总结评论
-    final_comment_text = get_final_summary_comment_text()
+    final_comment_text = get_final_summary_comment_text(summary_notes)
     add_github_pr_general_comment(owner, repo_name, pull_number, access_token, final_comment_text)
 
 
@@ -193,8 +237,11 @@ def github_webhook_general():
         return "提交已处理", 200
 
     # 调用提取出来的核心处理逻辑函数 (异步执行)
-    future = executor.submit(
+    _submit_review_job(
         _process_github_general_payload,
+        ('github_general', repo_full_name, str(pull_number), head_sha),
+        debounce_seconds=get_review_debounce_seconds(config),
+        event_time=pr_data.get('updated_at'),
         access_token=access_token,
         owner=owner,
         repo_name=repo_name,
@@ -206,9 +253,9 @@ def github_webhook_general():
         pr_html_url=pr_html_url,
         repo_web_url=repo_web_url,
         pr_source_branch=pr_source_branch,
-        pr_target_branch=pr_target_branch
+        pr_target_branch=pr_target_branch,
+        before_sha=payload_data.get('before') if action == 'synchronize' else None
     )
-    future.add_done_callback(handle_async_task_exception)
     
     logger.info(f"GitHub (通用审查): PR {repo_full_name}#{pull_number} 的处理任务已提交到后台执行。")
     return jsonify({"message": "GitHub General Webhook processing task accepted."}), 202
@@ -216,30 +263,65 @@ def github_webhook_general():
 
 def _process_gitlab_general_payload(access_token, project_id_str, mr_iid, mr_attrs, final_position_info, head_sha_payload, current_commit_sha_for_ops, project_name_from_payload, project_web_url, mr_title, mr_url):
     """实际处理 GitLab 通用审查的核心逻辑。"""
+    summary_notes = []
+    previous_sha, changed_paths = _get_incremental_review_paths(
+        'gitlab_general', project_id_str, str(mr_iid), current_commit_sha_for_ops,
+        [mr_attrs.get('oldrev')] + final_position_info.get("previous_head_shas", []),
+        lambda base_sha: get_gitlab_changed_files_between(project_id_str, base_sha, current_commit_sha_for_ops, access_token)
+    )
+    prefilter_skipped = {}
+
+    def _select_files_to_review(file_items):
+        # 增量筛选和预过滤只依赖路径和 diff，在获取旧内容之前进行，被跳过的文件不再拉取内容
+        if changed_paths is not None:
+            total_files = len(file_items)
+            file_items = [item for item in file_items if item.get("file_path") in changed_paths]
+            logger.info(f"GitLab (通用审查): 增量审查将只处理 {len(file_items)}/{total_files} 个文件。")
+            summary_notes.append(_get_incremental_review_note(previous_sha, len(file_items), total_files))
+
+        # 锁定文件、生成的文件和第三方代码不发送给 LLM
+        file_items, skipped = prefilter_general_file_items(
+            file_items, (gitlab_project_configs.get(project_id_str) or {}).get("prefilter"))
+        prefilter_skipped.update(skipped)
+        return file_items
+
     logger.info("GitLab (通用审查): 正在获取 MR 数据 (diffs 和文件内容)...")
-    file_data_list = get_gitlab_mr_data_for_general_review(project_id_str, mr_iid, access_token, mr_attrs, final_position_info)
+    file_data_list = get_gitlab_mr_data_for_general_review(
+        project_id_str, mr_iid, access_token, mr_attrs, final_position_info, file_filter=_select_files_to_review)
 
     if file_data_list is None:
         logger.warning("GitLab (通用审查): 获取 MR 数据失败。中止审查。")
         return
+
+    summary_notes.append(_get_prefilter_note(prefilter_skipped))
+    review_metadata = {"prefilter_skipped": prefilter_skipped} if prefilter_skipped else None
+
     if not file_data_list:
-        logger.info("GitLab (通用审查): 未检测到文件变更或数据。无需审查。")
+        logger.info("GitLab (通用审查): 未检测到文件变更或数据 (或均被预过滤)。无需审查。")
         _save_review_results_and_log( # 保存空列表表示已处理且无内容
             vcs_type='gitlab_general', identifier=project_id_str, pr_mr_id=str(mr_iid),
             commit_sha=current_commit_sha_for_ops, 
-            review_json_string=json.dumps([]), project_name_for_gitlab=project_name_from_payload
+            review_json_string=json.dumps([]), project_name_for_gitlab=project_name_from_payload,
+            review_metadata=review_metadata
         )
+        if prefilter_skipped:
+            add_gitlab_mr_general_comment(project_id_str, mr_iid, access_token,
+                                          get_final_summary_comment_text(summary_notes))
         return
 
     aggregated_general_reviews_for_storage = []
     files_with_issues_details = [] # {file_path: str, issues_text: str}
 
-    logger.info(f'GitLab (通用审查): 将对 {len(file_data_list)} 个文件逐一发送给 {app_configs.get("OPENAI_MODEL", "gpt-4o")} 进行审查...')
+    logger.info(f'GitLab (通用审查): 将对 {len(file_data_list)} 个文件并发发送给 {app_configs.get("OPENAI_MODEL", "gpt-4o")} 进行审查...')
+    review_texts = run_concurrently(
+        get_openai_code_review_general, file_data_list,
+        max_workers=get_per_job_concurrency(), task_description="GitLab (通用审查)", default=""
+    )
+    summary_notes.append(_get_job_timeout_note())
 
-    for file_item in file_data_list:
+    # 按文件原始顺序处理审查结果，保证评论和存储结果的顺序稳定
+    for file_item, review_text_for_file in zip(file_data_list, review_texts):
         current_file_path = file_item.get("file_path", "Unknown File")
-        logger.info(f"GitLab (通用审查): 正在对文件 {current_file_path} 进行 LLM 审查...")
-        review_text_for_file = get_openai_code_review_general(file_item)
 
         logger.info(f"GitLab (通用审查): 文件 {current_file_path} 的 LLM 原始输出:\n{review_text_for_file}")
 
@@ -276,19 +358,22 @@ def _process_gitlab_general_payload(access_token, project_id_str, mr_iid, mr_att
             pr_mr_id=str(mr_iid),
             commit_sha=current_commit_sha_for_ops,
             review_json_string=review_json_string_for_storage,
-            project_name_for_gitlab=project_name_from_payload
+            project_name_for_gitlab=project_name_from_payload,
+            review_metadata=review_metadata
         )
     else:
         logger.info("GitLab (通用审查): 所有被检查的文件均未发现问题。")
         no_issues_text = f"AI General Code Review 已完成，对 {len(file_data_list)} 个文件的检查均未发现主要问题或无审查建议。"
-        add_gitlab_mr_general_comment(project_id_str, mr_iid, access_token, no_issues_text)
+        if not is_job_timed_out():
+            add_gitlab_mr_general_comment(project_id_str, mr_iid, access_token, no_issues_text)
         _save_review_results_and_log(
             vcs_type='gitlab_general',
             identifier=project_id_str,
             pr_mr_id=str(mr_iid),
             commit_sha=current_commit_sha_for_ops,
             review_json_string=json.dumps([]), # Save empty list
-            project_name_for_gitlab=project_name_from_payload
+            project_name_for_gitlab=project_name_from_payload,
+            review_metadata=review_metadata
         )
 
     if app_configs.get("WECOM_BOT_WEBHOOK_URL"):
@@ -312,11 +397,11 @@ def _process_gitlab_general_payload(access_token, project_id_str, mr_iid, mr_att
 """
         send_notifications(summary_content)
 
-    if current_commit_sha_for_ops:
+    if current_commit_sha_for_ops and not is_job_timed_out():
         mark_commit_as_processed('gitlab_general', project_id_str, str(mr_iid), current_commit_sha_for_ops)
 
     # 添加最终总结评论
-    final_comment_text = get_final_summary_comment_text()
+    final_comment_text = get_final_summary_comment_text(summary_notes)
     add_gitlab_mr_general_comment(project_id_str, mr_iid, access_token, final_comment_text)
 
 
@@ -394,6 +479,7 @@ def gitlab_webhook_general():
         final_position_info["base_commit_sha"] = version_derived_position_info.get("base_sha", temp_position_info["base_commit_sha"])
         final_position_info["head_commit_sha"] = version_derived_position_info.get("head_sha", temp_position_info["head_commit_sha"])
         final_position_info["latest_version_id"] = version_derived_position_info.get("id")
+        final_position_info["previous_head_shas"] = version_derived_position_info.get("previous_head_shas", [])
 
     if not final_position_info.get("base_commit_sha") or not final_position_info.get("head_commit_sha"):
          logger.error(f"GitLab (通用审查) MR {project_id_str}#{mr_iid}: 无法确定 base_sha 或 head_sha。中止。")
@@ -402,8 +488,11 @@ def gitlab_webhook_general():
     current_commit_sha_for_ops = final_position_info.get("head_commit_sha", head_sha_payload)
 
     # 调用提取出来的核心处理逻辑函数 (异步执行)
-    future = executor.submit(
+    _submit_review_job(
         _process_gitlab_general_payload,
+        ('gitlab_general', project_id_str, str(mr_iid), current_commit_sha_for_ops),
+        debounce_seconds=get_review_debounce_seconds(config),
+        event_time=mr_attrs.get('updated_at'),
         access_token=access_token,
         project_id_str=project_id_str,
         mr_iid=mr_iid,
@@ -416,7 +505,6 @@ def gitlab_webhook_general():
         mr_title=mr_title,
         mr_url=mr_url
     )
-    future.add_done_callback(handle_async_task_exception)
 
     logger.info(f"GitLab (通用审查): MR {project_id_str}#{mr_iid} 的处理任务已提交到后台执行。")
     return jsonify({"message": "GitLab General Webhook processing task accepted."}), 202
@@ -3,9 +3,14 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-def get_final_summary_comment_text() -> str:
+def get_final_summary_comment_text(extra_notes: list = None) -> str:
     """
     生成通用的最终总结评论文本。
+    extra_notes 为可选的附加说明 (例如增量审查范围)，每条单独成段追加在末尾。
     """
     model_name = app_configs.get("OPENAI_MODEL", "gpt-4o")
-    return f"本次AI代码审查已完成，审核模型:「{model_name}」 修改意见仅供参考，具体修改请根据实际场景进行调整。"
+    text = f"本次AI代码审查已完成，审核模型:「{model_name}」 修改意见仅供参考，具体修改请根据实际场景进行调整。"
+    for note in extra_notes or []:
+        if note:
+            text += f"\n\n{note}"
+    return text
@@ -0,0 +1,141 @@
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from api.core_config import get_int_config
+
+logger = logging.getLogger(__name__)
+
+
+class ReviewJobAborted(Exception):
+    """
+    需要中止整个审查任务的异常 (例如 LLM 端点熔断)。
+    与单个文件的审查错误不同，它不会被 run_concurrently 或各审查函数吞掉，而是一直传播到任务入口。
+    """
+
+
+class ReviewJobCancelled(ReviewJobAborted):
+    """审查任务已被取消 (见 job_context)，不再继续任何阶段，也不发表结果。"""
+
+
+class ReviewJobDeadlineExceeded(Exception):
+    """
+    审查任务已超过截止时间 (见 job_context)，当前阶段的工作被放弃。
+    与 ReviewJobAborted 不同，它只放弃尚未完成的文件：run_concurrently 把它转换为该项的默认结果，
+    已完成的审查结果仍会被汇总和发表。
+    """
+
+
+class _GlobalLLMLimiter:
+    """
+    全局 LLM 请求并发限制器。
+    上限在每次获取时从 app_configs 读取，因此通过 /config/global_settings 修改后无需重启即可生效。
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._active = 0
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= max(1, get_int_config("LLM_MAX_CONCURRENT_REQUESTS", 10)):
+                # 带超时等待，以便上限被调大时等待中的线程能及时感知
+                self._condition.wait(timeout=1.0)
+            self._active += 1
+
+    def try_acquire(self) -> bool:
+        """不等待地占用一个名额；已达上限时返回 False。"""
+        with self._condition:
+            if self._active >= max(1, get_int_config("LLM_MAX_CONCURRENT_REQUESTS", 10)):
+                return False
+            self._active += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+
+_global_llm_limiter = _GlobalLLMLimiter()
+
+
+@contextmanager
+def llm_call_slot():
+    """占用一个全局 LLM 请求名额，退出时释放。所有实际发往 LLM 的请求都应在此上下文中执行。"""
+    _global_llm_limiter.acquire()
+    try:
+        yield
+    finally:
+        _global_llm_limiter.release()
+
+
+def try_acquire_llm_call_slot() -> bool:
+    """
+    不等待地占用一个全局 LLM 请求名额，用于可以放弃的额外请求 (如对冲请求)。
+    返回 True 时调用方必须在请求结束后调用 release_llm_call_slot。
+    """
+    return _global_llm_limiter.try_acquire()
+
+
+def release_llm_call_slot():
+    """释放 try_acquire_llm_call_slot 占用的名额。"""
+    _global_llm_limiter.release()
+
+
+def get_per_job_concurrency() -> int:
+    """获取单个审查任务内允许并发审查的文件数。"""
+    return max(1, get_int_config("LLM_MAX_CONCURRENT_FILES_PER_JOB", 5))
+
+
+def run_concurrently(func, items, max_workers: int, task_description: str, default=None):
+    """
+    以有界并发对 items 中的每一项执行 func，并按输入顺序返回结果列表。
+
+    :param func: 接收单个 item 的可调用对象。
+    :param items: 待处理的项目序列。
+    :param max_workers: 本次扇出的最大并发数。
+    :param task_description: 用于日志的任务描述。
+    :param default: 某一项执行出错或因任务超时被放弃时使用的结果值。
+    :return: 与 items 一一对应的结果列表。
+    :raises ReviewJobAborted: 任一项抛出 ReviewJobAborted 时，取消尚未开始的项并重新抛出。
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def _safe_call(index, item):
+        try:
+            return func(item)
+        except ReviewJobAborted:
+            raise
+        except ReviewJobDeadlineExceeded as e:
+            logger.warning(f"{task_description}: 第 {index + 1}/{len(items)} 项因任务超时被放弃: {e}")
+            return default
+        except Exception:
+            logger.exception(f"{task_description}: 第 {index + 1}/{len(items)} 项处理时出错:")
+            return default
+
+    workers = max(1, min(max_workers, len(items)))
+    if workers == 1:
+        return [_safe_call(i, item) for i, item in enumerate(items)]
+
+    logger.info(f"{task_description}: 以 {workers} 个并发处理 {len(items)} 项。")
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="review-fanout")
+    try:
+        # 为每个任务复制当前上下文，使任务级的 contextvars 在工作线程中同样可见
+        futures = [
+            pool.submit(contextvars.copy_context().run, _safe_call, i, item)
+            for i, item in enumerate(items)
+        ]
+        return [future.result() for future in futures]
+    except ReviewJobAborted:
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    finally:
+        pool.shutdown(wait=True)
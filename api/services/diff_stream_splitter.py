@@ -0,0 +1,140 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_DIFF_GIT_HEADER = "diff --git "
+_DIFF_GIT_PATHS_PATTERN = re.compile(r'^diff --git a/(.+) b/(.+)$')
+
+FILE_STATUS_ADDED = "added"
+FILE_STATUS_REMOVED = "removed"
+FILE_STATUS_RENAMED = "renamed"
+FILE_STATUS_COPIED = "copied"
+FILE_STATUS_MODIFIED = "modified"
+
+
+def _unquote_git_path(path: str) -> str:
+    """还原 git 对含特殊字符的路径所做的引号与 C 风格转义 (如 "a/\\344\\270\\255.py")。"""
+    if len(path) < 2 or not (path.startswith('"') and path.endswith('"')):
+        return path
+    try:
+        return path[1:-1].encode('latin-1', 'backslashreplace').decode('unicode_escape').encode('latin-1').decode('utf-8')
+    except (UnicodeDecodeError, UnicodeEncodeError):
+        logger.warning(f"无法还原 diff 中带引号的路径: {path}")
+        return path[1:-1]
+
+
+def _strip_side_prefix(path: str, prefix: str):
+    path = _unquote_git_path(path.split('\t', 1)[0])
+    if path == "/dev/null":
+        return None
+    return path[len(prefix):] if path.startswith(prefix) else path
+
+
+class UnifiedDiffSplitter:
+    """
+    把整个 PR/MR 的 git 格式 unified diff (如 GitHub 的 application/vnd.github.v3.diff、GitLab 的 raw_diffs)
+    按文件增量切分。每当下一个文件的 "diff --git" 标头到达，上一个文件的 diff 即完整并被返回，
+    无需等待整个响应下载完毕；只保留当前文件的文本。
+
+    每个文件返回一个字典: old_path、new_path (新增文件的 old_path / 删除文件的 new_path 为 None)、
+    status (added/removed/renamed/copied/modified)、is_binary，以及从第一个 "@@" 开始的 diff_text
+    (与 GitHub files API 的 patch 字段相同，可直接传给 parse_single_file_diff)。
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._current = None
+        self._in_hunks = False
+
+    def feed(self, chunk) -> list:
+        """输入响应的新片段 (bytes 或 str)，返回本次已完整的文件 diff 列表。"""
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        self._buffer += chunk
+        *complete_lines, self._buffer = self._buffer.split(b"\n")
+        completed_files = []
+        for raw_line in complete_lines:
+            completed_file = self._feed_line(raw_line.decode('utf-8', errors='replace'))
+            if completed_file is not None:
+                completed_files.append(completed_file)
+        return completed_files
+
+    def close(self) -> list:
+        """输入结束，返回剩余的 (最后一个) 文件 diff。"""
+        completed_files = []
+        if self._buffer:
+            completed_file = self._feed_line(self._buffer.decode('utf-8', errors='replace'))
+            self._buffer = b""
+            if completed_file is not None:
+                completed_files.append(completed_file)
+        if self._current is not None:
+            completed_files.append(self._finish_current())
+        return completed_files
+
+    def _feed_line(self, line: str):
+        # hunk 内容行都以 ' '、'+'、'-' 或 '\' 开头，因此 "diff --git " 一定是下一个文件的开始
+        if line.startswith(_DIFF_GIT_HEADER):
+            completed_file = self._finish_current() if self._current is not None else None
+            self._start_file(line)
+            return completed_file
+        if self._current is None:
+            return None
+        if self._in_hunks:
+            self._current["lines"].append(line)
+        elif line.startswith("@@"):
+            self._in_hunks = True
+            self._current["lines"].append(line)
+        else:
+            self._parse_extended_header(line)
+        return None
+
+    def _start_file(self, header_line: str):
+        old_path = new_path = None
+        match = _DIFF_GIT_PATHS_PATTERN.match(header_line)
+        if match and match.group(1) == match.group(2):  # 路径含 " b/" 时标头有歧义，交由 ---/+++ 或 rename 行确定
+            old_path = new_path = match.group(1)
+        self._current = {"old_path": old_path, "new_path": new_path, "status": FILE_STATUS_MODIFIED,
+                         "is_binary": False, "lines": []}
+        self._in_hunks = False
+
+    def _parse_extended_header(self, line: str):
+        current = self._current
+        if line.startswith("new file mode"):
+            current["status"] = FILE_STATUS_ADDED
+        elif line.startswith("deleted file mode"):
+            current["status"] = FILE_STATUS_REMOVED
+        elif line.startswith("rename from "):
+            current["status"], current["old_path"] = FILE_STATUS_RENAMED, _unquote_git_path(line[len("rename from "):])
+        elif line.startswith("rename to "):
+            current["new_path"] = _unquote_git_path(line[len("rename to "):])
+        elif line.startswith("copy from "):
+            current["status"], current["old_path"] = FILE_STATUS_COPIED, _unquote_git_path(line[len("copy from "):])
+        elif line.startswith("copy to "):
+            current["new_path"] = _unquote_git_path(line[len("copy to "):])
+        elif line.startswith("--- "):
+            current["old_path"] = _strip_side_prefix(line[4:], "a/")
+        elif line.startswith("+++ "):
+            current["new_path"] = _strip_side_prefix(line[4:], "b/")
+        elif line.startswith("Binary files ") or line.startswith("GIT binary patch"):
+            current["is_binary"] = True
+
+    def _finish_current(self) -> dict:
+        current = self._current
+        self._current = None
+        self._in_hunks = False
+        if current["status"] == FILE_STATUS_ADDED:
+            current["old_path"] = None
+        elif current["status"] == FILE_STATUS_REMOVED:
+            current["new_path"] = None
+        lines = current.pop("lines")
+        current["diff_text"] = "\n".join(lines) + "\n" if lines else ""
+        return current
+
+
+def iter_file_diffs(chunks):
+    """逐个产出 chunks (响应片段的可迭代对象) 中各文件的 diff，格式见 UnifiedDiffSplitter。"""
+    splitter = UnifiedDiffSplitter()
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.close()
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import zlib
+from collections import OrderedDict
+import redis
+import api.core_config as core_config_module
+from api.core_config import REDIS_FILE_CONTENT_CACHE_KEY_PREFIX, get_bool_config, get_int_config
+
+logger = logging.getLogger(__name__)
+
+# 只缓存以完整提交 SHA 指定版本的文件内容：内容不可变，条目无需失效
+_IMMUTABLE_REF_PATTERN = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+
+
+class _ByteBoundedLRU:
+    """按内容字节数限制总大小的进程内 LRU 缓存 (线程安全)。"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, content: str, max_bytes: int):
+        size = len(content.encode('utf-8'))
+        if size > max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[1]
+            self._entries[key] = (content, size)
+            self._total_bytes += size
+            while self._total_bytes > max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+    def get_usage(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._total_bytes}
+
+
+_memory_cache = _ByteBoundedLRU()
+_stats_lock = threading.Lock()
+_stats = {"memory_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0}
+
+
+def _count(field: str):
+    with _stats_lock:
+        _stats[field] += 1
+
+
+def _build_cache_key(repo_key: str, ref_sha: str, path: str) -> str:
+    payload = json.dumps([repo_key, ref_sha, path], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _is_cacheable(ref_sha: str) -> bool:
+    return bool(ref_sha) and bool(_IMMUTABLE_REF_PATTERN.match(ref_sha.lower())) and \
+        get_bool_config("FILE_CONTENT_CACHE_ENABLED", True)
+
+
+def _get_memory_limit_bytes() -> int:
+    return max(0, get_int_config("FILE_CONTENT_CACHE_MEMORY_MB", 64)) * 1024 * 1024
+
+
+def get_cached_file_content(repo_key: str, ref_sha: str, path: str):
+    """
+    查找文件在指定提交中的内容：先查进程内 LRU，再查 Redis (命中后回填进程内缓存)。
+    repo_key 应唯一标识仓库 (含平台与实例地址)。未命中、ref 不是完整 SHA 或缓存不可用时返回 None。
+    """
+    if not _is_cacheable(ref_sha):
+        return None
+    cache_key = _build_cache_key(repo_key, ref_sha, path)
+    content = _memory_cache.get(cache_key)
+    if content is not None:
+        _count("memory_hits")
+        return content
+
+    redis_client = core_config_module.redis_client
+    if redis_client is not None:
+        try:
+            compressed = redis_client.get(f"{REDIS_FILE_CONTENT_CACHE_KEY_PREFIX}{cache_key}")
+            if compressed is not None:
+                content = zlib.decompress(compressed).decode('utf-8')
+        except (redis.exceptions.RedisError, zlib.error, UnicodeDecodeError) as e:
+            logger.error(f"读取文件内容缓存时出错 ({path}@{ref_sha[:7]}): {e}")
+    if content is None:
+        _count("misses")
+        return None
+    _count("redis_hits")
+    _memory_cache.put(cache_key, content, _get_memory_limit_bytes())
+    return content
+
+
+def store_cached_file_content(repo_key: str, ref_sha: str, path: str, content: str):
+    """把文件在指定提交中的内容写入进程内 LRU 和 Redis (zlib 压缩，FILE_CONTENT_CACHE_TTL_SECONDS 后过期)。"""
+    if content is None or not _is_cacheable(ref_sha):
+        return
+    cache_key = _build_cache_key(repo_key, ref_sha, path)
+    _memory_cache.put(cache_key, content, _get_memory_limit_bytes())
+    _count("stores")
+    redis_client = core_config_module.redis_client
+    if redis_client is None:
+        return
+    ttl_seconds = max(1, get_int_config("FILE_CONTENT_CACHE_TTL_SECONDS", 60 * 60 * 24 * 7))
+    try:
+        redis_client.set(f"{REDIS_FILE_CONTENT_CACHE_KEY_PREFIX}{cache_key}",
+                         zlib.compress(content.encode('utf-8')), ex=ttl_seconds)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"写入文件内容缓存时出错 ({path}@{ref_sha[:7]}): {e}")
+
+
+def get_file_content_cache_stats() -> dict:
+    """返回当前进程的文件内容缓存统计：进程内/Redis 命中数、未命中数、写入数及进程内缓存占用。"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["enabled"] = get_bool_config("FILE_CONTENT_CACHE_ENABLED", True)
+    stats["memory"] = _memory_cache.get_usage()
+    lookups = stats["memory_hits"] + stats["redis_hits"] + stats["misses"]
+    stats["hit_rate"] = round((stats["memory_hits"] + stats["redis_hits"]) / lookups, 4) if lookups else None
+    return stats
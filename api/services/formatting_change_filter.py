@@ -0,0 +1,165 @@
+import ast
+import io
+import logging
+import os
+import re
+import textwrap
+import tokenize
+from api.utils import _group_changes_into_blocks, parse_single_file_diff
+
+logger = logging.getLogger(__name__)
+
+# 空白不影响语义的语言：比较时折叠行内空白、去掉标点两侧的空白和换行展开产生的尾随逗号。
+# 这些语言中换行仍可能有语义 (JS/Go/Kotlin/Swift 的自动分号插入、"//" 注释到行尾为止)，
+# 因此只有圆括号/方括号内的换行视为空白，其余换行作为记号保留 (仅忽略空行)。
+# CSS/SCSS/LESS 中空白本身有语义 (如后代选择器 ".a .b" 与 ".a.b")，不在此列。
+WHITESPACE_INSENSITIVE_EXTENSIONS = {
+    ".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".java", ".go", ".c", ".h", ".cc", ".cpp", ".cxx", ".hpp",
+    ".cs", ".rs", ".kt", ".kts", ".swift", ".scala", ".php", ".dart", ".json",
+}
+PYTHON_EXTENSIONS = {".py", ".pyi"}
+
+# 字符串字面量和 "//" 行注释在规范化时保持原样 (其中的空白有语义)；单独匹配换行以便按括号深度处理
+_LITERAL_OR_NEWLINE_PATTERN = re.compile(
+    r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|`(?:[^`\\]|\\.)*`|//[^\n]*|\n'
+)
+
+# 相邻时可能组成其他运算符的字符 (如 "&&"、"--"、"=>")
+_OPERATOR_CHARS = "+-*/%&|<>=!^~?:."
+_PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+
+
+def _normalize_code_segment(segment: str) -> str:
+    segment = re.sub(r',\s*(?=[)\]])', '', segment)  # 换行展开时添加的尾随逗号
+    segment = re.sub(r'[^\S\n]+', ' ', segment)
+    segment = re.sub(r'\s*\n\s*', '\n', segment)  # 保留换行记号，忽略空行及其两侧空白
+
+    normalized = ""
+    for index, part in enumerate(segment.split(" ")):
+        if index:
+            before, after = normalized[-1:], part[:1]
+            # 标点两侧的空格可以去掉，但两个运算符字符之间的空格有意义 ("a & &b" 与 "a&&b"、"x - -y" 与 "x--y" 含义不同)
+            next_to_punctuation = bool(_PUNCTUATION_PATTERN.match(before) or _PUNCTUATION_PATTERN.match(after))
+            between_operators = bool(before and after) and before in _OPERATOR_CHARS and after in _OPERATOR_CHARS
+            if not next_to_punctuation or between_operators:
+                normalized += " "
+        normalized += part
+    return normalized
+
+
+def _normalize_whitespace_insensitive(lines: list) -> str:
+    text = "\n".join(lines)
+    normalized_parts = []
+    code_parts = []
+    depth = 0
+    last_end = 0
+    for match in _LITERAL_OR_NEWLINE_PATTERN.finditer(text):
+        code = text[last_end:match.start()]
+        depth = max(0, depth + code.count("(") + code.count("[") - code.count(")") - code.count("]"))
+        code_parts.append(code)
+        token = match.group(0)
+        last_end = match.end()
+        if token == "\n":
+            # 括号内的换行不会触发自动分号插入，可视为空白
+            code_parts.append(" " if depth else "\n")
+            continue
+        normalized_parts.append(_normalize_code_segment("".join(code_parts)))
+        code_parts = []
+        if token.startswith("//"):
+            normalized_parts.append(token.rstrip() + "\n")  # 行注释必须在行尾结束
+        else:
+            normalized_parts.append(token)
+    code_parts.append(text[last_end:])
+    normalized_parts.append(_normalize_code_segment("".join(code_parts)))
+    return re.sub(r'\n+', '\n', "".join(normalized_parts)).strip()
+
+
+def _normalize_lines(lines: list) -> list:
+    """只忽略行尾空白和空行 (适用于空白可能有语义的文件，如 YAML、Makefile)。"""
+    return [line.rstrip() for line in lines if line.strip()]
+
+
+def _leading_indent(lines: list) -> int:
+    indents = [len(line) - len(line.lstrip()) for line in lines if line.strip()]
+    return min(indents) if indents else 0
+
+
+def _parse_python_fragment(source: str):
+    """解析 (去除公共缩进后的) 代码片段。片段以 ":" 结尾 (如单独修改的 def/if 行) 时补一个 pass 再试。"""
+    source = textwrap.dedent(source)
+    try:
+        return ast.parse(source)
+    except (SyntaxError, ValueError):
+        pass
+    if source.rstrip().endswith(":"):
+        try:
+            return ast.parse(source.rstrip() + "\n    pass")
+        except (SyntaxError, ValueError):
+            return None
+    return None
+
+
+def _python_comments(source: str) -> list:
+    try:
+        tokens = tokenize.generate_tokens(io.StringIO(textwrap.dedent(source)).readline)
+        return [" ".join(tok.string.split()) for tok in tokens if tok.type == tokenize.COMMENT]
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return None
+
+
+def _is_python_equivalent(removed_lines: list, added_lines: list):
+    """通过 AST (以及注释) 比较 Python 代码片段。片段无法解析时返回 None。"""
+    if _leading_indent(removed_lines) != _leading_indent(added_lines):
+        return False  # 缩进层级变化会改变语句所属的代码块
+    removed_source, added_source = "\n".join(removed_lines), "\n".join(added_lines)
+    removed_tree, added_tree = _parse_python_fragment(removed_source), _parse_python_fragment(added_source)
+    if removed_tree is None or added_tree is None:
+        return None
+    if ast.dump(removed_tree) != ast.dump(added_tree):
+        return False
+    removed_comments, added_comments = _python_comments(removed_source), _python_comments(added_source)
+    return removed_comments is not None and removed_comments == added_comments
+
+
+def is_formatting_only_block(file_path: str, removed_lines: list, added_lines: list) -> bool:
+    """判断一个连续变更块的删除行与新增行在格式规范化后是否等价。"""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in PYTHON_EXTENSIONS:
+        equivalent = _is_python_equivalent(removed_lines, added_lines)
+        if equivalent is not None:
+            return equivalent
+    elif extension in WHITESPACE_INSENSITIVE_EXTENSIONS:
+        return _normalize_whitespace_insensitive(removed_lines) == _normalize_whitespace_insensitive(added_lines)
+    return _normalize_lines(removed_lines) == _normalize_lines(added_lines)
+
+
+def strip_formatting_only_changes(file_path: str, file_data: dict):
+    """
+    去除 parse_single_file_diff 结果中仅有格式变化的变更块。
+    返回 (去除后的 file_data, 去除的变更块数)；所有变更块都只是格式变化时 file_data 为 None。
+    没有可去除的变更块时返回原对象。
+    """
+    blocks = _group_changes_into_blocks((file_data or {}).get("changes", []))
+    kept_changes = []
+    dropped_blocks = 0
+    for block in blocks:
+        removed_lines = [c.get("content") or "" for c in block if c.get("type") == "delete"]
+        added_lines = [c.get("content") or "" for c in block if c.get("type") == "add"]
+        if is_formatting_only_block(file_path, removed_lines, added_lines):
+            dropped_blocks += 1
+        else:
+            kept_changes.extend(block)
+    if not dropped_blocks:
+        return file_data, 0
+    if not kept_changes:
+        return None, dropped_blocks
+    return dict(file_data, changes=kept_changes, lines_changed=len(kept_changes)), dropped_blocks
+
+
+def is_formatting_only_diff(file_path: str, diff_text: str) -> bool:
+    """判断单个文件的 unified diff 是否只包含格式变化 (用于通用审查的文件列表)。"""
+    file_data = parse_single_file_diff(diff_text or "", file_path)
+    if not file_data["changes"]:
+        return False
+    stripped_file_data, _ = strip_formatting_only_changes(file_path, file_data)
+    return stripped_file_data is None
@@ -0,0 +1,93 @@
+import logging
+import threading
+from contextlib import contextmanager
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from api.core_config import get_int_config
+
+logger = logging.getLogger(__name__)
+
+_sessions = {}
+_host_semaphores = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _create_session(host_key: str) -> requests.Session:
+    pool_maxsize = max(1, get_int_config("HTTP_POOL_MAXSIZE", 20))
+    session = requests.Session()
+    # Session 由所有租户、令牌和任务共享，拒绝保存任何 Set-Cookie (如 GitLab 会话或代理的 Cookie)，避免在其他令牌的请求中被带上
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    # pool_connections 为缓存的连接池 (主机) 数，重定向到其他主机 (如 GitHub 的下载地址) 时也能复用连接
+    adapter = HTTPAdapter(pool_connections=max(1, get_int_config("HTTP_POOL_CONNECTIONS", 10)), pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    logger.info(f"为 {host_key} 创建 HTTP 连接池 (每主机最多保持 {pool_maxsize} 个连接)。")
+    return session
+
+
+def get_http_session(url: str) -> requests.Session:
+    """
+    返回 url 所在主机共享的 requests.Session (keep-alive 连接池，线程安全地按主机懒创建)。
+    对 GitHub/GitLab/通知 Webhook 的请求应使用它，而不是 requests.get/post，避免每次请求都重新进行 TCP 和 TLS 握手。
+    Session 不保存服务端返回的 Cookie (共享的 Session 不能在不同令牌的请求之间传递 Cookie)。
+    连接池大小 (HTTP_POOL_MAXSIZE / HTTP_POOL_CONNECTIONS) 在首次创建该主机的 Session 时读取。
+    """
+    host_key = _get_host_key(url)
+    session = _sessions.get(host_key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host_key)
+            if session is None:
+                session = _create_session(host_key)
+                _sessions[host_key] = session
+    return session
+
+
+@contextmanager
+def http_host_slot(url: str):
+    """
+    占用 url 所在主机的一个并发请求名额 (进程内所有任务共享)，退出时释放。
+    用于并发批量请求 (如拉取文件内容)，避免单个主机同时承受过多请求而触发限流。
+    每主机名额数 (HTTP_MAX_CONCURRENT_PER_HOST) 在首次访问该主机时读取。
+    """
+    host_key = _get_host_key(url)
+    with _sessions_lock:
+        semaphore = _host_semaphores.get(host_key)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(max(1, get_int_config("HTTP_MAX_CONCURRENT_PER_HOST", 8)))
+            _host_semaphores[host_key] = semaphore
+    with semaphore:
+        yield
+
+
+def get_http_pool_stats() -> dict:
+    """
+    返回各主机连接池的统计 (当前进程)：请求数、新建连接数及复用率。
+    新建连接数 (connections_opened) 远小于请求数说明 keep-alive 生效；接近请求数说明连接池过小或服务端关闭了连接。
+    """
+    with _sessions_lock:
+        sessions = list(_sessions.items())
+    stats = {}
+    for host_key, session in sessions:
+        for adapter in set(session.adapters.values()):
+            pool_manager = adapter.poolmanager
+            for pool_key in list(pool_manager.pools.keys()):
+                pool = pool_manager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                pool_host = f"{pool.scheme}://{pool.host}:{pool.port}"
+                entry = stats.setdefault(pool_host, {"requests": 0, "connections_opened": 0})
+                entry["requests"] += pool.num_requests
+                entry["connections_opened"] += pool.num_connections
+    for entry in stats.values():
+        reused = max(0, entry["requests"] - entry["connections_opened"])
+        entry["reused"] = reused
+        entry["reuse_ratio"] = round(reused / entry["requests"], 3) if entry["requests"] else 0.0
+    return stats
@@ -0,0 +1,178 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from .concurrency_service import ReviewJobCancelled, ReviewJobDeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+
+class ReviewJobContext:
+    """
+    单个审查任务的上下文：截止时间 + 取消令牌。
+    拉取变更、LLM 请求和发表评论等阶段在开始前调用 check() (通常经由 check_job_active)：
+    任务被取消时抛出 ReviewJobCancelled，超过截止时间时记录被放弃的阶段并抛出 ReviewJobDeadlineExceeded。
+    """
+
+    def __init__(self, description: str, timeout_seconds: float = None, previously_posted_comments=None):
+        self.description = description
+        # 同一任务之前被中止的运行 (如因 LLM 熔断重新排队) 已发表评论的位置，本次运行不再重复发表
+        self.previously_posted_comments = frozenset(previously_posted_comments or ())
+        self._posted_comments = set()
+        self.deadline = time.monotonic() + timeout_seconds if timeout_seconds and timeout_seconds > 0 else None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        self.cancel_reason = None
+        self._abandoned_stages = []
+        self._budget_usage = {}
+        self._cancellation_probe = None
+        self._probe_interval_seconds = 0.0
+        self._next_probe_time = 0.0
+
+    def get_remaining_seconds(self):
+        """距截止时间的剩余秒数；未设置截止时间时返回 None。"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        remaining = self.get_remaining_seconds()
+        return remaining is not None and remaining <= 0
+
+    @property
+    def cancelled(self) -> bool:
+        self._poll_cancellation_probe()
+        return self._cancel_event.is_set()
+
+    @property
+    def timed_out(self) -> bool:
+        """是否有阶段因超过截止时间而被放弃 (即结果不完整)。"""
+        with self._lock:
+            return bool(self._abandoned_stages)
+
+    @property
+    def abandoned_stages(self) -> list:
+        with self._lock:
+            return list(self._abandoned_stages)
+
+    def try_consume_budget(self, budget_name: str, limit: int) -> bool:
+        """从任务级的计数预算 (如对冲请求次数) 中消耗一次；已用满 limit 次时返回 False。"""
+        with self._lock:
+            used = self._budget_usage.get(budget_name, 0)
+            if used >= limit:
+                return False
+            self._budget_usage[budget_name] = used + 1
+            return True
+
+    def record_posted_comment(self, comment_key: str):
+        """记录本次运行已发表评论的位置 (见 ReviewCommentPoster)。"""
+        with self._lock:
+            self._posted_comments.add(comment_key)
+
+    @property
+    def posted_comments(self) -> frozenset:
+        """本次及之前被中止的运行已发表评论的位置，任务重新排队时传给下一次运行。"""
+        with self._lock:
+            return self.previously_posted_comments | self._posted_comments
+
+    def set_cancellation_probe(self, probe, interval_seconds: float):
+        """
+        设置外部取消检查 (如任务是否已被新提交取代，见 review_job_registry)。
+        probe 返回取消原因字符串或 None，在 check() 时调用，两次调用至少间隔 interval_seconds。
+        """
+        self._cancellation_probe = probe
+        self._probe_interval_seconds = interval_seconds
+        self._next_probe_time = 0.0
+
+    def _poll_cancellation_probe(self):
+        if self._cancellation_probe is None or self._cancel_event.is_set():
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_probe_time:
+                return
+            self._next_probe_time = now + self._probe_interval_seconds
+        try:
+            reason = self._cancellation_probe()
+        except Exception:
+            logger.exception(f"审查任务 {self.description} 的取消检查出错:")
+            return
+        if reason:
+            self.cancel(reason)
+
+    def cancel(self, reason: str):
+        """取消任务。可在任意线程中调用，正在进行的阶段会在下一次 check() 时停止。"""
+        if not self._cancel_event.is_set():
+            self.cancel_reason = reason
+            self._cancel_event.set()
+            logger.info(f"审查任务 {self.description} 已被取消: {reason}")
+
+    def check(self, stage_description: str, allow_expired: bool = False):
+        """
+        在开始一个阶段前检查任务状态。
+        :param allow_expired: 为 True 时只检查取消 (用于超时后仍需发表部分结果的阶段，如发表评论)。
+        :raises ReviewJobCancelled: 任务已被取消。
+        :raises ReviewJobDeadlineExceeded: 任务已超过截止时间。
+        """
+        if self.cancelled:
+            raise ReviewJobCancelled(f"审查任务 {self.description} 已被取消 ({self.cancel_reason})，停止 {stage_description}。")
+        if not allow_expired and self.expired:
+            with self._lock:
+                if stage_description not in self._abandoned_stages:
+                    self._abandoned_stages.append(stage_description)
+            raise ReviewJobDeadlineExceeded(f"审查任务 {self.description} 已超过截止时间，放弃 {stage_description}。")
+
+
+_current_job = contextvars.ContextVar("review_job_context", default=None)
+
+
+@contextmanager
+def review_job_context(description: str, timeout_seconds: float = None, previously_posted_comments=None):
+    """
+    在当前上下文 (及通过 contextvars 传播到的扇出线程) 中设置审查任务上下文并返回它。
+    timeout_seconds <= 0 或为 None 表示不限制时间。
+    previously_posted_comments 为同一任务之前被中止的运行已发表评论的位置 (见 ReviewJobContext.posted_comments)。
+    """
+    job = ReviewJobContext(description, timeout_seconds, previously_posted_comments)
+    token = _current_job.set(job)
+    try:
+        yield job
+    finally:
+        _current_job.reset(token)
+
+
+def get_current_job():
+    """返回当前的审查任务上下文；不在审查任务中时返回 None。"""
+    return _current_job.get()
+
+
+def check_job_active(stage_description: str, allow_expired: bool = False):
+    """检查当前审查任务 (如果有) 是否仍可继续，参数和异常同 ReviewJobContext.check。"""
+    job = _current_job.get()
+    if job is not None:
+        job.check(stage_description, allow_expired)
+
+
+def get_remaining_job_time():
+    """返回当前任务距截止时间的剩余秒数；未设置截止时间时返回 None。"""
+    job = _current_job.get()
+    return job.get_remaining_seconds() if job is not None else None
+
+
+def get_request_timeout(default_timeout: float, min_timeout: float = 1.0) -> float:
+    """返回 HTTP 请求的超时秒数：不超过 default_timeout，也不超过当前任务的剩余时间 (但至少为 min_timeout)。"""
+    remaining = get_remaining_job_time()
+    if remaining is None:
+        return default_timeout
+    return max(min_timeout, min(default_timeout, remaining))
+
+
+def is_job_timed_out() -> bool:
+    """
+    当前审查任务是否因超时放弃了部分阶段 (结果不完整)。
+    结果不完整时不应发表 "无问题" 评论，也不应把提交标记为已审查 (否则增量审查会跳过未审查的文件)。
+    """
+    job = _current_job.get()
+    return job is not None and job.timed_out
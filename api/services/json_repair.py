@@ -0,0 +1,132 @@
+import json
+import logging
+import redis
+import api.core_config as core_config_module
+from api.core_config import REDIS_LLM_JSON_REPAIR_STATS_KEY
+from .json_stream_parser import IncrementalJSONArrayParser
+
+logger = logging.getLogger(__name__)
+
+# 解析结果的来源，同时作为统计字段名
+JSON_PARSE_STRICT = "strict"          # 原样即为合法 JSON
+JSON_PARSE_EXTRACTED = "extracted"    # 去除前后的多余文字后合法
+JSON_PARSE_REPAIRED = "repaired"      # 去除尾随逗号、注释后合法
+JSON_PARSE_PARTIAL = "partial"        # 只能从截断/损坏的数组中恢复出完整的对象元素
+JSON_PARSE_REASK = "reask"            # 修复失败，要求模型重新输出合法 JSON 后成功
+JSON_PARSE_FAILED = "failed"
+
+
+def _find_json_start(text: str) -> int:
+    """返回第一个 '[' 或 '{' 的位置，不存在时返回 -1。"""
+    positions = [index for index in (text.find("["), text.find("{")) if index != -1]
+    return min(positions) if positions else -1
+
+
+def repair_json_text(text: str) -> str:
+    """
+    对 LLM 输出的 JSON 文本做保守修复 (只修改字符串之外的内容): 去除 // 和 /* */ 注释、去除 ] 和 } 之前的尾随逗号。
+    不补全被截断的内容 —— 截断的输出由 parse_llm_json_tolerantly 只恢复其中完整的对象元素，避免产出内容残缺的审查意见。
+    """
+    result = []
+    in_string = False
+    escape_next = False
+    index = 0
+    length = len(text)
+    while index < length:
+        ch = text[index]
+        if in_string:
+            result.append(ch)
+            if escape_next:
+                escape_next = False
+            elif ch == '\\':
+                escape_next = True
+            elif ch == '"':
+                in_string = False
+            index += 1
+            continue
+        if ch == '"':
+            in_string = True
+        elif text.startswith("//", index):
+            newline_index = text.find("\n", index)
+            index = length if newline_index == -1 else newline_index
+            continue
+        elif text.startswith("/*", index):
+            end_index = text.find("*/", index + 2)
+            index = length if end_index == -1 else end_index + 2
+            continue
+        elif ch in "]}":
+            # 去除紧邻的尾随逗号 (中间可能有空白)
+            trailing = len(result)
+            while trailing > 0 and result[trailing - 1].isspace():
+                trailing -= 1
+            if trailing > 0 and result[trailing - 1] == ",":
+                del result[trailing - 1]
+        result.append(ch)
+        index += 1
+    return "".join(result)
+
+
+def _raw_decode_from_start(text: str):
+    start_index = _find_json_start(text)
+    if start_index == -1:
+        raise ValueError("未找到 JSON 起始括号")
+    value, _ = json.JSONDecoder().raw_decode(text, start_index)
+    return value
+
+
+def parse_llm_json_tolerantly(text: str):
+    """
+    尽可能从 LLM 输出中解析出 JSON。依次尝试: 严格解析、提取第一个 JSON 值、修复后解析、
+    从数组中恢复所有完整的对象元素。返回 (解析结果, 来源)；全部失败时返回 (None, JSON_PARSE_FAILED)。
+    """
+    if not text:
+        return None, JSON_PARSE_FAILED
+    try:
+        return json.loads(text), JSON_PARSE_STRICT
+    except json.JSONDecodeError:
+        pass
+    try:
+        return _raw_decode_from_start(text), JSON_PARSE_EXTRACTED
+    except ValueError:  # json.JSONDecodeError 是 ValueError 的子类
+        pass
+
+    start_index = _find_json_start(text)
+    if start_index != -1:
+        repaired_text = repair_json_text(text[start_index:])
+        try:
+            return _raw_decode_from_start(repaired_text), JSON_PARSE_REPAIRED
+        except ValueError:
+            pass
+        # 逐个恢复数组中的完整对象元素，损坏或被截断的元素被跳过
+        recovered = IncrementalJSONArrayParser().feed(repaired_text)
+        if recovered:
+            return recovered, JSON_PARSE_PARTIAL
+    return None, JSON_PARSE_FAILED
+
+
+def record_json_repair_outcome(outcome: str, context_description: str):
+    """累加 JSON 解析/修复结果的统计 (Redis HASH，字段为 strict/extracted/repaired/partial/reask/failed)。"""
+    if outcome != JSON_PARSE_STRICT:
+        logger.info(f"LLM 输出 JSON 解析结果 ({context_description}): {outcome}")
+    redis_client = core_config_module.redis_client
+    if redis_client is None:
+        return
+    try:
+        redis_client.hincrby(REDIS_LLM_JSON_REPAIR_STATS_KEY, outcome, 1)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"记录 JSON 修复统计时出错 ({context_description}): {e}")
+
+
+def get_json_repair_stats() -> dict:
+    """返回各解析结果的累计次数。"""
+    stats = {outcome: 0 for outcome in (JSON_PARSE_STRICT, JSON_PARSE_EXTRACTED, JSON_PARSE_REPAIRED,
+                                        JSON_PARSE_PARTIAL, JSON_PARSE_REASK, JSON_PARSE_FAILED)}
+    redis_client = core_config_module.redis_client
+    if redis_client is None:
+        return stats
+    try:
+        for field_bytes, value_bytes in redis_client.hgetall(REDIS_LLM_JSON_REPAIR_STATS_KEY).items():
+            stats[field_bytes.decode('utf-8')] = int(value_bytes)
+    except (redis.exceptions.RedisError, ValueError) as e:
+        logger.error(f"读取 JSON 修复统计时出错: {e}")
+    return stats
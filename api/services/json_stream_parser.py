@@ -0,0 +1,120 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+_THINK_OPEN_TAG = "<think>"
+_THINK_CLOSE_TAG = "</think>"
+
+
+class IncrementalJSONArrayParser:
+    """
+    增量解析 LLM 流式输出中的 JSON 数组，每当数组中的一个对象元素完整时立即返回它。
+
+    - 以输出中出现的第一个 '[' 作为目标数组 (可以嵌套在对象中，如 {"reviews": [...]})，
+      在此之前的 <think>...</think> 内容、Markdown 代码块标记等都会被忽略。
+    - 只保留当前正在解析的对象文本，已返回的对象不再占用内存。
+    - 无法解析的元素会被跳过并记录日志，不影响后续元素。
+    """
+
+    def __init__(self):
+        self._array_depth = None  # 目标数组所在的括号深度，None 表示尚未找到
+        self._depth = 0
+        self._in_string = False
+        self._escape_next = False
+        self._in_think = False
+        self._finished = False
+        self._pending_tag = ""  # 数组开始前可能被切断的 <think> 标签片段
+        self._object_chars = None  # 当前对象元素的字符，None 表示不在对象元素中
+        self.emitted_count = 0
+
+    @property
+    def finished(self) -> bool:
+        """目标数组是否已经闭合。"""
+        return self._finished
+
+    def feed(self, text: str) -> list:
+        """输入新的文本片段，返回本次解析出的完整对象列表。"""
+        if not text or self._finished:
+            return []
+        if self._array_depth is None:
+            text = self._skip_think_blocks(text)
+
+        completed = []
+        for ch in text:
+            if self._finished:
+                break
+            if self._object_chars is not None:
+                self._object_chars.append(ch)
+
+            if self._in_string:
+                if self._escape_next:
+                    self._escape_next = False
+                elif ch == '\\':
+                    self._escape_next = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                if self._array_depth is not None or self._depth > 0:
+                    self._in_string = True
+            elif ch in '[{':
+                if self._array_depth is None:
+                    if ch == '[':
+                        self._array_depth = self._depth + 1
+                    self._depth += 1
+                    continue
+                self._depth += 1
+                if ch == '{' and self._depth == self._array_depth + 1:
+                    self._object_chars = [ch]
+            elif ch in ']}':
+                if self._array_depth is None:
+                    self._depth = max(0, self._depth - 1)
+                    continue
+                if ch == '}' and self._depth == self._array_depth + 1 and self._object_chars is not None:
+                    parsed = self._parse_object("".join(self._object_chars))
+                    self._object_chars = None
+                    if parsed is not None:
+                        completed.append(parsed)
+                if ch == ']' and self._depth == self._array_depth:
+                    self._finished = True
+                self._depth -= 1
+        return completed
+
+    def _skip_think_blocks(self, text: str) -> str:
+        """在找到目标数组之前，剔除 <think>...</think> 中的内容 (其中可能包含干扰解析的括号)。"""
+        text = self._pending_tag + text
+        self._pending_tag = ""
+        result = []
+        while text:
+            if self._in_think:
+                close_index = text.find(_THINK_CLOSE_TAG)
+                if close_index == -1:
+                    # 保留可能被切断的结束标签前缀，等待下一个片段
+                    self._pending_tag = text[-(len(_THINK_CLOSE_TAG) - 1):]
+                    return "".join(result)
+                self._in_think = False
+                text = text[close_index + len(_THINK_CLOSE_TAG):]
+                continue
+            open_index = text.find(_THINK_OPEN_TAG)
+            if open_index == -1:
+                partial_index = text.rfind("<")
+                if partial_index != -1 and _THINK_OPEN_TAG.startswith(text[partial_index:]):
+                    self._pending_tag = text[partial_index:]
+                    text = text[:partial_index]
+                result.append(text)
+                return "".join(result)
+            result.append(text[:open_index])
+            self._in_think = True
+            text = text[open_index + len(_THINK_OPEN_TAG):]
+        return "".join(result)
+
+    def _parse_object(self, object_text: str):
+        try:
+            parsed = json.loads(object_text)
+        except json.JSONDecodeError as e:
+            logger.warning(f"流式解析: 跳过无法解析的 JSON 对象元素: {e}。内容: {object_text[:200]}")
+            return None
+        self.emitted_count += 1
+        return parsed
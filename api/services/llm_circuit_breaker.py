@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from openai import APIConnectionError, APIStatusError
+from api.core_config import get_int_config
+from .concurrency_service import ReviewJobAborted
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_STATE_CLOSED = "closed"
+CIRCUIT_STATE_OPEN = "open"
+CIRCUIT_STATE_HALF_OPEN = "half_open"
+
+
+class LLMCircuitOpenError(ReviewJobAborted):
+    """熔断器处于打开状态时快速失败。整个审查任务会被中止并稍后重新排队，而不是产出"无问题"的审查结果。"""
+
+    def __init__(self, retry_after_seconds: float):
+        super().__init__(f"LLM 端点熔断中，约 {retry_after_seconds:.0f} 秒后再试。")
+        self.retry_after_seconds = retry_after_seconds
+
+
+def is_circuit_failure(error: Exception) -> bool:
+    """只有表明端点本身不可用的错误 (连接失败、超时、5xx) 才计入熔断；限流和请求内容错误不计入。"""
+    if isinstance(error, APIConnectionError):  # 包括 APITimeoutError
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+class LLMCircuitBreaker:
+    """
+    LLM 端点熔断器 (closed / open / half-open 状态机)。
+    - closed: 正常放行，连续失败达到 LLM_CIRCUIT_FAILURE_THRESHOLD 次后转为 open。
+    - open: 所有请求直接抛出 LLMCircuitOpenError，持续 LLM_CIRCUIT_OPEN_SECONDS 秒后转为 half-open。
+    - half-open: 只放行一个探测请求，成功则恢复 closed，失败则重新 open。
+    阈值和时长在每次判断时从配置读取，修改后立即生效。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = CIRCUIT_STATE_CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._total_rejected = 0
+
+    @staticmethod
+    def _open_seconds() -> int:
+        return max(1, get_int_config("LLM_CIRCUIT_OPEN_SECONDS", 60))
+
+    def _remaining_open_seconds_locked(self) -> float:
+        return max(0.0, self._opened_at + self._open_seconds() - time.monotonic())
+
+    def before_call(self):
+        """
+        发送请求前调用。熔断打开 (或半开状态下已有探测请求在进行) 时抛出 LLMCircuitOpenError。
+        返回本次请求是否占用了半开状态的探测名额 (请求未得到明确结果时应以此决定是否调用 release_probe)。
+        """
+        with self._lock:
+            if self._state == CIRCUIT_STATE_OPEN:
+                remaining = self._remaining_open_seconds_locked()
+                if remaining > 0:
+                    self._total_rejected += 1
+                    raise LLMCircuitOpenError(remaining)
+                self._state = CIRCUIT_STATE_HALF_OPEN
+                logger.info("LLM 熔断器进入半开状态，放行一个探测请求。")
+            if self._state == CIRCUIT_STATE_HALF_OPEN:
+                if self._probe_in_flight:
+                    self._total_rejected += 1
+                    raise LLMCircuitOpenError(self._open_seconds() / 2)
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CIRCUIT_STATE_CLOSED:
+                logger.info("LLM 探测请求成功，熔断器恢复为关闭状态。")
+            self._state = CIRCUIT_STATE_CLOSED
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, error: Exception, holds_probe: bool = False):
+        """
+        记录一次失败的请求。holds_probe 为本次请求在 before_call 中是否占用了探测名额。
+        非端点故障类的错误 (如 429) 既不能证明端点已恢复，也不能说明端点故障：不改变状态和计数，只释放本请求占用的探测名额。
+        """
+        if not is_circuit_failure(error):
+            if holds_probe:
+                self.release_probe()
+            return
+        with self._lock:
+            self._consecutive_failures += 1
+            was_half_open = self._state == CIRCUIT_STATE_HALF_OPEN
+            self._probe_in_flight = False
+            threshold = max(1, get_int_config("LLM_CIRCUIT_FAILURE_THRESHOLD", 5))
+            if was_half_open or (self._state == CIRCUIT_STATE_CLOSED and self._consecutive_failures >= threshold):
+                self._state = CIRCUIT_STATE_OPEN
+                self._opened_at = time.monotonic()
+                logger.error(
+                    f"LLM 端点{'探测请求失败' if was_half_open else f'连续失败 {self._consecutive_failures} 次'}，"
+                    f"熔断器打开 {self._open_seconds()} 秒。最后错误: {error}")
+
+    def release_probe(self):
+        """请求未得到明确结果 (例如被其他异常中断) 时释放半开状态的探测名额。"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def get_retry_after_seconds(self):
+        """熔断打开时返回距离半开的秒数，否则返回 None。"""
+        with self._lock:
+            if self._state != CIRCUIT_STATE_OPEN:
+                return None
+            remaining = self._remaining_open_seconds_locked()
+            return remaining if remaining > 0 else None
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "open_remaining_seconds": round(self._remaining_open_seconds_locked(), 1)
+                if self._state == CIRCUIT_STATE_OPEN else 0,
+                "total_rejected": self._total_rejected,
+            }
+
+
+llm_circuit_breaker = LLMCircuitBreaker()
@@ -1,47 +1,107 @@
 import logging
 import re
-from openai import OpenAI, APIError # 导入 APIError
-from api.core_config import app_configs
+import time
+from openai import OpenAI, APIError, BadRequestError # 导入 APIError
+from api.core_config import app_configs, get_bool_config, get_int_config
+from .concurrency_service import (
+    llm_call_slot, try_acquire_llm_call_slot, release_llm_call_slot, ReviewJobAborted, ReviewJobDeadlineExceeded
+)
+from .job_context import get_current_job, check_job_active, get_remaining_job_time, get_request_timeout
+from .json_stream_parser import IncrementalJSONArrayParser
+from .llm_retry_policy import LLMRetryPolicy
+from .llm_circuit_breaker import llm_circuit_breaker, LLMCircuitOpenError
+from .llm_rate_limiter import (
+    acquire_llm_rate_limit, try_acquire_llm_rate_limit, record_llm_token_usage, is_token_rate_limit_enabled,
+    release_llm_token_reservation, LLMRateLimitExceeded
+)
+from .llm_usage_stats import record_llm_usage
+from api.utils import estimate_tokens
+from .llm_endpoint_pool import (
+    LLMEndpointPool, LLMPoolMember, parse_endpoint_pool_config, POOL_STRATEGY_LEAST_OUTSTANDING
+)
 
 logger = logging.getLogger(__name__)
 
+# OpenAI SDK 的默认请求超时 (秒)；任务设置了截止时间时，单次请求的超时不超过任务剩余时间
+_DEFAULT_LLM_REQUEST_TIMEOUT_SECONDS = 600
+
 openai_client = None
 
+def _normalize_base_url(base_url: str) -> str:
+    """为 OpenAI 库兼容性修正自定义基础 URL (补全 /v1 后缀)。"""
+    if base_url and base_url != "https://api.openai.com/v1" and not base_url.endswith('/v1'):
+        if not base_url.endswith('/api') and not base_url.endswith('/'):
+            corrected_base_url = base_url.rstrip('/') + '/v1'
+            logger.info(
+                f"为 OpenAI 库兼容性，修正 OpenAI API 基础 URL 从 '{base_url}' 到 '{corrected_base_url}'。")
+            return corrected_base_url
+        logger.info(f"使用自定义 OpenAI API 基础 URL: {base_url}")
+    return base_url
+
+
+def _build_openai_client(base_url: str, api_key: str):
+    """根据基础 URL 和 API Key 构建 OpenAI 客户端实例。"""
+    base_url = _normalize_base_url(base_url)
+    if base_url and base_url != "https://api.openai.com/v1":
+        logger.info(f"使用自定义基础 URL 初始化 OpenAI 客户端: {base_url}")
+        return OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            max_retries=0  # 重试由 LLMRetryPolicy 统一处理
+        )
+    logger.info("使用默认 OpenAI API 端点初始化 OpenAI 客户端。")
+    return OpenAI(
+        api_key=api_key,
+        max_retries=0  # 重试由 LLMRetryPolicy 统一处理
+    )
+
+
+def _build_endpoint_pool_members(primary_client, primary_base_url: str) -> list:
+    """根据主端点和 OPENAI_ENDPOINT_POOL 配置构建端点池成员列表。"""
+    members = []
+    if primary_client is not None:
+        members.append(LLMPoolMember(name=primary_base_url or "default", client=primary_client, weight=1.0))
+    for index, entry in enumerate(parse_endpoint_pool_config(app_configs.get("OPENAI_ENDPOINT_POOL"))):
+        base_url = entry.get("base_url") or "https://api.openai.com/v1"
+        try:
+            weight = float(entry.get("weight", 1))
+        except (TypeError, ValueError):
+            weight = 1.0
+        members.append(LLMPoolMember(
+            name=entry.get("name") or f"{base_url}#{index + 1}",
+            client=_build_openai_client(base_url, entry["api_key"]),
+            weight=weight,
+            model=entry.get("model")
+        ))
+    return members
+
+
 def initialize_openai_client():
-    """根据 app_configs 初始化或重新初始化全局 OpenAI 客户端。"""
+    """根据 app_configs 初始化或重新初始化全局 OpenAI 客户端 (配置了端点池时为 LLMEndpointPool)。"""
     global openai_client
     try:
         current_base_url = app_configs.get("OPENAI_API_BASE_URL")
         current_api_key = app_configs.get("OPENAI_API_KEY")
         current_model = app_configs.get("OPENAI_MODEL")
 
+        primary_client = None
         if not current_api_key or current_api_key == "xxxx-xxxx-xxxx-xxxx":
             logger.warning(
-                "警告: OpenAI API Key 未配置或为占位符。OpenAI 客户端将不会初始化。")
-            openai_client = None
-            return
-
-        if current_base_url and current_base_url != "https://api.openai.com/v1" and not current_base_url.endswith(
-                '/v1'):
-            if not current_base_url.endswith('/api') and not current_base_url.endswith('/'):
-                corrected_base_url = current_base_url.rstrip('/') + '/v1'
-                logger.info(
-                    f"为 OpenAI 库兼容性，修正 OpenAI API 基础 URL 从 '{current_base_url}' 到 '{corrected_base_url}'。")
-                current_base_url = corrected_base_url
-            else:
-                logger.info(f"使用自定义 OpenAI API 基础 URL: {current_base_url}")
-
-        if current_base_url and current_base_url != "https://api.openai.com/v1":
-            logger.info(f"使用自定义基础 URL 初始化 OpenAI 客户端: {current_base_url}")
-            openai_client = OpenAI(
-                base_url=current_base_url,
-                api_key=current_api_key
-            )
+                "警告: OpenAI API Key 未配置或为占位符。主 OpenAI 客户端将不会初始化。")
         else:
-            logger.info("使用默认 OpenAI API 端点初始化 OpenAI 客户端。")
-            openai_client = OpenAI(
-                api_key=current_api_key
-            )
+            primary_client = _build_openai_client(current_base_url, current_api_key)
+
+        if app_configs.get("OPENAI_ENDPOINT_POOL"):
+            members = _build_endpoint_pool_members(primary_client, current_base_url)
+            if len(members) > 1 or (members and primary_client is None):
+                openai_client = LLMEndpointPool(
+                    members, strategy=app_configs.get("OPENAI_ENDPOINT_POOL_STRATEGY") or POOL_STRATEGY_LEAST_OUTSTANDING)
+                logger.info(f"OpenAI 端点池已初始化，共 {len(members)} 个成员。将使用的模型: {current_model}")
+                return
+
+        openai_client = primary_client
+        if openai_client is None:
+            return
         logger.info(f"OpenAI 客户端已初始化/重新初始化。将使用的模型: {current_model}")
     except Exception as e:
         logger.error(f"初始化 OpenAI 客户端时出错: {e}")
@@ -50,6 +110,18 @@ def initialize_openai_client():
         openai_client = None
 
 
+def get_llm_endpoint_pool_status():
+    """返回端点池各成员的状态；未启用端点池时返回 None。"""
+    if isinstance(openai_client, LLMEndpointPool):
+        return openai_client.get_status()
+    return None
+
+
+def get_llm_circuit_breaker_status() -> dict:
+    """返回 LLM 熔断器的当前状态。"""
+    return llm_circuit_breaker.get_status()
+
+
 def get_openai_client():
     """获取 OpenAI 客户端实例，如果未初始化则尝试初始化。"""
     global openai_client
@@ -59,20 +131,158 @@ def get_openai_client():
     return openai_client
 
 
+def _consume_hedge_budget() -> bool:
+    """对冲请求会产生额外花费，每个审查任务最多发起 LLM_HEDGE_MAX_PER_JOB 次。"""
+    job = get_current_job()
+    return job is not None and job.try_consume_budget("llm_hedge", max(0, get_int_config("LLM_HEDGE_MAX_PER_JOB", 3)))
+
+
+def _make_hedge_starter(model_name: str, estimated_prompt_tokens: int, context_description: str):
+    """
+    构造端点池对冲请求的 start_hedge 回调 (见 LLMEndpointPool.create_hedged_chat_completion)。
+    对冲副本与普通请求一样计入全局并发上限和集群限流，但不等待名额：对冲预算、并发名额或限流名额不足时不对冲。
+    两个请求都结束后释放名额，并按被丢弃的响应修正 token 预扣和记录用量 (落后的请求失败时退回预扣)。
+    """
+    hedge_description = f"{context_description} (对冲)"
+
+    def _start_hedge():
+        if not _consume_hedge_budget():
+            return None
+        if not try_acquire_llm_call_slot():
+            logger.info(f"全局 LLM 并发名额已满，不发起对冲请求 ({context_description})。")
+            return None
+        reserved_tokens = try_acquire_llm_rate_limit(estimated_prompt_tokens, hedge_description)
+        if reserved_tokens is None:
+            release_llm_call_slot()
+            logger.info(f"LLM 集群限流名额不足，不发起对冲请求 ({context_description})。")
+            return None
+
+        def _finish_hedge(discarded_response):
+            release_llm_call_slot()
+            if discarded_response is None:
+                # 落后的请求失败了，退回其预扣的 token
+                release_llm_token_reservation(reserved_tokens, hedge_description)
+                return
+            usage = getattr(discarded_response, "usage", None)
+            record_llm_token_usage(reserved_tokens, usage, hedge_description)
+            record_llm_usage(usage, model_name, hedge_description)
+
+        return _finish_hedge
+
+    return _start_hedge
+
+
+def _get_hedge_delay(client, completion_params: dict):
+    """
+    返回对冲请求的等待阈值 (秒)：端点池最近请求耗时的 LLM_HEDGE_LATENCY_PERCENTILE 百分位。
+    未启用对冲、流式请求 (已发表的流式结果无法撤回)、不在审查任务中或耗时样本不足时返回 None。
+    """
+    if not get_bool_config("LLM_HEDGE_ENABLED", False) or completion_params.get("stream"):
+        return None
+    if not isinstance(client, LLMEndpointPool) or get_current_job() is None:
+        return None
+    percentile = min(99, max(50, get_int_config("LLM_HEDGE_LATENCY_PERCENTILE", 95)))
+    return client.get_latency_percentile(percentile)
+
+
+def _create_chat_completion(client, completion_params: dict, start_hedge=None):
+    """
+    发送 chat completion 请求。client 为端点池时由池选择具体成员；
+    提供 start_hedge (见 _make_hedge_starter) 且启用对冲时可能同时在两个成员上请求。
+    """
+    if isinstance(client, LLMEndpointPool):
+        hedge_delay = _get_hedge_delay(client, completion_params) if start_hedge is not None else None
+        if hedge_delay is not None:
+            return client.create_hedged_chat_completion(hedge_delay, start_hedge, **completion_params)
+        return client.create_chat_completion(**completion_params)
+    return client.chat.completions.create(**completion_params)
+
+
+def _clean_llm_content(raw_content: str, context_description: str) -> str:
+    """移除 <think> 标签并提取 Markdown 代码块中的内容。"""
+    # 移除 <think>...</think> 标签及其内容
+    # re.DOTALL 使 . 匹配换行符
+    content_after_think_tags = re.sub(r"<think>.*?</?think>", "", raw_content, flags=re.DOTALL)
+    # 尝试提取被 ```...``` 包裹的内容，可选地处理语言标记如 json
+    # re.DOTALL 确保 . 可以匹配换行符，处理多行 JSON
+    # \s* 用于匹配 ``` 和实际内容之间，以及内容和末尾 ``` 之间的空白字符
+    # (?:\w*\s*)? 是一个可选的非捕获组，匹配可选的语言名称后跟可选空格
+    markdown_json_match = re.search(r"```(?:\w*\s*)?([\s\S]*?)\s*```", content_after_think_tags, re.DOTALL)
+
+    if markdown_json_match:
+        # 如果匹配到，提取第一个捕获组的内容
+        final_content = markdown_json_match.group(1)
+        logger.info(f"从 Markdown 代码块中提取了 JSON 内容 ({context_description})。")
+    else:
+        # 如果没有匹配到 Markdown 代码块，则假定内容已经是 JSON 或纯文本
+        final_content = content_after_think_tags
+        # 然后去除首尾空白
+    return final_content.strip()
+
+
+def _consume_streaming_completion(client, completion_params: dict, context_description: str, on_finding):
+    """
+    以流式方式执行请求，每解析出一个完整的数组元素对象就调用 on_finding(obj)。
+    返回 (完整的原始响应内容, usage)；响应中没有内容时内容为 None，服务端未返回用量时 usage 为 None。
+    服务端以 400 拒绝 stream_options 参数时，去掉该参数重新请求一次 (此时没有用量)。
+    """
+    parser = IncrementalJSONArrayParser()
+    content_parts = []
+    usage = None
+    stream_params = dict(completion_params, stream=True)
+    if is_token_rate_limit_enabled() or get_bool_config("LLM_STREAM_INCLUDE_USAGE", False):
+        # 流式响应默认不返回用量；集群 token 限流需要用它修正预估值，用量统计需要其中的前缀缓存命中数
+        stream_params["stream_options"] = {"include_usage": True}
+    try:
+        stream = _create_chat_completion(client, stream_params)
+    except BadRequestError as e:
+        if "stream_options" not in stream_params or "stream_options" not in str(e):
+            raise
+        logger.warning(f"LLM 服务不支持 stream_options 参数，去掉该参数重新请求 ({context_description}): {e}")
+        stream_params.pop("stream_options")
+        stream = _create_chat_completion(client, stream_params)
+    job = get_current_job()
+    for chunk in stream:
+        if job is not None and job.cancelled:
+            getattr(stream, "close", lambda: None)()  # 不再读取剩余输出，尽快释放连接
+            job.check(context_description, allow_expired=True)
+        usage = getattr(chunk, "usage", None) or usage
+        if not chunk.choices:
+            continue
+        delta_text = getattr(chunk.choices[0].delta, "content", None)
+        if not delta_text:
+            continue
+        content_parts.append(delta_text)
+        for finding in parser.feed(delta_text):
+            try:
+                on_finding(finding)
+            except Exception:
+                logger.exception(f"处理流式审查结果的回调出错 ({context_description}):")
+    if parser.emitted_count:
+        logger.info(f"流式响应 ({context_description}) 共增量解析出 {parser.emitted_count} 个结果对象。")
+    return "".join(content_parts) or None, usage
+
+
 def execute_llm_chat_completion(client, model_name: str, system_prompt: str, user_prompt: str, context_description: str,
-                                response_format_type: str = None):
+                                response_format_type: str = None, on_finding=None):
     """
     执行 LLM 请求。
 
-    :param client: OpenAI 客户端实例。
+    :param client: OpenAI 客户端实例或 LLMEndpointPool。
     :param model_name: 要使用的模型名称。
     :param system_prompt: 系统提示。
     :param user_prompt: 用户原始提示。
     :param context_description: 用于 _prepare_llm_user_prompt 的上下文描述。
     :param response_format_type: 可选，响应格式类型 (例如 "json_object")。
-    :return: LLM 的响应内容。
+    :param on_finding: 可选，启用流式模式 (LLM_STREAMING_ENABLED) 时，输出 JSON 数组中每个元素对象解析完成后立即以该对象调用此回调。
+    :return: LLM 的响应内容 (完整内容，与非流式模式一致)。
+             限流、5xx 和连接错误会按 LLMRetryPolicy 退避重试，重试耗尽后返回 "Error: ..." 字符串。
+    :raises LLMCircuitOpenError: LLM 端点熔断中，请求未发送。调用方应中止整个审查任务并稍后重试。
+    :raises ReviewJobCancelled: 当前审查任务已被取消 (见 job_context)。
+    :raises ReviewJobDeadlineExceeded: 当前审查任务已超过截止时间，请求未发送或被超时中断。
     """
 
+    # 消息顺序固定为 System Prompt (各请求间逐字节一致) 在前、变化的输入在后，使服务端可以缓存公共前缀
     completion_params = {
         "model": model_name,
         "messages": [
@@ -83,40 +293,92 @@ def execute_llm_chat_completion(client, model_name: str, system_prompt: str, use
     if response_format_type:
         completion_params["response_format"] = {"type": response_format_type}
 
-    try:
-        response = client.chat.completions.create(**completion_params)
-        if response and response.choices and len(response.choices) > 0:
-            message = response.choices[0].message
-            if message and message.content:
-                # 首先获取原始响应内容
-                raw_content = message.content
-                # 移除 <think>...</think> 标签及其内容
-                # re.DOTALL 使 . 匹配换行符
-                content_after_think_tags = re.sub(r"<think>.*?</?think>", "", raw_content, flags=re.DOTALL)
-                # 尝试提取被 ```...``` 包裹的内容，可选地处理语言标记如 json
-                # re.DOTALL 确保 . 可以匹配换行符，处理多行 JSON
-                # \s* 用于匹配 ``` 和实际内容之间，以及内容和末尾 ``` 之间的空白字符
-                # (?:\w*\s*)? 是一个可选的非捕获组，匹配可选的语言名称后跟可选空格
-                markdown_json_match = re.search(r"```(?:\w*\s*)?([\s\S]*?)\s*```", content_after_think_tags, re.DOTALL)
-
-                if markdown_json_match:
-                    # 如果匹配到，提取第一个捕获组的内容
-                    final_content = markdown_json_match.group(1)
-                    logger.info(f"从 Markdown 代码块中提取了 JSON 内容 ({context_description})。")
+    streaming = on_finding is not None and get_bool_config("LLM_STREAMING_ENABLED", True)
+    retry_policy = LLMRetryPolicy(context_description)
+    estimated_prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+    while True:
+        emitted_findings = []
+        check_job_active(context_description)
+        if get_remaining_job_time() is not None:
+            completion_params["timeout"] = get_request_timeout(_DEFAULT_LLM_REQUEST_TIMEOUT_SECONDS)
+        # 集群级 RPM/TPM 令牌桶 (等待期间不占用全局 LLM 并发名额)，响应后按实际用量修正，请求失败时退回
+        try:
+            reserved_tokens = acquire_llm_rate_limit(estimated_prompt_tokens, context_description)
+        except LLMRateLimitExceeded as e:
+            # 集群配额长时间耗尽时不发送请求，按限流错误退避重试
+            retry_delay = retry_policy.get_retry_delay(e)
+            if retry_delay is not None:
+                time.sleep(retry_delay)
+                continue
+            logger.error(f"LLM 集群限流名额不足，放弃请求 ({context_description}): {e}")
+            return f"Error: LLM cluster rate limit exceeded for {context_description}: {str(e)}"
+        holds_probe = False
+        try:
+            # 熔断检查紧挨着请求发送 (在等待限流和并发名额之后)，半开状态的探测名额不会在等待期间被占用；
+            # 熔断打开时快速失败 (LLMCircuitOpenError 向上传播，不转换为 "Error: ..." 字符串)
+            if streaming:
+                def _on_finding(finding):
+                    emitted_findings.append(1)
+                    on_finding(finding)
+
+                with llm_call_slot():
+                    holds_probe = llm_circuit_breaker.before_call()
+                    raw_content, usage = _consume_streaming_completion(
+                        client, completion_params, context_description, _on_finding)
+                llm_circuit_breaker.record_success()
+                record_llm_token_usage(reserved_tokens, usage, context_description)
+                reserved_tokens = 0
+                record_llm_usage(usage, model_name, context_description)
+                if raw_content:
+                    return _clean_llm_content(raw_content, context_description)
+                logger.error(f"LLM 流式响应中没有内容 ({context_description})。")
+                return f"Error: LLM response missing content for {context_description}."
+
+            with llm_call_slot():
+                holds_probe = llm_circuit_breaker.before_call()
+                response = _create_chat_completion(
+                    client, completion_params,
+                    _make_hedge_starter(model_name, estimated_prompt_tokens, context_description))
+            llm_circuit_breaker.record_success()
+            record_llm_token_usage(reserved_tokens, getattr(response, "usage", None), context_description)
+            reserved_tokens = 0
+            record_llm_usage(getattr(response, "usage", None), model_name, context_description)
+            if response and response.choices and len(response.choices) > 0:
+                message = response.choices[0].message
+                if message and message.content:
+                    return _clean_llm_content(message.content, context_description)
                 else:
-                    # 如果没有匹配到 Markdown 代码块，则假定内容已经是 JSON 或纯文本
-                    final_content = content_after_think_tags
-                    # 然后去除首尾空白
-                return final_content.strip()
+                    logger.error(f"LLM 响应中缺少 'content' 字段 ({context_description})。响应: {response}")
+                    return f"Error: LLM response missing content for {context_description}."
             else:
-                logger.error(f"LLM 响应中缺少 'content' 字段 ({context_description})。响应: {response}")
-                return f"Error: LLM response missing content for {context_description}."
-        else:
-            logger.error(f"LLM 响应无效或 choices 为空 ({context_description})。响应: {response}")
-            return f"Error: Invalid LLM response or empty choices for {context_description}."
-    except APIError as e:  # 使用导入的 APIError
-        logger.error(f"LLM API 请求失败 ({context_description}): {e}")
-        return f"Error: LLM API request failed for {context_description}: {str(e)}"
-    except Exception as e:
-        logger.error(f"处理 LLM 响应时发生意外错误 ({context_description}): {e}")
-        return f"Error: Unexpected error during LLM processing for {context_description}: {str(e)}"
+                logger.error(f"LLM 响应无效或 choices 为空 ({context_description})。响应: {response}")
+                return f"Error: Invalid LLM response or empty choices for {context_description}."
+        except LLMCircuitOpenError:
+            raise
+        except (ReviewJobAborted, ReviewJobDeadlineExceeded):
+            if holds_probe:
+                llm_circuit_breaker.release_probe()
+            raise
+        except APIError as e:  # 使用导入的 APIError
+            job = get_current_job()
+            if job is not None and job.expired:
+                # 请求因任务截止时间被中断，不计入端点的失败次数
+                if holds_probe:
+                    llm_circuit_breaker.release_probe()
+                job.check(context_description)
+            llm_circuit_breaker.record_failure(e, holds_probe)
+            # 流式响应已发出部分结果时不再重试，避免重新生成的内容与已发表的评论重复
+            retry_delay = None if emitted_findings else retry_policy.get_retry_delay(e)
+            if retry_delay is not None:
+                time.sleep(retry_delay)  # 等待期间不占用全局 LLM 并发名额
+                continue
+            logger.error(f"LLM API 请求失败 ({context_description}): {e}")
+            return f"Error: LLM API request failed for {context_description}: {str(e)}"
+        except Exception as e:
+            if holds_probe:
+                llm_circuit_breaker.release_probe()
+            logger.error(f"处理 LLM 响应时发生意外错误 ({context_description}): {e}")
+            return f"Error: Unexpected error during LLM processing for {context_description}: {str(e)}"
+        finally:
+            # 请求未发送或失败 (没有用于修正的 usage) 时退回预扣的 token；成功时已修正并置 0
+            release_llm_token_reservation(reserved_tokens, context_description)
@@ -0,0 +1,281 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from openai import (
+    APIConnectionError, RateLimitError, InternalServerError,
+    AuthenticationError, PermissionDeniedError
+)
+from api.core_config import get_int_config
+
+logger = logging.getLogger(__name__)
+
+# 被视为端点自身故障 (而非请求内容问题) 的异常类型，会计入成员的健康状态
+_MEMBER_FAULT_ERRORS = (
+    APIConnectionError, RateLimitError, InternalServerError, AuthenticationError, PermissionDeniedError
+)
+
+POOL_STRATEGY_LEAST_OUTSTANDING = "least_outstanding"
+POOL_STRATEGY_WEIGHTED = "weighted"
+
+# 对冲请求的延迟阈值基于最近若干次成功的非流式请求耗时计算，样本不足时不对冲
+_LATENCY_WINDOW_SIZE = 200
+_HEDGE_MIN_LATENCY_SAMPLES = 20
+# 执行对冲请求 (首个请求及其副本) 的线程池；调用方线程只等待结果。线程数 (LLM_HEDGE_MAX_WORKERS) 在首次对冲时读取
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=max(2, get_int_config("LLM_HEDGE_MAX_WORKERS", 32)), thread_name_prefix="llm-hedge")
+    return _hedge_executor
+
+
+def parse_endpoint_pool_config(raw_value) -> list:
+    """
+    解析 OPENAI_ENDPOINT_POOL 配置。
+    支持 JSON 字符串或已解析的列表，每一项形如:
+    {"base_url": "...", "api_key": "...", "weight": 1, "name": "可选", "model": "可选，覆盖 OPENAI_MODEL"}
+    """
+    if not raw_value:
+        return []
+    entries = raw_value
+    if isinstance(raw_value, str):
+        try:
+            entries = json.loads(raw_value)
+        except json.JSONDecodeError as e:
+            logger.error(f"解析 OPENAI_ENDPOINT_POOL 配置失败: {e}。将忽略端点池配置。")
+            return []
+    if not isinstance(entries, list):
+        logger.error(f"OPENAI_ENDPOINT_POOL 必须是列表，实际为 {type(entries).__name__}。将忽略端点池配置。")
+        return []
+
+    valid_entries = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("api_key"):
+            logger.warning(f"跳过无效的端点池条目 #{index}: 缺少 api_key。")
+            continue
+        valid_entries.append(entry)
+    return valid_entries
+
+
+def _get_discarded_response(futures, winner):
+    """返回对冲请求中未被采用的成功响应；没有时返回 None。"""
+    for future in futures:
+        if future is not winner and future.exception() is None:
+            return future.result()
+    return None
+
+
+def _call_when_all_done(futures: list, callback):
+    """所有 future 结束后 (在最后结束的那个 future 的线程中) 调用一次 callback。"""
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            callback()
+        except Exception:
+            logger.exception("处理对冲请求结束回调时出错:")
+
+    for future in futures:
+        future.add_done_callback(_on_done)
+
+
+class LLMPoolMember:
+    """端点池中的单个成员 (一个 base_url + api_key 组合)。"""
+
+    def __init__(self, name: str, client, weight: float = 1.0, model: str = None):
+        self.name = name
+        self.client = client
+        self.weight = weight if weight and weight > 0 else 1.0
+        self.model = model
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.hedge_requests = 0  # 作为对冲副本被选中的次数
+        self.hedge_wins = 0  # 其中副本先于首个请求成功返回的次数
+
+    def is_healthy(self, now: float) -> bool:
+        return self.unhealthy_until <= now
+
+
+class LLMEndpointPool:
+    """
+    多个 OpenAI 兼容端点/Key 组成的负载均衡池。
+    按最少在途请求 (按权重归一) 或加权随机选择成员，并跟踪每个成员的健康状态：
+    连续失败达到阈值后进入冷却期，冷却期内不再被优先选择。
+    还会记录最近的非流式请求耗时，用于对冲请求 (见 create_hedged_chat_completion)。
+    """
+
+    def __init__(self, members: list, strategy: str = POOL_STRATEGY_LEAST_OUTSTANDING,
+                 failure_threshold: int = 3, cooldown_seconds: float = 30.0):
+        if not members:
+            raise ValueError("LLMEndpointPool 至少需要一个成员。")
+        self._members = members
+        self._strategy = strategy
+        self._failure_threshold = failure_threshold
+        self._cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._round_robin_offset = 0
+        self._recent_latencies = deque(maxlen=_LATENCY_WINDOW_SIZE)
+
+    @property
+    def members(self) -> list:
+        return list(self._members)
+
+    def _select_member_locked(self, exclude=(), healthy_only: bool = False):
+        """选择一个成员。healthy_only 为 True 时只在 exclude 之外的健康成员中选择，没有时返回 None。"""
+        now = time.monotonic()
+        candidates = [m for m in self._members if m not in exclude]
+        if not candidates and not healthy_only:
+            candidates = list(self._members)
+        healthy = [m for m in candidates if m.is_healthy(now)]
+        if not healthy:
+            if healthy_only:
+                return None
+            # 所有成员都在冷却中时，选择最早恢复的成员，而不是直接失败
+            return min(candidates, key=lambda m: m.unhealthy_until)
+
+        if self._strategy == POOL_STRATEGY_WEIGHTED:
+            return random.choices(healthy, weights=[m.weight for m in healthy], k=1)[0]
+
+        # 最少在途请求：按 (在途数 + 1) / 权重 选择，平局时轮转以分散负载
+        self._round_robin_offset = (self._round_robin_offset + 1) % len(healthy)
+        rotated = healthy[self._round_robin_offset:] + healthy[:self._round_robin_offset]
+        return min(rotated, key=lambda m: (m.outstanding + 1) / m.weight)
+
+    def acquire_member(self, exclude=()):
+        """选择一个成员并将其在途请求数加一。调用方必须随后调用 release_member。"""
+        with self._lock:
+            member = self._select_member_locked(exclude)
+            member.outstanding += 1
+            member.total_requests += 1
+            return member
+
+    def release_member(self, member, error: Exception = None):
+        """释放成员并根据请求结果更新其健康状态。"""
+        with self._lock:
+            member.outstanding = max(0, member.outstanding - 1)
+            if error is None:
+                member.consecutive_failures = 0
+                member.unhealthy_until = 0.0
+                return
+            if not isinstance(error, _MEMBER_FAULT_ERRORS):
+                return  # 请求本身的问题 (如 400) 不计入端点健康状态
+            member.total_failures += 1
+            member.consecutive_failures += 1
+            if member.consecutive_failures >= self._failure_threshold:
+                member.unhealthy_until = time.monotonic() + self._cooldown_seconds
+                logger.warning(
+                    f"LLM 端点 '{member.name}' 连续失败 {member.consecutive_failures} 次，"
+                    f"进入 {self._cooldown_seconds:.0f} 秒冷却期。最后错误: {error}")
+
+    def _call_member(self, member, completion_params: dict):
+        """在已获取的成员上执行请求并释放该成员。成功的非流式请求耗时计入延迟统计。"""
+        params = dict(completion_params)
+        if member.model:
+            params["model"] = member.model
+        start_time = time.monotonic()
+        try:
+            response = member.client.chat.completions.create(**params)
+        except Exception as e:
+            self.release_member(member, e)
+            raise
+        self.release_member(member)
+        if not params.get("stream"):
+            with self._lock:
+                self._recent_latencies.append(time.monotonic() - start_time)
+        return response
+
+    def create_chat_completion(self, exclude=(), **completion_params):
+        """在选出的成员上执行 chat completion 请求。"""
+        return self._call_member(self.acquire_member(exclude), completion_params)
+
+    def get_latency_percentile(self, percentile: float):
+        """返回最近成功的非流式请求耗时 (秒) 的指定百分位；样本不足时返回 None。"""
+        with self._lock:
+            latencies = sorted(self._recent_latencies)
+        if len(latencies) < _HEDGE_MIN_LATENCY_SAMPLES:
+            return None
+        index = min(len(latencies) - 1, max(0, int(round(len(latencies) * percentile / 100.0)) - 1))
+        return latencies[index]
+
+    def create_hedged_chat_completion(self, hedge_delay_seconds: float, start_hedge, **completion_params):
+        """
+        对冲执行非流式 chat completion 请求：首个请求在 hedge_delay_seconds 内未返回、池中有其他健康成员
+        且 start_hedge() 允许时，在该成员上发起相同的请求，返回最先成功的响应。
+        start_hedge() 负责对冲副本的配额 (对冲预算、全局并发名额、集群限流名额)，不允许对冲时返回 None，
+        否则返回 finish_hedge(discarded_response) 回调：两个请求都结束后调用一次，传入被丢弃的那个成功响应
+        (没有时为 None)，用于释放名额并记录落后请求的用量。
+        落后的请求无法中途取消，会在后台完成。两个请求都失败时抛出最后一个错误。
+        """
+        executor = _get_hedge_executor()
+        primary = self.acquire_member()
+        futures = {executor.submit(self._call_member, primary, completion_params): primary}
+        done, _ = wait(futures, timeout=hedge_delay_seconds)
+        hedge_member = None
+        if not done:
+            with self._lock:
+                hedge_member = self._select_member_locked(exclude=(primary,), healthy_only=True)
+            finish_hedge = start_hedge() if hedge_member is not None else None
+            if finish_hedge is None:
+                hedge_member = None
+            else:
+                with self._lock:
+                    hedge_member.outstanding += 1
+                    hedge_member.total_requests += 1
+                    hedge_member.hedge_requests += 1
+                logger.info(f"LLM 请求在 {hedge_delay_seconds:.1f} 秒内未返回 (端点 '{primary.name}')，"
+                            f"在端点 '{hedge_member.name}' 上发起对冲请求。")
+                futures[executor.submit(self._call_member, hedge_member, completion_params)] = hedge_member
+
+        pending = set(futures)
+        last_error = None
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    last_error = future.exception()
+                elif winner is None:
+                    winner = future
+        if hedge_member is not None:
+            if winner is not None and futures[winner] is hedge_member:
+                with self._lock:
+                    hedge_member.hedge_wins += 1
+            _call_when_all_done(list(futures), lambda: finish_hedge(_get_discarded_response(futures, winner)))
+        if winner is None:
+            raise last_error
+        return winner.result()
+
+    def get_status(self) -> list:
+        """返回各成员的健康与负载状态，用于管理接口展示。"""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "name": m.name,
+                "weight": m.weight,
+                "model": m.model,
+                "healthy": m.is_healthy(now),
+                "outstanding_requests": m.outstanding,
+                "consecutive_failures": m.consecutive_failures,
+                "total_requests": m.total_requests,
+                "total_failures": m.total_failures,
+                "hedge_requests": m.hedge_requests,
+                "hedge_wins": m.hedge_wins,
+            } for m in self._members]
@@ -0,0 +1,106 @@
+import fnmatch
+import json
+import logging
+import os
+from api.core_config import app_configs
+
+logger = logging.getLogger(__name__)
+
+
+def parse_routing_rules(raw_value) -> list:
+    """
+    解析 LLM_ROUTING_RULES 配置。支持 JSON 字符串或已解析的列表，按顺序匹配，第一条命中的规则生效。每条规则形如:
+    {
+        "name": "docs",                      # 可选，用于记录路由决策
+        "model": "gpt-4o-mini",              # 必填，命中时使用的模型
+        "extensions": [".md", ".txt"],       # 可选，文件扩展名 (不区分大小写)
+        "path_patterns": ["docs/*"],         # 可选，fnmatch 风格的路径模式
+        "min_lines_changed": 0,              # 可选，变更行数下限 (含)
+        "max_lines_changed": 20              # 可选，变更行数上限 (含)
+    }
+    规则中给出的所有条件都满足时才算命中。条件的类型不正确 (如 extensions 不是列表、行数不是整数) 的规则会被跳过。
+    """
+    if not raw_value:
+        return []
+    rules = raw_value
+    if isinstance(raw_value, str):
+        try:
+            rules = json.loads(raw_value)
+        except json.JSONDecodeError as e:
+            logger.error(f"解析 LLM_ROUTING_RULES 配置失败: {e}。将不进行模型路由。")
+            return []
+    if not isinstance(rules, list):
+        logger.error(f"LLM_ROUTING_RULES 必须是列表，实际为 {type(rules).__name__}。将不进行模型路由。")
+        return []
+
+    valid_rules = []
+    for index, rule in enumerate(rules):
+        if not isinstance(rule, dict) or not rule.get("model"):
+            logger.warning(f"跳过无效的模型路由规则 #{index}: 缺少 model。")
+            continue
+        normalized_rule = _normalize_routing_rule(rule, index)
+        if normalized_rule is not None:
+            valid_rules.append(normalized_rule)
+    return valid_rules
+
+
+def _normalize_routing_rule(rule: dict, index: int):
+    """校验规则中各条件的类型，并将行数条件转换为整数。返回规范化后的规则副本，无效时返回 None。"""
+    normalized_rule = dict(rule)
+    for list_key in ("extensions", "path_patterns"):
+        values = rule.get(list_key)
+        if values is not None and (not isinstance(values, list) or not all(isinstance(v, str) for v in values)):
+            logger.warning(f"跳过无效的模型路由规则 #{index}: {list_key} 必须是字符串列表，实际为 {values!r}。")
+            return None
+    for int_key in ("min_lines_changed", "max_lines_changed"):
+        value = rule.get(int_key)
+        if value is None:
+            continue
+        try:
+            normalized_rule[int_key] = int(value)
+        except (TypeError, ValueError):
+            logger.warning(f"跳过无效的模型路由规则 #{index}: {int_key} 必须是整数，实际为 {value!r}。")
+            return None
+    return normalized_rule
+
+
+def _rule_matches(rule: dict, file_path: str, extension: str, lines_changed: int) -> bool:
+    extensions = rule.get("extensions")
+    if extensions and extension not in [ext.lower() for ext in extensions]:
+        return False
+    path_patterns = rule.get("path_patterns")
+    if path_patterns and not any(fnmatch.fnmatch(file_path, pattern) for pattern in path_patterns):
+        return False
+    if rule.get("min_lines_changed") is not None and lines_changed < rule["min_lines_changed"]:
+        return False
+    if rule.get("max_lines_changed") is not None and lines_changed > rule["max_lines_changed"]:
+        return False
+    return True
+
+
+def route_file_review(file_path: str, file_data: dict, default_model: str, rules: list = None) -> dict:
+    """
+    根据文件的变更特征 (路径、扩展名、lines_changed) 为单个文件选择审查模型。
+    返回路由决策 {"model": ..., "rule": 命中的规则名称或 None, "lines_changed": ...}。
+    """
+    if rules is None:
+        rules = parse_routing_rules(app_configs.get("LLM_ROUTING_RULES"))
+    lines_changed = (file_data or {}).get("lines_changed") or 0
+    extension = os.path.splitext(file_path)[1].lower()
+    for index, rule in enumerate(rules):
+        if _rule_matches(rule, file_path, extension, lines_changed):
+            return {"model": rule["model"], "rule": rule.get("name") or f"rule#{index + 1}", "lines_changed": lines_changed}
+    return {"model": default_model, "rule": None, "lines_changed": lines_changed}
+
+
+def route_file_reviews(structured_changes: dict, default_model: str) -> dict:
+    """为 structured_changes 中的每个文件选择审查模型。返回 {file_path: 路由决策}。"""
+    rules = parse_routing_rules(app_configs.get("LLM_ROUTING_RULES"))
+    decisions = {
+        file_path: route_file_review(file_path, file_data, default_model, rules)
+        for file_path, file_data in structured_changes.items()
+    }
+    if rules:
+        routed_count = sum(1 for decision in decisions.values() if decision["rule"] is not None)
+        logger.info(f"模型路由: {len(decisions)} 个文件中有 {routed_count} 个命中路由规则。")
+    return decisions
@@ -0,0 +1,178 @@
+import logging
+import time
+import redis
+import api.core_config as core_config_module
+from api.core_config import REDIS_LLM_RATE_LIMIT_KEY_PREFIX, get_int_config
+from .job_context import get_remaining_job_time
+
+logger = logging.getLogger(__name__)
+
+_REQUEST_BUCKET_KEY = f"{REDIS_LLM_RATE_LIMIT_KEY_PREFIX}requests"
+_TOKEN_BUCKET_KEY = f"{REDIS_LLM_RATE_LIMIT_KEY_PREFIX}tokens"
+
+# 令牌桶: 每个桶是一个 HASH {tokens, ts}，容量为每分钟配额，按 容量/60 每秒匀速补充。
+# 两个桶都足够时才同时扣减 (避免只扣了其中一个)，否则返回需要等待的毫秒数。
+# 使用 Redis 服务器时间，避免各副本之间的时钟偏差。
+_ACQUIRE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local wait = 0
+local levels = {}
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[(i - 1) * 2 + 1])
+    local cost = tonumber(ARGV[(i - 1) * 2 + 2])
+    if capacity > 0 then
+        local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+        local tokens = tonumber(state[1]) or capacity
+        local ts = tonumber(state[2]) or now
+        local rate = capacity / 60.0
+        tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+        levels[i] = tokens
+        if tokens < cost then
+            wait = math.max(wait, (cost - tokens) / rate)
+        end
+    end
+end
+if wait > 0 then
+    return math.ceil(wait * 1000)
+end
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[(i - 1) * 2 + 1])
+    if capacity > 0 then
+        local cost = tonumber(ARGV[(i - 1) * 2 + 2])
+        redis.call('HSET', KEYS[i], 'tokens', levels[i] - cost, 'ts', now)
+        redis.call('EXPIRE', KEYS[i], 120)
+    end
+end
+return 0
+"""
+
+# 根据响应中的实际用量修正 token 桶: delta > 0 表示实际用量超出预估，需追加扣减 (允许为负，即"欠账")；
+# delta < 0 表示预估过高，退回多扣的部分 (不超过容量)。
+_ADJUST_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local capacity = tonumber(ARGV[1])
+local delta = tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * capacity / 60.0)
+tokens = math.min(capacity, tokens - delta)
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return 0
+"""
+
+
+class LLMRateLimitExceeded(Exception):
+    """在 LLM_RATE_LIMIT_MAX_WAIT_SECONDS 或任务截止时间内未能获取集群限流名额，请求未发送。调用方应按限流错误处理 (稍后重试或放弃)。"""
+
+    def __init__(self, message: str, retry_after_seconds: float = None):
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+
+def _get_limits():
+    return max(0, get_int_config("LLM_RATE_LIMIT_RPM", 0)), max(0, get_int_config("LLM_RATE_LIMIT_TPM", 0))
+
+
+def is_token_rate_limit_enabled() -> bool:
+    """是否启用了按 token 数的集群限流 (启用时需要响应返回 usage 来修正计数)。"""
+    return core_config_module.redis_client is not None and _get_limits()[1] > 0
+
+
+def _get_token_cost(estimated_tokens: int, tpm_limit: int) -> int:
+    # 单次请求的预估 token 超过桶容量时按容量扣减，否则永远无法获取
+    return min(max(0, estimated_tokens), tpm_limit) if tpm_limit > 0 else 0
+
+
+def _eval_acquire(redis_client, rpm_limit: int, tpm_limit: int, token_cost: int):
+    """尝试从两个令牌桶中扣减，返回需要等待的毫秒数 (0 表示已扣减)。"""
+    return redis_client.eval(
+        _ACQUIRE_SCRIPT, 2, _REQUEST_BUCKET_KEY, _TOKEN_BUCKET_KEY, rpm_limit, 1, tpm_limit, token_cost)
+
+
+def acquire_llm_rate_limit(estimated_tokens: int, context_description: str) -> int:
+    """
+    在发送 LLM 请求前，从 Redis 中的集群级令牌桶获取 1 个请求名额和 estimated_tokens 个 token 名额。
+    名额不足时等待，直到获取成功、超过 LLM_RATE_LIMIT_MAX_WAIT_SECONDS 或任务截止时间。
+    Redis 不可用时放行请求 (失败开放)。
+    返回实际从 token 桶扣减的数量，供 record_llm_token_usage 修正 (请求失败时用 release_llm_token_reservation 退回)；
+    未扣减时返回 0。
+    :raises LLMRateLimitExceeded: 等待超过上限或任务截止时间，未获取名额，请求不应发送。
+    """
+    redis_client = core_config_module.redis_client
+    rpm_limit, tpm_limit = _get_limits()
+    if redis_client is None or (rpm_limit <= 0 and tpm_limit <= 0):
+        return 0
+
+    token_cost = _get_token_cost(estimated_tokens, tpm_limit)
+    max_wait = max(0, get_int_config("LLM_RATE_LIMIT_MAX_WAIT_SECONDS", 120))
+    start_time = time.monotonic()
+    while True:
+        try:
+            wait_ms = _eval_acquire(redis_client, rpm_limit, tpm_limit, token_cost)
+        except redis.exceptions.RedisError as e:
+            logger.error(f"LLM 集群限流: 访问 Redis 令牌桶出错，放行请求 ({context_description}): {e}")
+            return 0
+        if not wait_ms:
+            return token_cost
+
+        wait_seconds = int(wait_ms) / 1000
+        waited = time.monotonic() - start_time
+        remaining_job_time = get_remaining_job_time()
+        if waited + wait_seconds > max_wait or (remaining_job_time is not None and wait_seconds >= remaining_job_time):
+            logger.warning(
+                f"LLM 集群限流: 等待名额超过上限 (已等待 {waited:.1f} 秒，还需 {wait_seconds:.1f} 秒)，不发送请求 ({context_description})。")
+            raise LLMRateLimitExceeded(
+                f"cluster LLM rate limit still exhausted after waiting {waited:.1f}s", retry_after_seconds=wait_seconds)
+        logger.info(f"LLM 集群限流: 配额已用尽，等待 {wait_seconds:.2f} 秒后重试 ({context_description})。")
+        time.sleep(wait_seconds)
+
+
+def try_acquire_llm_rate_limit(estimated_tokens: int, context_description: str):
+    """
+    不等待地获取 1 个请求名额和 estimated_tokens 个 token 名额，用于可以放弃的额外请求 (如对冲请求)。
+    名额不足时返回 None，调用方不应发送该请求；未启用限流或 Redis 不可用时返回 0。
+    成功时的返回值同 acquire_llm_rate_limit，需要通过 record_llm_token_usage 修正。
+    """
+    redis_client = core_config_module.redis_client
+    rpm_limit, tpm_limit = _get_limits()
+    if redis_client is None or (rpm_limit <= 0 and tpm_limit <= 0):
+        return 0
+    token_cost = _get_token_cost(estimated_tokens, tpm_limit)
+    try:
+        wait_ms = _eval_acquire(redis_client, rpm_limit, tpm_limit, token_cost)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"LLM 集群限流: 访问 Redis 令牌桶出错，放行请求 ({context_description}): {e}")
+        return 0
+    return None if wait_ms else token_cost
+
+
+def record_llm_token_usage(reserved_tokens: int, usage, context_description: str):
+    """根据响应返回的 usage.total_tokens 修正令牌桶中预扣的 token 数。"""
+    redis_client = core_config_module.redis_client
+    tpm_limit = _get_limits()[1]
+    actual_tokens = getattr(usage, "total_tokens", None) if usage is not None else None
+    if redis_client is None or tpm_limit <= 0 or actual_tokens is None:
+        return
+    delta = int(actual_tokens) - reserved_tokens
+    if delta == 0:
+        return
+    try:
+        redis_client.eval(_ADJUST_SCRIPT, 1, _TOKEN_BUCKET_KEY, tpm_limit, delta)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"LLM 集群限流: 修正 token 用量时出错 ({context_description}): {e}")
+
+
+def release_llm_token_reservation(reserved_tokens: int, context_description: str):
+    """请求失败 (没有可用于修正的 usage) 时，把 acquire_llm_rate_limit 预扣的 token 退回令牌桶。"""
+    redis_client = core_config_module.redis_client
+    tpm_limit = _get_limits()[1]
+    if redis_client is None or tpm_limit <= 0 or not reserved_tokens:
+        return
+    try:
+        redis_client.eval(_ADJUST_SCRIPT, 1, _TOKEN_BUCKET_KEY, tpm_limit, -reserved_tokens)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"LLM 集群限流: 退回预扣的 token 时出错 ({context_description}): {e}")
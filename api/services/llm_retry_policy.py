@@ -0,0 +1,139 @@
+import email.utils
+import logging
+import random
+import re
+import time
+from openai import APIConnectionError, APIStatusError, RateLimitError
+from api.core_config import get_int_config
+from .job_context import get_remaining_job_time
+from .llm_rate_limiter import LLMRateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+ERROR_CLASS_RATE_LIMIT = "rate_limit"
+ERROR_CLASS_SERVER_ERROR = "server_error"
+ERROR_CLASS_CONNECTION = "connection"
+
+# 各错误类别的重试次数上限对应的配置项及默认值
+_RETRY_BUDGET_CONFIG = {
+    ERROR_CLASS_RATE_LIMIT: ("LLM_RETRY_MAX_ATTEMPTS_RATE_LIMIT", 5),
+    ERROR_CLASS_SERVER_ERROR: ("LLM_RETRY_MAX_ATTEMPTS_SERVER_ERROR", 3),
+    ERROR_CLASS_CONNECTION: ("LLM_RETRY_MAX_ATTEMPTS_CONNECTION", 3),
+}
+
+
+def classify_llm_error(error: Exception):
+    """将 LLM 调用异常归类为可重试的错误类别；不可重试时返回 None。"""
+    if isinstance(error, (RateLimitError, LLMRateLimitExceeded)):
+        return ERROR_CLASS_RATE_LIMIT
+    if isinstance(error, APIConnectionError):  # 包括 APITimeoutError
+        return ERROR_CLASS_CONNECTION
+    if isinstance(error, APIStatusError):
+        if error.status_code == 429:
+            return ERROR_CLASS_RATE_LIMIT
+        if error.status_code in (408, 409) or error.status_code >= 500:
+            return ERROR_CLASS_SERVER_ERROR
+    return None
+
+
+def _parse_duration_seconds(value: str):
+    """解析 "1.5"、"20ms"、"6m0s"、"1h2m3.5s" 形式的时长 (x-ratelimit-reset-* 使用此格式)。"""
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    unit_seconds = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * unit_seconds[unit] for number, unit in parts)
+
+
+def get_retry_after_seconds(headers):
+    """
+    从响应头中读取服务端建议的等待时间 (秒)，按优先级依次尝试:
+    retry-after-ms、retry-after (秒数或 HTTP 日期)、x-ratelimit-reset-requests / x-ratelimit-reset-tokens。
+    对 x-ratelimit-reset-*，优先使用剩余额度已耗尽 (x-ratelimit-remaining-* 为 0) 的那一项。
+    """
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                retry_date = email.utils.parsedate_to_datetime(retry_after)
+                return max(0.0, retry_date.timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    reset_candidates = []
+    for limit_kind in ("requests", "tokens"):
+        reset_seconds = _parse_duration_seconds(headers.get(f"x-ratelimit-reset-{limit_kind}"))
+        if reset_seconds is None:
+            continue
+        exhausted = headers.get(f"x-ratelimit-remaining-{limit_kind}") == "0"
+        reset_candidates.append((exhausted, reset_seconds))
+    if not reset_candidates:
+        return None
+    exhausted_resets = [seconds for exhausted, seconds in reset_candidates if exhausted]
+    return max(exhausted_resets or [seconds for _, seconds in reset_candidates])
+
+
+class LLMRetryPolicy:
+    """
+    LLM 调用的重试策略：指数退避 + 抖动，优先遵循服务端返回的 Retry-After / x-ratelimit-* 头，
+    每个错误类别有独立的重试次数预算，且不会超过当前任务的截止时间。
+    每次逻辑调用创建一个实例。
+    """
+
+    def __init__(self, context_description: str):
+        self._context_description = context_description
+        self._attempts_by_class = {}
+        self._base_delay = max(1, get_int_config("LLM_RETRY_BASE_DELAY_SECONDS", 1))
+        self._max_delay = max(self._base_delay, get_int_config("LLM_RETRY_MAX_DELAY_SECONDS", 60))
+
+    def get_retry_delay(self, error: Exception):
+        """
+        判断是否应重试该错误。应重试时返回等待秒数，否则返回 None。
+        调用一次即消耗对应错误类别的一次重试预算。
+        """
+        error_class = classify_llm_error(error)
+        if error_class is None:
+            return None
+        budget_key, budget_default = _RETRY_BUDGET_CONFIG[error_class]
+        attempts = self._attempts_by_class.get(error_class, 0)
+        if attempts >= max(0, get_int_config(budget_key, budget_default)):
+            logger.warning(f"LLM 请求 ({self._context_description}) 的 {error_class} 类错误重试次数已用尽 ({attempts} 次)。")
+            return None
+        self._attempts_by_class[error_class] = attempts + 1
+
+        # 指数退避，使用 "equal jitter"：在 [delay/2, delay] 之间随机，避免多个请求同时重试
+        backoff = min(self._max_delay, self._base_delay * (2 ** attempts))
+        delay = backoff / 2 + random.uniform(0, backoff / 2)
+        response = getattr(error, "response", None)
+        server_delay = get_retry_after_seconds(getattr(response, "headers", None))
+        if server_delay is None:
+            server_delay = getattr(error, "retry_after_seconds", None)  # 集群限流给出的等待时间
+        if server_delay is not None:
+            # 服务端明确给出等待时间时以其为准 (加少量抖动)，过早重试只会再次被限流；总等待仍受任务截止时间约束
+            delay = server_delay + random.uniform(0, 0.5)
+
+        remaining = get_remaining_job_time()
+        if remaining is not None and delay >= remaining:
+            logger.warning(
+                f"LLM 请求 ({self._context_description}) 需等待 {delay:.1f} 秒后重试，但任务剩余时间仅 {max(0.0, remaining):.1f} 秒，放弃重试。")
+            return None
+        logger.warning(
+            f"LLM 请求 ({self._context_description}) 遇到 {error_class} 类错误，将在 {delay:.1f} 秒后进行第 {attempts + 1} 次重试: {error}")
+        return delay
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import time
+import redis
+import api.core_config as core_config_module
+from api.core_config import REDIS_LLM_REVIEW_CACHE_KEY_PREFIX, get_bool_config, get_int_config
+
+logger = logging.getLogger(__name__)
+
+_CACHE_INDEX_KEY = f"{REDIS_LLM_REVIEW_CACHE_KEY_PREFIX}index"  # ZSET: 缓存键 -> 写入时间，用于容量淘汰
+_CACHE_STATS_KEY = f"{REDIS_LLM_REVIEW_CACHE_KEY_PREFIX}stats"  # HASH: hits / misses / stores / evictions
+
+
+def _get_entry_redis_key(cache_key: str) -> str:
+    return f"{REDIS_LLM_REVIEW_CACHE_KEY_PREFIX}entry:{cache_key}"
+
+
+def build_review_cache_key(model_name: str, system_prompt: str, user_prompt: str) -> str:
+    """根据模型名称、System Prompt 和序列化后的输入生成内容寻址的缓存键。"""
+    payload = json.dumps([model_name, system_prompt, user_prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _is_cache_available() -> bool:
+    return core_config_module.redis_client is not None and get_bool_config("LLM_REVIEW_CACHE_ENABLED", True)
+
+
+def get_cached_review(model_name: str, system_prompt: str, user_prompt: str):
+    """查找缓存的 LLM 审查输出。命中返回字符串，未命中或缓存不可用返回 None。"""
+    if not _is_cache_available():
+        return None
+    redis_client = core_config_module.redis_client
+    cache_key = build_review_cache_key(model_name, system_prompt, user_prompt)
+    try:
+        cached_bytes = redis_client.get(_get_entry_redis_key(cache_key))
+        redis_client.hincrby(_CACHE_STATS_KEY, "hits" if cached_bytes is not None else "misses", 1)
+        if cached_bytes is None:
+            return None
+        logger.info(f"LLM 审查缓存命中 (key: {cache_key[:12]}...)，跳过 LLM 请求。")
+        return cached_bytes.decode('utf-8')
+    except (redis.exceptions.RedisError, UnicodeDecodeError) as e:
+        logger.error(f"读取 LLM 审查缓存时出错 (key: {cache_key[:12]}...): {e}")
+        return None
+
+
+def store_cached_review(model_name: str, system_prompt: str, user_prompt: str, review_output: str):
+    """写入 LLM 审查输出到缓存，并在超过容量上限时淘汰最早写入的条目。"""
+    if not _is_cache_available() or review_output is None:
+        return
+    redis_client = core_config_module.redis_client
+    cache_key = build_review_cache_key(model_name, system_prompt, user_prompt)
+    ttl_seconds = max(1, get_int_config("LLM_REVIEW_CACHE_TTL_SECONDS", 60 * 60 * 24 * 7))
+    max_entries = max(1, get_int_config("LLM_REVIEW_CACHE_MAX_ENTRIES", 10000))
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(_get_entry_redis_key(cache_key), review_output, ex=ttl_seconds)
+        pipe.zadd(_CACHE_INDEX_KEY, {cache_key: time.time()})
+        pipe.hincrby(_CACHE_STATS_KEY, "stores", 1)
+        # 索引中会残留已因 TTL 过期的条目，先清理它们，再按容量淘汰最旧的条目
+        pipe.zremrangebyscore(_CACHE_INDEX_KEY, "-inf", time.time() - ttl_seconds)
+        pipe.zcard(_CACHE_INDEX_KEY)
+        index_size = pipe.execute()[-1]
+
+        overflow = index_size - max_entries
+        if overflow > 0:
+            evicted = redis_client.zpopmin(_CACHE_INDEX_KEY, overflow)
+            if evicted:
+                pipe = redis_client.pipeline()
+                pipe.delete(*[_get_entry_redis_key(member.decode('utf-8')) for member, _ in evicted])
+                pipe.hincrby(_CACHE_STATS_KEY, "evictions", len(evicted))
+                pipe.execute()
+                logger.info(f"LLM 审查缓存超过上限 {max_entries}，淘汰了 {len(evicted)} 个最旧条目。")
+    except redis.exceptions.RedisError as e:
+        logger.error(f"写入 LLM 审查缓存时出错 (key: {cache_key[:12]}...): {e}")
+
+
+def get_review_cache_stats() -> dict:
+    """返回缓存命中/未命中计数和当前条目数。"""
+    stats = {"enabled": get_bool_config("LLM_REVIEW_CACHE_ENABLED", True),
+             "hits": 0, "misses": 0, "stores": 0, "evictions": 0, "entries": 0, "hit_rate": None}
+    redis_client = core_config_module.redis_client
+    if redis_client is None:
+        return stats
+    try:
+        raw_stats = redis_client.hgetall(_CACHE_STATS_KEY)
+        for field_bytes, value_bytes in raw_stats.items():
+            stats[field_bytes.decode('utf-8')] = int(value_bytes)
+        stats["entries"] = redis_client.zcard(_CACHE_INDEX_KEY)
+    except (redis.exceptions.RedisError, ValueError) as e:
+        logger.error(f"读取 LLM 审查缓存统计时出错: {e}")
+    lookups = stats["hits"] + stats["misses"]
+    if lookups:
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4)
+    return stats
@@ -1,12 +1,22 @@
 import json
 import logging
 from openai import OpenAI # Ensure OpenAI client is available for type hinting if needed
-from api.core_config import app_configs
+from api.core_config import app_configs, get_int_config, get_bool_config
+from api.utils import split_file_changes_into_chunks, estimate_tokens, format_file_changes_compact
 from .llm_client_manager import get_openai_client, execute_llm_chat_completion
+from .concurrency_service import run_concurrently, get_per_job_concurrency, ReviewJobAborted, ReviewJobDeadlineExceeded
+from .llm_review_cache import get_cached_review, store_cached_review
+from .json_repair import (parse_llm_json_tolerantly, record_json_repair_outcome, JSON_PARSE_STRICT,
+                          JSON_PARSE_PARTIAL, JSON_PARSE_REASK, JSON_PARSE_FAILED)
 from api.prompt.prompt_loader import get_prompt
 
 logger = logging.getLogger(__name__)
 
+# 发送给 LLM 的 diff 编码格式: json 为逐行变更的 JSON 对象，compact 为紧凑的带行号 diff 文本 (见 format_file_changes_compact)
+DIFF_FORMAT_JSON = "json"
+DIFF_FORMAT_COMPACT = "compact"
+SUPPORTED_DIFF_FORMATS = (DIFF_FORMAT_JSON, DIFF_FORMAT_COMPACT)
+
 DETAILED_REVIEW_SYSTEM_PROMPT = """
 # 角色
 你现在是专业的代码审查专家，你的核心职责是深入分析提供的代码变更，发现其中潜在的错误、安全隐患、性能问题、设计缺陷或不符合最佳实践的地方。
@@ -146,8 +156,12 @@ DETAILED_REVIEW_SYSTEM_PROMPT = """
 """
 
 
-def get_openai_code_review(structured_file_changes):
-    """使用 OpenAI API 对结构化的代码变更进行 review (源自 GitHub 版本，通用性较好)"""
+def get_openai_code_review(structured_file_changes, on_review=None, model_by_path: dict = None, diff_format: str = None):
+    """
+    使用 OpenAI API 对结构化的代码变更进行 review (源自 GitHub 版本，通用性较好)
+    on_review 为可选回调，流式模式下每解析出一条审查意见即以 (file_path, review) 调用；
+    model_by_path 为可选的按文件模型路由结果；diff_format 为可选的 diff 编码格式。含义见 get_openai_detailed_reviews。
+    """
     client = get_openai_client()
     if not client:
         logger.warning("OpenAI 客户端不可用 (未初始化或初始化失败)。跳过审查。")
@@ -156,96 +170,14 @@ def get_openai_code_review(structured_file_changes):
         logger.info("未提供结构化变更以供审查。")
         return "[]"
 
-    all_reviews = []
     current_model = app_configs.get("OPENAI_MODEL", "gpt-4o")
+    reviews_by_file = get_openai_detailed_reviews(
+        structured_file_changes, client, current_model, on_review=on_review, model_by_path=model_by_path,
+        diff_format=diff_format)
 
-    for file_path, file_data in structured_file_changes.items():
-        input_data = {
-            "file_meta": {
-                "path": file_data["path"],
-                "old_path": file_data.get("old_path"),
-                "lines_changed": file_data.get("lines_changed", len(file_data["changes"])),
-                "context": file_data["context"]
-            },
-            "changes": file_data["changes"]
-        }
-        try:
-            input_json_string = json.dumps(input_data, indent=2, ensure_ascii=False)
-        except TypeError as te:
-            logger.error(f"序列化文件 {file_path} 的输入数据时出错: {te}")
-            logger.error(f"有问题的据结构: {input_data}")
-            continue
-
-        user_prompt_for_llm = f"\n\n```json\n{input_json_string}\n```\n"
-
-        try:
-            logger.info(f"正在发送文件审查请求: {file_path}...")
-            # Ensure client is fresh if settings changed (get_openai_client handles this)
-            client = get_openai_client()
-            if not client:
-                logger.warning(f"在审查 {file_path} 前 OpenAI 客户端变得不可用。将跳过此文件并继续处理其他文件。")
-                continue
-            
-            detailed_review_system_prompt = get_prompt('detailed_review')
-            if "Error: Prompt" in detailed_review_system_prompt: # Check if prompt loading failed
-                logger.error(f"无法加载详细审查的 System Prompt。跳过文件 {file_path}。错误: {detailed_review_system_prompt}")
-                continue
-
-
-            review_json_str = execute_llm_chat_completion(
-                client,
-                current_model,
-                detailed_review_system_prompt,
-                user_prompt_for_llm,
-                "细粒度审查",
-                response_format_type="json_object"
-            )
-
-            logger.info(f"-------------LLM 输出-----------")
-            logger.info(f"文件 {file_path} 的 LLM 原始输出:")
-            logger.info(f"{review_json_str}")
-            logger.info(f"-------------LLM 输出-----------")
-
-            try:
-                parsed_output = json.loads(review_json_str)
-                reviews_for_file = []
-                if isinstance(parsed_output, list):
-                    reviews_for_file = parsed_output
-                elif isinstance(parsed_output, dict):  # Check if the dict contains a list
-                    found_list = False
-                    for key, value in parsed_output.items():
-                        if isinstance(value, list):
-                            reviews_for_file = value
-                            found_list = True
-                            logger.info(f"在 LLM 输出的键 '{key}' 下找到审查列表。")
-                            break
-                    if not found_list:
-                        logger.warning(
-                            f"警告: 文件 {file_path} 的 LLM 输出是一个字典，但未找到列表值。输出: {review_json_str}")
-                        # Attempt to use the dict as a single review item if it matches structure,
-                        # otherwise, it will be filtered out by validation below.
-                        reviews_for_file = [parsed_output]
-                else:
-                    logger.warning(
-                        f"警告: 文件 {file_path} 的 LLM 输出不是 JSON 列表或预期的字典。输出: {review_json_str}")
-
-                valid_reviews_for_file = []
-                for review in reviews_for_file:
-                    if isinstance(review, dict) and all(
-                            k in review for k in ["file", "lines", "category", "severity", "analysis", "suggestion"]):
-                        if review.get("file") != file_path:
-                            logger.warning(f"警告: 修正审查中的文件路径从 '{review.get('file')}' 为 '{file_path}'")
-                            review["file"] = file_path
-                        valid_reviews_for_file.append(review)
-                    else:
-                        logger.warning(f"警告: 跳过文件 {file_path} 的无效审查项结构: {review}")
-                all_reviews.extend(valid_reviews_for_file)
-
-            except json.JSONDecodeError as json_e:
-                logger.error(f"错误: 解析来自 OpenAI 的文件 {file_path} 的 JSON 响应失败: {json_e}")
-                logger.error(f"LLM 原始输出为: {review_json_str}")
-        except Exception as e:
-            logger.exception(f"从 OpenAI 获取文件 {file_path} 的代码审查时出错:")
+    all_reviews = []
+    for file_path, reviews_for_file in reviews_by_file.items():
+        all_reviews.extend(reviews_for_file)
 
     try:
         final_json_output = json.dumps(all_reviews, ensure_ascii=False, indent=2)
@@ -257,9 +189,107 @@ def get_openai_code_review(structured_file_changes):
     return final_json_output
 
 
-def get_openai_detailed_review_for_file(file_path: str, file_data: dict, client: OpenAI, model_name: str):
+def get_openai_detailed_reviews(structured_changes: dict, client: OpenAI, model_name: str, on_review=None,
+                                model_by_path: dict = None, diff_format: str = None) -> dict:
+    """
+    并发地对多个文件进行详细审查 (受单任务并发上限和全局 LLM 并发上限约束)。
+    小文件会先被打包为批量请求 (见 _pack_review_units)，其余文件单独审查。
+    on_review 为可选回调：流式模式下每条审查意见通过校验后立即以 (file_path, review) 调用 (可能来自多个线程)，
+    便于调用方在模型仍在生成时开始发表评论。回调收到的意见同样包含在返回值中，调用方需自行去重。
+    model_by_path 为可选的 {file_path: 模型名称} (见 llm_model_router)，未指定的文件使用 model_name；
+    只有路由到同一模型的文件才会被打包到一起。
+    diff_format 为可选的 diff 编码格式 (通常来自仓库配置)，未指定时使用 LLM_DIFF_FORMAT (见 resolve_diff_format)。
+    返回 {file_path: [审查意见, ...]}，键的顺序与 structured_changes 一致，保证聚合结果稳定。
+    """
+    diff_format = resolve_diff_format(diff_format)
+    file_items = list(structured_changes.items())
+    items_by_model = {}
+    for file_path, file_data in file_items:
+        file_model = (model_by_path or {}).get(file_path) or model_name
+        items_by_model.setdefault(file_model, []).append((file_path, file_data))
+    review_units = [
+        (unit_model, unit)
+        for unit_model, model_items in items_by_model.items()
+        for unit in _pack_review_units(model_items, diff_format)
+    ]
+
+    def _review_unit(model_and_unit):
+        unit_model, unit = model_and_unit
+        if len(unit) == 1:
+            file_path, file_data = unit[0]
+            return {file_path: get_openai_detailed_review_for_file(
+                file_path, file_data, client, unit_model, on_review, diff_format)}
+        return get_openai_detailed_review_for_batch(unit, client, unit_model, on_review, diff_format)
+
+    unit_results = run_concurrently(
+        _review_unit,
+        review_units,
+        max_workers=get_per_job_concurrency(),
+        task_description="详细审查",
+        default={}
+    )
+    reviews_by_path = {}
+    for unit_result in unit_results:
+        reviews_by_path.update(unit_result or {})
+    return {file_path: reviews_by_path.get(file_path) or [] for file_path, _ in file_items}
+
+
+def resolve_diff_format(diff_format: str = None) -> str:
+    """确定 diff 编码格式: 优先使用传入值 (仓库配置)，其次为全局 LLM_DIFF_FORMAT；无效值回退为 json。"""
+    for candidate in (diff_format, app_configs.get("LLM_DIFF_FORMAT")):
+        if not candidate:
+            continue
+        normalized = str(candidate).strip().lower()
+        if normalized in SUPPORTED_DIFF_FORMATS:
+            return normalized
+        logger.warning(f"不支持的 diff 编码格式 '{candidate}'，已忽略。可选值: {', '.join(SUPPORTED_DIFF_FORMATS)}")
+    return DIFF_FORMAT_JSON
+
+
+def _get_detailed_review_prompt_key(diff_format: str) -> str:
+    return 'detailed_review_compact' if diff_format == DIFF_FORMAT_COMPACT else 'detailed_review'
+
+
+def _pack_review_units(file_items: list, diff_format: str = DIFF_FORMAT_JSON) -> list:
+    """
+    将待审查文件分组为审查单元：估算输入不超过 LLM_BATCH_MAX_TOKENS 四分之一的小文件，
+    按顺序贪心打包，每包总估算 token 不超过 LLM_BATCH_MAX_TOKENS 且文件数不超过 LLM_BATCH_MAX_FILES；
+    其余文件各自成为一个单元。LLM_BATCH_MAX_TOKENS 为 0 时不打包。
+    """
+    batch_max_tokens = get_int_config("LLM_BATCH_MAX_TOKENS", 4000)
+    batch_max_files = get_int_config("LLM_BATCH_MAX_FILES", 10)
+    if batch_max_tokens <= 0 or batch_max_files <= 1:
+        return [[item] for item in file_items]
+
+    small_file_max_tokens = batch_max_tokens // 4
+    units = []
+    current_batch, current_tokens = [], 0
+    for file_path, file_data in file_items:
+        try:
+            file_tokens = estimate_tokens(_build_detailed_review_user_prompt([(file_path, file_data or {})], diff_format))
+        except TypeError:
+            file_tokens = small_file_max_tokens + 1  # 无法序列化的文件交给单文件审查处理
+        if not file_data or file_tokens > small_file_max_tokens:
+            units.append([(file_path, file_data)])
+            continue
+        if current_batch and (current_tokens + file_tokens > batch_max_tokens or len(current_batch) >= batch_max_files):
+            units.append(current_batch)
+            current_batch, current_tokens = [], 0
+        current_batch.append((file_path, file_data))
+        current_tokens += file_tokens
+    if current_batch:
+        units.append(current_batch)
+    batched_count = sum(len(unit) for unit in units if len(unit) > 1)
+    if batched_count:
+        logger.info(f"详细审查: {batched_count} 个小文件被打包为批量请求，共 {len(units)} 个审查单元。")
+    return units
+
+
+def get_openai_detailed_review_for_file(file_path: str, file_data: dict, client: OpenAI, model_name: str, on_review=None,
+                                        diff_format: str = DIFF_FORMAT_JSON):
     """
     使用 OpenAI API 对单个文件的结构化代码变更进行详细审查。
+    变更内容超过 LLM_CHUNK_MAX_TOKENS 时，按变更块切分为多个分片并发审查，再合并各分片的审查意见。
     返回一个 Python 列表，其中包含该文件的审查意见字典。
     如果文件没有问题或发生错误，则返回空列表。
     """
@@ -270,7 +300,49 @@ def get_openai_detailed_review_for_file(file_path: str, file_data: dict, client:
         logger.info(f"未提供文件 {file_path} 的数据以供详细审查。")
         return []
 
-    input_data = {
+    chunk_max_tokens = max(500, get_int_config("LLM_CHUNK_MAX_TOKENS", 6000))
+    chunks = split_file_changes_into_chunks(file_data, chunk_max_tokens)
+    if len(chunks) == 1:
+        return _get_detailed_review_for_chunk(
+            file_path, chunks[0], client, model_name, f"文件 {file_path}", on_review, diff_format)
+
+    logger.info(f"文件 {file_path} 的变更超过 {chunk_max_tokens} tokens 预算，切分为 {len(chunks)} 个分片进行审查。")
+    chunk_results = run_concurrently(
+        lambda indexed_chunk: _get_detailed_review_for_chunk(
+            file_path, indexed_chunk[1], client, model_name,
+            f"文件 {file_path} (分片 {indexed_chunk[0] + 1}/{len(chunks)})", on_review, diff_format),
+        list(enumerate(chunks)),
+        max_workers=get_per_job_concurrency(),
+        task_description=f"文件 {file_path} 分片审查",
+        default=[]
+    )
+    return _merge_chunk_reviews(chunk_results)
+
+
+def _merge_chunk_reviews(chunk_results: list) -> list:
+    """合并各分片的审查意见：去除重复项 (相同行号与分析内容)，并按行号排序。"""
+    merged_reviews = []
+    seen_keys = set()
+    for reviews in chunk_results:
+        for review in reviews or []:
+            lines = review.get("lines") or {}
+            dedupe_key = (lines.get("old"), lines.get("new"), review.get("analysis"))
+            if dedupe_key in seen_keys:
+                continue
+            seen_keys.add(dedupe_key)
+            merged_reviews.append(review)
+
+    def _line_sort_key(review):
+        lines = review.get("lines") or {}
+        line_number = lines.get("new") if isinstance(lines.get("new"), int) else lines.get("old")
+        return line_number if isinstance(line_number, int) else 0
+
+    return sorted(merged_reviews, key=_line_sort_key)
+
+
+def _build_detailed_review_input(file_path: str, file_data: dict) -> dict:
+    """构造单个文件 (或分片) 发送给 LLM 的输入结构。"""
+    return {
         "file_meta": {
             "path": file_data.get("path", file_path), # Ensure path from file_data or argument
             "old_path": file_data.get("old_path"),
@@ -279,74 +351,256 @@ def get_openai_detailed_review_for_file(file_path: str, file_data: dict, client:
         },
         "changes": file_data.get("changes", [])
     }
+
+
+def _build_detailed_review_user_prompt(file_items: list, diff_format: str, batch: bool = False) -> str:
+    """
+    按 diff 编码格式构造 user 消息中的变更输入。file_items 为 [(file_path, file_data), ...]；
+    batch 为 True 时 json 格式输出为数组，compact 格式的多个文件以空行分隔。
+    :raises TypeError: json 格式下输入结构无法序列化。
+    """
+    if diff_format == DIFF_FORMAT_COMPACT:
+        compact_text = "\n\n".join(
+            format_file_changes_compact(dict(file_data, path=file_data.get("path", file_path)))
+            for file_path, file_data in file_items)
+        return f"\n\n```\n{compact_text}\n```\n"
+    inputs = [_build_detailed_review_input(file_path, file_data) for file_path, file_data in file_items]
+    input_json_string = json.dumps(inputs if batch else inputs[0], indent=2, ensure_ascii=False)
+    return f"\n\n```json\n{input_json_string}\n```\n"
+
+
+def _reask_for_valid_json(broken_output: str, client: OpenAI, model_name: str, target_description: str):
+    """把无法解析的输出发回模型，要求只输出修复后的合法 JSON。返回解析结果，仍失败时返回 None。"""
+    repair_system_prompt = get_prompt("json_repair")
+    if "Error: Prompt" in repair_system_prompt:
+        logger.error(f"无法加载 JSON 修复的 System Prompt，放弃重新请求 ({target_description}): {repair_system_prompt}")
+        return None
+    logger.info(f"{target_description} 的 LLM 输出无法修复为合法 JSON，要求模型重新输出...")
+    reask_output = execute_llm_chat_completion(
+        client,
+        model_name,
+        repair_system_prompt,
+        broken_output,
+        f"{target_description} 的 JSON 修复",
+        response_format_type="json_object"
+    )
+    if not reask_output or reask_output.startswith("Error:"):
+        return None
+    parsed_output, method = parse_llm_json_tolerantly(reask_output)
+    return parsed_output if method not in (JSON_PARSE_PARTIAL, JSON_PARSE_FAILED) else None
+
+
+def _request_detailed_review(system_prompt: str, user_prompt: str, client: OpenAI, model_name: str, target_description: str,
+                             on_finding=None):
+    """
+    发送一次详细审查请求 (优先使用缓存)，并从输出中提取审查意见列表。
+    on_finding 不为空时以流式模式请求，每个审查意见对象解析完成即回调 (缓存命中时不回调)。
+    输出不是合法 JSON 时依次尝试本地修复、恢复截断数组中的完整元素、要求模型重新输出 (LLM_JSON_REASK_ENABLED)。
+    返回列表；LLM 调用失败或输出无法解析时返回 None。
+    """
+    # 相同模型 + System Prompt + 输入的审查结果直接复用缓存，不再消耗 token
+    review_json_str = get_cached_review(model_name, system_prompt, user_prompt)
+    from_cache = review_json_str is not None
+    if not from_cache:
+        review_json_str = execute_llm_chat_completion(
+            client,
+            model_name,
+            system_prompt,
+            user_prompt,
+            f"{target_description} 的细粒度审查",
+            response_format_type="json_object",
+            on_finding=on_finding
+        )
+
+    logger.info(f"-------------LLM 输出 ({target_description}{', 来自缓存' if from_cache else ''})-----------")
+    logger.info(f"{review_json_str}")
+    logger.info(f"-------------LLM 输出结束 ({target_description})-----------")
+
+    if not review_json_str or review_json_str.startswith("Error:"):
+        logger.error(f"错误: {target_description} 的 LLM 调用失败: {review_json_str}")
+        return None
+
+    parsed_output, parse_method = parse_llm_json_tolerantly(review_json_str)
+    if parse_method == JSON_PARSE_FAILED and not from_cache and get_bool_config("LLM_JSON_REASK_ENABLED", True):
+        parsed_output = _reask_for_valid_json(review_json_str, client, model_name, target_description)
+        if parsed_output is not None:
+            parse_method = JSON_PARSE_REASK
+    if not from_cache:
+        record_json_repair_outcome(parse_method, target_description)
+    if parse_method == JSON_PARSE_FAILED:
+        logger.error(f"错误: 解析来自 OpenAI 的 {target_description} 的 JSON 响应失败。")
+        logger.error(f"LLM 原始输出为: {review_json_str}")
+        return None
+
+    if not from_cache and parse_method != JSON_PARSE_PARTIAL and isinstance(parsed_output, (list, dict)):
+        # 仅缓存可解析的输出，避免重放格式错误的响应；修复后的输出以规范化的 JSON 缓存，截断后部分恢复的结果不缓存
+        cached_text = review_json_str if parse_method == JSON_PARSE_STRICT else json.dumps(parsed_output, ensure_ascii=False)
+        store_cached_review(model_name, system_prompt, user_prompt, cached_text)
+    if isinstance(parsed_output, list):
+        return parsed_output
+    if isinstance(parsed_output, dict):
+        for key, value in parsed_output.items():
+            if isinstance(value, list):
+                logger.info(f"在 LLM 输出的键 '{key}' 下找到 {target_description} 的审查列表。")
+                return value
+        logger.warning(f"警告: {target_description} 的 LLM 输出是一个字典，但未找到列表值。输出: {review_json_str}")
+        return [parsed_output] # Try to treat as single item
+    logger.warning(f"警告: {target_description} 的 LLM 输出不是 JSON 列表或预期的字典。输出: {review_json_str}")
+    return []
+
+
+def _validate_file_reviews(reviews: list, file_path: str) -> list:
+    """校验审查意见的结构，并将 file 字段修正为实际文件路径。"""
+    valid_reviews = []
+    for review in reviews:
+        if isinstance(review, dict) and all(
+                k in review for k in ["file", "lines", "category", "severity", "analysis", "suggestion"]):
+            if review.get("file") != file_path:
+                logger.warning(f"警告: 修正审查中的文件路径从 '{review.get('file')}' 为 '{file_path}' (针对文件 {file_path})")
+                review["file"] = file_path
+            valid_reviews.append(review)
+        else:
+            logger.warning(f"警告: 跳过文件 {file_path} 的无效审查项结构: {review}")
+    return valid_reviews
+
+
+def _make_on_finding(on_review, resolve_path, streamed_reviews: dict = None):
+    """
+    构造流式回调：resolve_path(item) 返回审查意见所属的文件路径 (无法对应时返回 None)，
+    校验后交给 on_review(file_path, review)。streamed_reviews 不为空时按文件记录已交付的审查意见。
+    """
+    def on_finding(item):
+        target_path = resolve_path(item) if isinstance(item, dict) else None
+        if target_path is None:
+            return
+        for review in _validate_file_reviews([item], target_path):
+            if streamed_reviews is not None:
+                streamed_reviews.setdefault(target_path, []).append(review)
+            on_review(target_path, review)
+    return on_finding
+
+
+def _get_detailed_review_for_chunk(file_path: str, file_data: dict, client: OpenAI, model_name: str, target_description: str,
+                                   on_review=None, diff_format: str = DIFF_FORMAT_JSON):
+    """对单个文件 (或其一个分片) 发起一次详细审查请求，返回校验后的审查意见列表。"""
     try:
-        input_json_string = json.dumps(input_data, indent=2, ensure_ascii=False)
+        user_prompt_for_llm = _build_detailed_review_user_prompt([(file_path, file_data)], diff_format)
     except TypeError as te:
         logger.error(f"序列化文件 {file_path} 的输入数据时出错: {te}")
-        logger.error(f"有问题的输入结构: {input_data}")
+        logger.error(f"有问题的输入结构: {file_data}")
         return []
 
-    user_prompt_for_llm = f"\n\n```json\n{input_json_string}\n```\n"
-
     try:
-        logger.info(f"正在发送文件审查请求 (详细): {file_path} 给模型 {model_name}...")
+        logger.info(f"正在发送文件审查请求 (详细): {target_description} 给模型 {model_name}...")
         
-        detailed_review_system_prompt = get_prompt('detailed_review')
+        detailed_review_system_prompt = get_prompt(_get_detailed_review_prompt_key(diff_format))
         if "Error: Prompt" in detailed_review_system_prompt: # Check if prompt loading failed
             logger.error(f"无法加载详细审查的 System Prompt。跳过文件 {file_path}。错误: {detailed_review_system_prompt}")
             return []
 
-        review_json_str = execute_llm_chat_completion(
-            client,
-            model_name,
-            detailed_review_system_prompt,
-            user_prompt_for_llm,
-            f"文件 {file_path} 的细粒度审查",
-            response_format_type="json_object"
-        )
-
-        logger.info(f"-------------LLM 输出 (文件: {file_path})-----------")
-        logger.info(f"{review_json_str}")
-        logger.info(f"-------------LLM 输出结束 (文件: {file_path})-----------")
-
-        try:
-            parsed_output = json.loads(review_json_str)
-            reviews_for_this_file = []
-            if isinstance(parsed_output, list):
-                reviews_for_this_file = parsed_output
-            elif isinstance(parsed_output, dict):
-                found_list = False
-                for key, value in parsed_output.items():
-                    if isinstance(value, list):
-                        reviews_for_this_file = value
-                        found_list = True
-                        logger.info(f"在 LLM 输出的键 '{key}' 下找到文件 {file_path} 的审查列表。")
-                        break
-                if not found_list:
-                    logger.warning(
-                        f"警告: 文件 {file_path} 的 LLM 输出是一个字典，但未找到列表值。输出: {review_json_str}")
-                    reviews_for_this_file = [parsed_output] # Try to treat as single item
-            else:
-                logger.warning(
-                    f"警告: 文件 {file_path} 的 LLM 输出不是 JSON 列表或预期的字典。输出: {review_json_str}")
-                return [] # Not a valid format
-
-            valid_reviews = []
-            for review in reviews_for_this_file:
-                if isinstance(review, dict) and all(
-                        k in review for k in ["file", "lines", "category", "severity", "analysis", "suggestion"]):
-                    if review.get("file") != file_path:
-                        logger.warning(f"警告: 修正审查中的文件路径从 '{review.get('file')}' 为 '{file_path}' (针对文件 {file_path})")
-                        review["file"] = file_path
-                    valid_reviews.append(review)
-                else:
-                    logger.warning(f"警告: 跳过文件 {file_path} 的无效审查项结构: {review}")
-            return valid_reviews
-
-        except json.JSONDecodeError as json_e:
-            logger.error(f"错误: 解析来自 OpenAI 的文件 {file_path} 的 JSON 响应失败: {json_e}")
-            logger.error(f"LLM 原始输出为: {review_json_str}")
-            return []
+        # 流式输出中途失败时不会重试 (避免重复发布)，已交付的审查意见作为该文件的结果，不能当作没有问题
+        streamed_reviews = {}
+        on_finding = _make_on_finding(
+            on_review, lambda item: file_path, streamed_reviews) if on_review is not None else None
+        reviews_for_this_file = _request_detailed_review(
+            detailed_review_system_prompt, user_prompt_for_llm, client, model_name, target_description, on_finding)
+        if reviews_for_this_file is None and streamed_reviews.get(file_path):
+            logger.warning(f"{target_description} 的请求在流式交付 {len(streamed_reviews[file_path])} 条审查意见后失败，"
+                           f"使用已交付的审查意见作为结果。")
+            return streamed_reviews[file_path]
+        return _validate_file_reviews(reviews_for_this_file or [], file_path)
+    except (ReviewJobAborted, ReviewJobDeadlineExceeded):
+        raise
     except Exception as e:
         logger.exception(f"从 OpenAI 获取文件 {file_path} 的详细代码审查时出错:")
         return []
+
+
+def get_openai_detailed_review_for_batch(file_items: list, client: OpenAI, model_name: str, on_review=None,
+                                        diff_format: str = DIFF_FORMAT_JSON) -> dict:
+    """
+    将多个小文件合并为一次请求进行详细审查，再按 file 字段把审查意见拆分回各文件。
+    file_items 为 [(file_path, file_data), ...]。返回 {file_path: [审查意见, ...]}。
+    批量请求失败或输出无法解析时，回退为逐个文件审查。失败前已通过 on_review 流式交付过部分审查意见的文件同样重审
+    (无法判断该文件的意见是否已输出完整)，但重审结果中与已交付意见位置 (行号) 相同的意见会被丢弃：
+    重审的措辞不同，无法按内容去重。
+    """
+    paths = [file_path for file_path, _ in file_items]
+    results = {file_path: [] for file_path in paths}
+    target_description = f"{len(file_items)} 个文件的批量审查"
+    # old_path 也可用于匹配 (模型可能引用重命名前的路径)
+    path_aliases = {file_path: file_path for file_path in paths}
+    for file_path, file_data in file_items:
+        if file_data.get("old_path"):
+            path_aliases.setdefault(file_data["old_path"], file_path)
+
+    # 流式回调已交给 on_review 的审查意见 (按文件)；批量请求失败后重审这些文件时用于去除相同位置的意见
+    streamed_reviews = {}
+    on_finding = _make_on_finding(
+        on_review, lambda item: path_aliases.get(item.get("file")), streamed_reviews) if on_review is not None else None
+
+    try:
+        batch_input_text = _build_detailed_review_user_prompt(file_items, diff_format, batch=True)
+        prompt_key = _get_detailed_review_prompt_key(diff_format)
+        detailed_review_system_prompt = get_prompt(prompt_key)
+        batch_instructions = get_prompt(prompt_key, 'batch_instructions')
+        if "Error: Prompt" in detailed_review_system_prompt or "Error: Prompt" in batch_instructions:
+            logger.error(f"无法加载批量详细审查的 System Prompt，改为逐个文件审查: {', '.join(paths)}")
+            reviews = None
+        else:
+            # 批量说明放在 user 消息中，使 System Prompt 与单文件审查逐字节一致，可命中服务端的 Prompt 前缀缓存
+            user_prompt_for_llm = f"{batch_instructions}{batch_input_text}"
+            logger.info(f"正在发送批量审查请求 (详细): {', '.join(paths)} 给模型 {model_name}...")
+            reviews = _request_detailed_review(
+                detailed_review_system_prompt, user_prompt_for_llm,
+                client, model_name, target_description, on_finding)
+    except (ReviewJobAborted, ReviewJobDeadlineExceeded):
+        raise
+    except Exception:
+        logger.exception(f"{target_description} 出错:")
+        reviews = None
+
+    if reviews is None:
+        logger.warning(f"{target_description} 失败，回退为逐个文件审查。")
+        for file_path, file_data in file_items:
+            if file_path in streamed_reviews:
+                logger.info(f"文件 {file_path} 在批量请求失败前已流式发布 {len(streamed_reviews[file_path])} 条审查意见，"
+                            f"重审时跳过相同位置的意见。")
+                results[file_path] = _rereview_partially_streamed_file(
+                    file_path, file_data, streamed_reviews[file_path], client, model_name, on_review, diff_format)
+                continue
+            results[file_path] = get_openai_detailed_review_for_file(
+                file_path, file_data, client, model_name, on_review, diff_format)
+        return results
+
+    grouped_reviews = {file_path: [] for file_path in paths}
+    for review in reviews:
+        target_path = path_aliases.get(review.get("file")) if isinstance(review, dict) else None
+        if target_path is None:
+            logger.warning(f"警告: 批量审查返回的审查项无法对应到本批次的文件，已丢弃: {review}")
+            continue
+        grouped_reviews[target_path].append(review)
+    for file_path in paths:
+        results[file_path] = _validate_file_reviews(grouped_reviews[file_path], file_path)
+    return results
+
+
+def _rereview_partially_streamed_file(file_path: str, file_data: dict, streamed_reviews: list, client: OpenAI,
+                                      model_name: str, on_review=None, diff_format: str = DIFF_FORMAT_JSON) -> list:
+    """
+    重审在失败的批量请求中已流式交付部分意见的文件。与已交付意见位置 (行号) 相同的新意见既不交给 on_review 也不加入结果。
+    返回已交付的意见加上重审得到的其他位置的意见。
+    """
+    streamed_locations = {json.dumps(review.get("lines"), sort_keys=True) for review in streamed_reviews}
+
+    def _is_new_location(review):
+        return json.dumps(review.get("lines"), sort_keys=True) not in streamed_locations
+
+    def _on_new_location_review(target_path, review):
+        if _is_new_location(review):
+            on_review(target_path, review)
+
+    rereviewed = get_openai_detailed_review_for_file(
+        file_path, file_data, client, model_name,
+        _on_new_location_review if on_review is not None else None, diff_format)
+    return _merge_chunk_reviews([streamed_reviews, [review for review in rereviewed if _is_new_location(review)]])
@@ -2,6 +2,8 @@ import json
 import logging
 from api.core_config import app_configs
 from .llm_client_manager import get_openai_client, execute_llm_chat_completion
+from .llm_review_cache import get_cached_review, store_cached_review
+from .concurrency_service import ReviewJobAborted, ReviewJobDeadlineExceeded
 from api.prompt.prompt_loader import get_prompt
 
 logger = logging.getLogger(__name__)
@@ -45,19 +47,25 @@ def get_openai_code_review_general(file_data: dict):
             return error_msg # Return the error message to be potentially shown to user/logged
 
 
-        review_text = execute_llm_chat_completion(
-            client,
-            current_model,
-            general_review_system_prompt,
-            user_prompt_content_for_llm,  # This is already the JSON string
-            "粗粒度审查"
-            # No response_format_type for plain text Markdown
-        )
+        review_text = get_cached_review(current_model, general_review_system_prompt, user_prompt_content_for_llm)
+        if review_text is None:
+            review_text = execute_llm_chat_completion(
+                client,
+                current_model,
+                general_review_system_prompt,
+                user_prompt_content_for_llm,  # This is already the JSON string
+                "粗粒度审查"
+                # No response_format_type for plain text Markdown
+            )
+            if review_text and not review_text.startswith("Error:"):
+                store_cached_review(current_model, general_review_system_prompt, user_prompt_content_for_llm, review_text)
 
         logger.info(f"-------------LLM 粗粒度审查输出-----------")
         logger.info(review_text)
         logger.info(f"-------------LLM 粗粒度审查输出结束-----------")
         return review_text
+    except (ReviewJobAborted, ReviewJobDeadlineExceeded):
+        raise
     except Exception as e:
         logger.exception("从 OpenAI 获取粗粒度代码审查时出错:")
         return f"Error during general code review with OpenAI: {e}"
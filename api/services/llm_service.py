@@ -4,11 +4,18 @@ import logging
 from .llm_client_manager import (
     openai_client,
     initialize_openai_client,
-    get_openai_client
+    get_openai_client,
+    get_llm_endpoint_pool_status,
+    get_llm_circuit_breaker_status
 )
 
 # 从 llm_review_detailed_service 导入
-from .llm_review_detailed_service import get_openai_code_review, get_openai_detailed_review_for_file
+from .llm_review_detailed_service import (
+    get_openai_code_review, get_openai_detailed_review_for_file, get_openai_detailed_reviews, SUPPORTED_DIFF_FORMATS
+)
+
+# 从 llm_model_router 导入
+from .llm_model_router import route_file_reviews
 
 # 从 llm_review_general_service 导入
 from .llm_review_general_service import get_openai_code_review_general
@@ -20,9 +27,14 @@ __all__ = [
     "openai_client",
     "initialize_openai_client",
     "get_openai_client",
+    "get_llm_endpoint_pool_status",
+    "get_llm_circuit_breaker_status",
     "get_openai_code_review",
     "get_openai_detailed_review_for_file", # 新增导出
+    "get_openai_detailed_reviews",
     "get_openai_code_review_general",
+    "route_file_reviews",
+    "SUPPORTED_DIFF_FORMATS",
 ]
 
 logger.info("LLM 服务已初始化，将重定向到专门的服务。")
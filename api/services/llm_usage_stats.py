@@ -0,0 +1,68 @@
+import logging
+import redis
+import api.core_config as core_config_module
+from api.core_config import REDIS_LLM_USAGE_STATS_KEY
+
+logger = logging.getLogger(__name__)
+
+
+def get_cached_prompt_tokens(usage):
+    """
+    从响应的 usage 中读取命中服务端 Prompt 前缀缓存的 token 数。
+    兼容 OpenAI (prompt_tokens_details.cached_tokens) 和 DeepSeek (prompt_cache_hit_tokens) 的字段；未返回时为 None。
+    """
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        cached_tokens = details.get("cached_tokens")
+    else:
+        cached_tokens = getattr(details, "cached_tokens", None)
+    if cached_tokens is None:
+        cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+    return int(cached_tokens) if isinstance(cached_tokens, (int, float)) else None
+
+
+def record_llm_usage(usage, model_name: str, context_description: str):
+    """记录一次 LLM 请求的 token 用量 (含前缀缓存命中的 token 数)，并累加到 Redis 中的统计。"""
+    prompt_tokens = getattr(usage, "prompt_tokens", None) if usage is not None else None
+    if not isinstance(prompt_tokens, (int, float)):
+        return
+    cached_tokens = get_cached_prompt_tokens(usage)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    logger.info(
+        f"LLM 用量 ({context_description}, {model_name}): prompt {prompt_tokens} tokens"
+        f"{f' (其中 {cached_tokens} 命中前缀缓存)' if cached_tokens is not None else ''}"
+        f"{f', completion {completion_tokens} tokens' if isinstance(completion_tokens, (int, float)) else ''}。")
+
+    redis_client = core_config_module.redis_client
+    if redis_client is None:
+        return
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hincrby(REDIS_LLM_USAGE_STATS_KEY, "requests", 1)
+        pipe.hincrby(REDIS_LLM_USAGE_STATS_KEY, "prompt_tokens", int(prompt_tokens))
+        if isinstance(completion_tokens, (int, float)):
+            pipe.hincrby(REDIS_LLM_USAGE_STATS_KEY, "completion_tokens", int(completion_tokens))
+        if cached_tokens is not None:
+            pipe.hincrby(REDIS_LLM_USAGE_STATS_KEY, "cached_prompt_tokens", cached_tokens)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"记录 LLM 用量统计时出错 ({context_description}): {e}")
+
+
+def get_llm_usage_stats() -> dict:
+    """返回累计的 LLM token 用量及 Prompt 前缀缓存命中率。"""
+    stats = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_prompt_tokens": 0,
+             "prompt_cache_hit_rate": None}
+    redis_client = core_config_module.redis_client
+    if redis_client is None:
+        return stats
+    try:
+        for field_bytes, value_bytes in redis_client.hgetall(REDIS_LLM_USAGE_STATS_KEY).items():
+            stats[field_bytes.decode('utf-8')] = int(value_bytes)
+    except (redis.exceptions.RedisError, ValueError) as e:
+        logger.error(f"读取 LLM 用量统计时出错: {e}")
+    if stats["prompt_tokens"]:
+        stats["prompt_cache_hit_rate"] = round(stats["cached_prompt_tokens"] / stats["prompt_tokens"], 4)
+    return stats
@@ -1,5 +1,6 @@
 import requests
 from api.core_config import app_configs
+from api.services.http_session_pool import get_http_session
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,7 +14,7 @@ def _send_notification(url: str, payload: dict, service_name: str):
 
     headers = {'Content-Type': 'application/json'}
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
+        response = get_http_session(url).post(url, json=payload, headers=headers, timeout=15)
         response.raise_for_status()
         # 检查企业微信特定的错误码
         if service_name == "企业微信机器人" and response.json().get("errcode") != 0:
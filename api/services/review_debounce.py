@@ -0,0 +1,65 @@
+import logging
+import uuid
+import redis
+import api.core_config as core_config_module
+from api.core_config import REDIS_REVIEW_DEBOUNCE_KEY_PREFIX, get_int_config
+
+logger = logging.getLogger(__name__)
+
+# 只有仍持有最新事件令牌的一方才能认领 (认领即删除)，避免多个副本同时提交审查
+_CLAIM_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+return 0
+"""
+
+
+def _get_debounce_key(vcs_type: str, identifier: str, pr_mr_id: str) -> str:
+    return f"{REDIS_REVIEW_DEBOUNCE_KEY_PREFIX}{vcs_type}:{identifier}:{pr_mr_id}"
+
+
+def get_review_debounce_seconds(repo_config: dict = None) -> int:
+    """返回审查事件的防抖窗口 (秒)：仓库配置中的 debounce_seconds 优先，否则使用 REVIEW_DEBOUNCE_SECONDS。"""
+    repo_value = (repo_config or {}).get("debounce_seconds")
+    if repo_value is not None:
+        try:
+            return max(0, int(repo_value))
+        except (TypeError, ValueError):
+            logger.warning(f"仓库配置中的 debounce_seconds 值无效: {repo_value}，使用全局配置。")
+    return max(0, get_int_config("REVIEW_DEBOUNCE_SECONDS", 0))
+
+
+def record_review_event(vcs_type: str, identifier: str, pr_mr_id: str, window_seconds: int):
+    """
+    记录 PR/MR 的一次审查事件，返回该事件的令牌。之后的事件会覆盖令牌 (Redis，所有副本共享)，
+    因此窗口结束时只有最后一个事件能通过 claim_review_event 认领。
+    Redis 不可用时返回 None，调用方应立即提交审查 (不防抖)。
+    """
+    redis_client = core_config_module.redis_client
+    if redis_client is None:
+        return None
+    token = uuid.uuid4().hex
+    try:
+        # 过期时间留出余量，确保窗口结束时令牌仍在
+        redis_client.set(_get_debounce_key(vcs_type, identifier, pr_mr_id), token, ex=window_seconds + 60)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"记录 {vcs_type} {identifier}#{pr_mr_id} 的审查事件时 Redis 出错，不做防抖: {e}")
+        return None
+    return token
+
+
+def claim_review_event(vcs_type: str, identifier: str, pr_mr_id: str, token: str) -> bool:
+    """
+    防抖窗口结束时调用：该事件仍是 PR/MR 的最新事件时认领并返回 True，已被之后的事件合并时返回 False。
+    Redis 出错时返回 True (宁可多审查一次，也不丢失审查)。
+    """
+    redis_client = core_config_module.redis_client
+    if redis_client is None:
+        return True
+    try:
+        return bool(redis_client.eval(_CLAIM_SCRIPT, 1, _get_debounce_key(vcs_type, identifier, pr_mr_id), token))
+    except redis.exceptions.RedisError as e:
+        logger.error(f"认领 {vcs_type} {identifier}#{pr_mr_id} 的审查事件时 Redis 出错，照常审查: {e}")
+        return True
@@ -0,0 +1,102 @@
+import logging
+from datetime import datetime
+import redis
+import api.core_config as core_config_module
+from api.core_config import REDIS_ACTIVE_REVIEW_SHA_KEY_PREFIX, get_bool_config
+
+logger = logging.getLogger(__name__)
+
+# 注册表条目的过期时间；每次有新的提交提交审查任务时刷新
+_REGISTRY_TTL_SECONDS = 60 * 60 * 24 * 7
+# 运行中的任务最多每隔这么多秒查询一次注册表 (检查发生在拉取变更、LLM 请求和发表评论之前)
+SUPERSEDE_CHECK_INTERVAL_SECONDS = 5
+
+
+# 只有事件时间不早于已登记事件的提交才能替换登记的 SHA，避免乱序到达的旧事件取消新提交的审查。
+# KEYS[1] 为登记的 SHA，KEYS[2] 为其事件时间 (Unix 秒)；ARGV: head_sha, 事件时间 (空字符串表示未知), 过期秒数。
+# 返回 {是否已登记, 之前登记的 SHA}。
+_REGISTER_SCRIPT = """
+local new_ts = tonumber(ARGV[2])
+local current_ts = tonumber(redis.call('GET', KEYS[2]))
+local previous_sha = redis.call('GET', KEYS[1])
+if new_ts and current_ts and new_ts < current_ts then
+    return {0, previous_sha}
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+if new_ts then
+    redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+end
+return {1, previous_sha}
+"""
+
+
+def _get_registry_key(vcs_type: str, identifier: str, pr_mr_id: str) -> str:
+    return f"{REDIS_ACTIVE_REVIEW_SHA_KEY_PREFIX}{vcs_type}:{identifier}:{pr_mr_id}"
+
+
+def parse_event_time(value):
+    """
+    解析 Webhook 负载中的时间 (GitHub 的 "2024-01-02T03:04:05Z"、GitLab 的 "2024-01-02 03:04:05 UTC" 或带时区偏移的 ISO 8601)，
+    返回 Unix 时间戳 (秒)；无法解析时返回 None。
+    """
+    if not value or not isinstance(value, str):
+        return None
+    normalized = value.strip().replace(" UTC", "+00:00")
+    if normalized.endswith("Z"):
+        normalized = normalized[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(normalized).timestamp()
+    except ValueError:
+        logger.warning(f"无法解析 Webhook 事件时间: {value}")
+        return None
+
+
+def register_review_job(vcs_type: str, identifier: str, pr_mr_id: str, head_sha: str, event_time: str = None):
+    """
+    记录 PR/MR 最新提交审查的 head SHA (Redis，所有副本共享)。
+    之前为旧 SHA 提交的任务，无论仍在排队还是正在运行，都会在下一次检查时发现自己已被取代。
+    event_time 为 Webhook 负载中 PR/MR 的 updated_at (见 parse_event_time)：早于已登记事件的事件 (Webhook 乱序到达)
+    不会替换登记的 SHA，它自己的任务随后会因已被取代而跳过。未提供或无法解析时总是替换。
+    """
+    redis_client = core_config_module.redis_client
+    if not head_sha or redis_client is None or not get_bool_config("REVIEW_CANCEL_SUPERSEDED_ENABLED", True):
+        return
+    registry_key = _get_registry_key(vcs_type, identifier, pr_mr_id)
+    event_timestamp = parse_event_time(event_time)
+    try:
+        registered, previous_sha = redis_client.eval(
+            _REGISTER_SCRIPT, 2, registry_key, f"{registry_key}:event_time", head_sha,
+            "" if event_timestamp is None else repr(event_timestamp), _REGISTRY_TTL_SECONDS)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"登记审查任务 {vcs_type} {identifier}#{pr_mr_id} ({head_sha[:7]}) 时 Redis 出错: {e}")
+        return
+    previous_sha = previous_sha.decode('utf-8') if isinstance(previous_sha, bytes) else previous_sha
+    if not registered:
+        logger.info(f"{vcs_type} {identifier}#{pr_mr_id}: 提交 {head_sha[:7]} 的事件 ({event_time}) 早于已登记的提交 "
+                    f"{(previous_sha or '')[:7]} 的事件 (Webhook 乱序到达)，不取代其审查。")
+    elif previous_sha and previous_sha != head_sha:
+        logger.info(f"{vcs_type} {identifier}#{pr_mr_id}: 新提交 {head_sha[:7]} 取代了 {previous_sha[:7]}，"
+                    f"旧提交的审查任务将被取消。")
+
+
+def get_superseding_sha(vcs_type: str, identifier: str, pr_mr_id: str, head_sha: str):
+    """返回取代了 head_sha 的更新的 SHA；未被取代、未启用或无法判断 (Redis 不可用) 时返回 None。"""
+    redis_client = core_config_module.redis_client
+    if not head_sha or redis_client is None or not get_bool_config("REVIEW_CANCEL_SUPERSEDED_ENABLED", True):
+        return None
+    try:
+        latest_sha = redis_client.get(_get_registry_key(vcs_type, identifier, pr_mr_id))
+    except redis.exceptions.RedisError as e:
+        logger.error(f"查询审查任务 {vcs_type} {identifier}#{pr_mr_id} 是否已被取代时 Redis 出错: {e}")
+        return None
+    latest_sha = latest_sha.decode('utf-8') if isinstance(latest_sha, bytes) else latest_sha
+    return latest_sha if latest_sha and latest_sha != head_sha else None
+
+
+def watch_for_supersession(job, vcs_type: str, identifier: str, pr_mr_id: str, head_sha: str):
+    """为审查任务上下文 (见 job_context) 设置取代检查：发现有更新的提交时取消该任务。"""
+    def _probe():
+        latest_sha = get_superseding_sha(vcs_type, identifier, pr_mr_id, head_sha)
+        return f"已被新提交 {latest_sha[:7]} 取代" if latest_sha else None
+
+    job.set_cancellation_probe(_probe, SUPERSEDE_CHECK_INTERVAL_SECONDS)
@@ -0,0 +1,146 @@
+import fnmatch
+import logging
+import os
+import re
+from api.core_config import get_bool_config, get_int_config
+from .formatting_change_filter import strip_formatting_only_changes, is_formatting_only_diff
+
+logger = logging.getLogger(__name__)
+
+# 依赖锁定文件 (按文件名匹配)
+LOCKFILE_NAMES = {
+    "package-lock.json", "npm-shrinkwrap.json", "yarn.lock", "pnpm-lock.yaml", "bun.lockb",
+    "poetry.lock", "pipfile.lock", "uv.lock", "pdm.lock", "cargo.lock", "gemfile.lock", "composer.lock",
+    "go.sum", "mix.lock", "pubspec.lock", "podfile.lock", "packages.lock.json", "gradle.lockfile", "flake.lock",
+}
+# 生成的代码和压缩产物
+GENERATED_FILE_GLOBS = (
+    "*.min.js", "*.min.css", "*.map", "*.bundle.js",
+    "*_pb2.py", "*_pb2.pyi", "*_pb2_grpc.py", "*.pb.go", "*.pb.cc", "*.pb.h", "*_pb.js", "*_pb.d.ts", "*_grpc_pb.js",
+    "*.g.dart", "*.freezed.dart", "*.generated.*", "*.designer.cs",
+)
+# 第三方代码目录 (路径中任一级目录名匹配即跳过)
+VENDORED_DIR_NAMES = {"vendor", "node_modules", "third_party", "bower_components"}
+# 生成文件的标记，只在新增内容的开头若干行中查找
+_GENERATED_MARKER_PATTERN = re.compile(r'@generated\b|Code generated .* DO NOT EDIT|<auto-generated', re.IGNORECASE)
+_GENERATED_MARKER_SCAN_LINES = 30
+
+SKIP_REASON_LOCKFILE = "依赖锁定文件"
+SKIP_REASON_GENERATED = "生成的文件"
+SKIP_REASON_VENDORED = "第三方代码"
+SKIP_REASON_LONG_LINES = "超长行 (疑似压缩文件)"
+SKIP_REASON_REPO_RULE = "仓库过滤规则"
+SKIP_REASON_FORMATTING_ONLY = "仅格式变更"
+
+
+def _match_globs(file_path: str, patterns) -> bool:
+    """不含 "/" 的模式按文件名匹配，否则按完整路径匹配。"""
+    file_name = os.path.basename(file_path)
+    for pattern in patterns or []:
+        if fnmatch.fnmatch(file_path, pattern) or ("/" not in pattern and fnmatch.fnmatch(file_name, pattern)):
+            return True
+    return False
+
+
+def get_prefilter_skip_reason(file_path: str, added_lines: list, repo_rules: dict = None):
+    """
+    判断文件是否应跳过 LLM 审查。返回跳过原因，需要审查时返回 None。
+    repo_rules 为仓库配置中的可选 prefilter 字段:
+    {
+        "include_globs": ["docs/generated/api.md"],   # 始终审查 (优先于所有其他规则)
+        "exclude_globs": ["migrations/*", "*.snap"],  # 跳过匹配的路径
+        "exclude_regexes": ["^assets/.*\\.svg$"]      # 跳过匹配的路径 (re.search)
+    }
+    之后依次应用内置规则: 锁定文件名、生成文件/第三方目录、@generated 等标记、超长行。
+    """
+    repo_rules = repo_rules or {}
+    if _match_globs(file_path, repo_rules.get("include_globs")):
+        return None
+    if _match_globs(file_path, repo_rules.get("exclude_globs")):
+        return SKIP_REASON_REPO_RULE
+    for pattern in repo_rules.get("exclude_regexes") or []:
+        try:
+            if re.search(pattern, file_path):
+                return SKIP_REASON_REPO_RULE
+        except re.error as e:
+            logger.warning(f"预过滤: 忽略无效的正则规则 '{pattern}': {e}")
+
+    if os.path.basename(file_path).lower() in LOCKFILE_NAMES:
+        return SKIP_REASON_LOCKFILE
+    if _match_globs(file_path, GENERATED_FILE_GLOBS):
+        return SKIP_REASON_GENERATED
+    if any(part in VENDORED_DIR_NAMES for part in file_path.split("/")[:-1]):
+        return SKIP_REASON_VENDORED
+    if any(_GENERATED_MARKER_PATTERN.search(line) for line in added_lines[:_GENERATED_MARKER_SCAN_LINES]):
+        return SKIP_REASON_GENERATED
+    max_line_length = get_int_config("REVIEW_PREFILTER_MAX_LINE_LENGTH", 1000)
+    if max_line_length > 0 and any(len(line) > max_line_length for line in added_lines):
+        return SKIP_REASON_LONG_LINES
+    return None
+
+
+def prefilter_structured_changes(structured_changes: dict, repo_rules: dict = None):
+    """
+    对详细审查的 structured_changes ({file_path: parse_single_file_diff 结果}) 进行预过滤。
+    REVIEW_PREFILTER_ENABLED 控制按规则跳过文件；REVIEW_SKIP_FORMATTING_ONLY 控制去除仅有格式变化的变更块，
+    所有变更块都只是格式变化的文件同样被跳过。
+    返回 (需要审查的 structured_changes, {被跳过的 file_path: 原因})。
+    """
+    rules_enabled = get_bool_config("REVIEW_PREFILTER_ENABLED", True)
+    skip_formatting_only = get_bool_config("REVIEW_SKIP_FORMATTING_ONLY", True)
+    if not rules_enabled and not skip_formatting_only:
+        return structured_changes, {}
+    kept, skipped = {}, {}
+    dropped_blocks_total = 0
+    for file_path, file_data in structured_changes.items():
+        if rules_enabled:
+            added_lines = [c.get("content") or "" for c in (file_data or {}).get("changes", []) if c.get("type") == "add"]
+            reason = get_prefilter_skip_reason(file_path, added_lines, repo_rules)
+            if reason:
+                skipped[file_path] = reason
+                continue
+        if skip_formatting_only and file_data and file_data.get("changes"):
+            file_data, dropped_blocks = strip_formatting_only_changes(file_path, file_data)
+            dropped_blocks_total += dropped_blocks
+            if file_data is None:
+                skipped[file_path] = SKIP_REASON_FORMATTING_ONLY
+                continue
+        kept[file_path] = file_data
+    if dropped_blocks_total:
+        logger.info(f"预过滤: 共去除了 {dropped_blocks_total} 个仅有格式变化的变更块。")
+    _log_skipped_files(skipped, len(structured_changes))
+    return kept, skipped
+
+
+def prefilter_general_file_items(file_data_list: list, repo_rules: dict = None):
+    """
+    对通用审查的文件列表 ([{"file_path", "diff_text", ...}]) 进行预过滤 (配置项含义同 prefilter_structured_changes)。
+    返回 (需要审查的文件列表, {被跳过的 file_path: 原因})。
+    """
+    rules_enabled = get_bool_config("REVIEW_PREFILTER_ENABLED", True)
+    skip_formatting_only = get_bool_config("REVIEW_SKIP_FORMATTING_ONLY", True)
+    if not rules_enabled and not skip_formatting_only:
+        return file_data_list, {}
+    kept, skipped = [], {}
+    for file_item in file_data_list:
+        file_path = file_item.get("file_path") or ""
+        diff_text = file_item.get("diff_text") or ""
+        if rules_enabled:
+            added_lines = [line[1:] for line in diff_text.splitlines() if line.startswith("+") and not line.startswith("+++")]
+            reason = get_prefilter_skip_reason(file_path, added_lines, repo_rules)
+            if reason:
+                skipped[file_path] = reason
+                continue
+        # 通用审查会把完整 diff 发给 LLM，因此只跳过整体都是格式变化的文件，不改写部分 diff
+        if skip_formatting_only and is_formatting_only_diff(file_path, diff_text):
+            skipped[file_path] = SKIP_REASON_FORMATTING_ONLY
+            continue
+        kept.append(file_item)
+    _log_skipped_files(skipped, len(file_data_list))
+    return kept, skipped
+
+
+def _log_skipped_files(skipped: dict, total_files: int):
+    if skipped:
+        logger.info(f"预过滤: {total_files} 个文件中有 {len(skipped)} 个不发送给 LLM: "
+                    + ", ".join(f"{path} ({reason})" for path, reason in skipped.items()))
@@ -3,14 +3,115 @@ import json
 import traceback
 import logging
 import base64
-from api.core_config import app_configs, gitlab_project_configs
+from api.core_config import app_configs, gitlab_project_configs, get_int_config
 from api.utils import parse_single_file_diff
+from .concurrency_service import ReviewJobAborted, ReviewJobDeadlineExceeded, run_concurrently
+from .job_context import check_job_active, get_request_timeout
+from .http_session_pool import get_http_session, http_host_slot
+from .file_content_cache import get_cached_file_content, store_cached_file_content
+from .diff_stream_splitter import iter_file_diffs, FILE_STATUS_ADDED, FILE_STATUS_REMOVED, FILE_STATUS_RENAMED
 
 logger = logging.getLogger(__name__)
 
+# GitHub PR 文件列表 API 每页最多 100 个文件，总共最多返回 3000 个文件
+_GITHUB_FILES_PER_PAGE = 100
+_GITHUB_PR_FILES_LIMIT = 3000
+# 获取 PR/MR 变更的方式: files 为逐文件的 JSON 条目 (GitHub files API / GitLab versions API)，
+# full_diff 为一次请求获取整个 PR/MR 的 unified diff 并流式切分 (见 diff_stream_splitter)
+DIFF_FETCH_MODE_FILES = "files"
+DIFF_FETCH_MODE_FULL_DIFF = "full_diff"
+_DIFF_STREAM_CHUNK_BYTES = 64 * 1024
+# 文件过大未获取内容时返回的占位文本前缀 (不是文件的真实内容，不能缓存)
+_CONTENT_NOT_FETCHED_PREFIX = "[Content not fetched:"
+
+
+def _get_with_job_deadline(url: str, **kwargs):
+    """
+    发送 GET 请求 (拉取变更和文件内容)。请求前检查当前审查任务是否已被取消或超时 (见 job_context)，
+    请求超时不超过任务剩余时间。
+    """
+    check_job_active(f"请求 {url}")
+    kwargs["timeout"] = get_request_timeout(kwargs.get("timeout", 60))
+    return get_http_session(url).get(url, **kwargs)
+
+
+def iter_github_pr_files(files_url: str, headers: dict):
+    """
+    分页获取 GitHub PR 的文件列表 (/pulls/{n}/files)，逐个产出文件条目。
+    按 per_page=100 请求并跟随 Link 头中的 next 链接，直到最后一页或达到 GitHub 的 3000 个文件上限；
+    每一页到达后即可处理其中的文件，无需等待所有页下载完毕。请求异常由调用方处理。
+    """
+    next_url, params = files_url, {"per_page": _GITHUB_FILES_PER_PAGE}
+    file_count = 0
+    page = 0
+    while next_url:
+        page += 1
+        response = _get_with_job_deadline(next_url, headers=headers, params=params, timeout=60)
+        response.raise_for_status()
+        page_items = response.json()
+        logger.info(f"收到 PR 文件列表第 {page} 页的 {len(page_items)} 个文件条目。")
+        for file_item in page_items:
+            file_count += 1
+            yield file_item
+        next_url = response.links.get("next", {}).get("url")
+        params = None  # next 链接已包含分页参数
+    if file_count >= _GITHUB_PR_FILES_LIMIT:
+        logger.warning(f"PR 文件数达到 GitHub API 上限 ({_GITHUB_PR_FILES_LIMIT})，其余文件不会被审查: {files_url}")
+
+
+def _is_full_diff_fetch_mode() -> bool:
+    return app_configs.get("VCS_DIFF_FETCH_MODE", DIFF_FETCH_MODE_FILES) == DIFF_FETCH_MODE_FULL_DIFF
+
+
+def _open_full_diff_stream(diff_url: str, headers: dict):
+    """
+    以流式请求获取整个 PR/MR 的 unified diff，返回未读取内容的响应。
+    请求失败 (如 GitHub 对过大的 diff 返回 406) 时返回 None，调用方应回退为逐文件获取。
+    """
+    try:
+        logger.info(f"从以下地址流式获取完整 diff: {diff_url}")
+        response = _get_with_job_deadline(diff_url, headers=headers, stream=True, timeout=60)
+        response.raise_for_status()
+        return response
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"获取完整 diff ({diff_url}) 失败，回退为逐文件获取变更: {e}")
+        if 'response' in locals():
+            response.close()
+        return None
+
+
+def _iter_response_file_diffs(response):
+    """
+    边下载边切分完整 diff 响应，逐个产出文件 diff (格式见 UnifiedDiffSplitter)，结束后关闭响应。
+    读取中途断开 (如 ChunkedEncodingError) 时异常会向上传播，此时已产出的只是部分文件，调用方应放弃整个结果。
+    """
+    with response:
+        yield from iter_file_diffs(response.iter_content(chunk_size=_DIFF_STREAM_CHUNK_BYTES))
+
+
+def _iter_github_pr_file_items(files_url: str, headers: dict):
+    """
+    逐个产出 GitHub PR 的文件条目 (字段同 /pulls/{n}/files 的 filename、previous_filename、status、patch)。
+    VCS_DIFF_FETCH_MODE 为 full_diff 时通过一次 application/vnd.github.v3.diff 请求获取，
+    不受 files API 对大文件 patch 的截断影响；失败时回退为分页获取文件列表 (见 iter_github_pr_files)。
+    """
+    if _is_full_diff_fetch_mode():
+        pr_url = files_url.rsplit("/files", 1)[0]
+        response = _open_full_diff_stream(pr_url, {**headers, "Accept": "application/vnd.github.v3.diff"})
+        if response is not None:
+            for file_diff in _iter_response_file_diffs(response):
+                yield {
+                    "filename": file_diff["new_path"] or file_diff["old_path"],
+                    "previous_filename": file_diff["old_path"] if file_diff["status"] == FILE_STATUS_RENAMED else None,
+                    "status": file_diff["status"],
+                    "patch": file_diff["diff_text"],
+                }
+            return
+    yield from iter_github_pr_files(files_url, headers)
+
 
 def get_github_pr_changes(owner, repo_name, pull_number, access_token):
-    """从 GitHub API 获取 Pull Request 的变更，并为每个文件解析成结构化数据"""
+    """从 GitHub API 获取 Pull Request 的变更，并为每个文件解析成结构化数据。获取失败 (包括任一分页失败) 时返回 None"""
     if not access_token:
         logger.error(f"错误: 仓库 {owner}/{repo_name} 未配置访问令牌。")
         return None
@@ -26,17 +127,9 @@ def get_github_pr_changes(owner, repo_name, pull_number, access_token):
 
     try:
         logger.info(f"从以下地址获取 PR 文件: {files_url}")
-        response = requests.get(files_url, headers=headers, timeout=60)
-        response.raise_for_status()
-        files_data = response.json()
-
-        if not files_data:
-            logger.info(f"在 {owner}/{repo_name} 的 Pull Request {pull_number} 中未找到文件。")
-            return {}
-
-        logger.info(f"从 API 收到 PR {pull_number} 的 {len(files_data)} 个文件条目。")
-
-        for file_item in files_data:
+        file_count = 0
+        for file_item in _iter_github_pr_file_items(files_url, headers):
+            file_count += 1
             file_patch_text = file_item.get('patch')
             new_path = file_item.get('filename')
             old_path = file_item.get('previous_filename')
@@ -80,26 +173,34 @@ def get_github_pr_changes(owner, repo_name, pull_number, access_token):
             except Exception as parse_e:
                 logger.exception(f"解析文件 {new_path} 的 diff 时出错:")
 
+        if file_count == 0:
+            logger.info(f"在 {owner}/{repo_name} 的 Pull Request {pull_number} 中未找到文件。")
+            return {}
+        logger.info(f"从 API 收到 PR {pull_number} 的 {file_count} 个文件条目。")
         if not structured_changes:
             logger.info(f"在 {owner}/{repo_name} 的 PR {pull_number} 的所有文件中均未找到可解析的变更。")
 
+    # 出错时已收集的可能只是部分文件 (如第 N+1 页请求失败)，返回 None 让调用方中止审查，而不是审查部分文件
     except requests.exceptions.RequestException as e:
         logger.error(f"从 GitHub API ({files_url}) 获取数据时出错: {e}")
-        if 'response' in locals() and response is not None:
-            logger.error(f"响应状态: {response.status_code}, 响应体: {response.text[:500]}...")
+        if getattr(e, 'response', None) is not None:
+            logger.error(f"响应状态: {e.response.status_code}, 响应体: {e.response.text[:500]}...")
+        return None
     except json.JSONDecodeError as json_e:
         logger.error(f"解码来自 GitHub API ({files_url}) 的 JSON 响应时出错: {json_e}")
-        if 'response' in locals() and response is not None:
-            logger.error(f"响应文本: {response.text[:500]}...")
+        return None
+    except (ReviewJobAborted, ReviewJobDeadlineExceeded):
+        raise
     except Exception as e:
         logger.exception(
             f"获取/解析 {owner}/{repo_name} 中 PR {pull_number} 的 diff 时发生意外错误:")
+        return None
 
     return structured_changes
 
 
 def get_gitlab_mr_changes(project_id, mr_iid, access_token):
-    """从 GitLab API 获取 Merge Request 的变更，并为每个文件解析成结构化数据"""
+    """从 GitLab API 获取 Merge Request 的变更，并为每个文件解析成结构化数据。获取失败时变更为 None (位置信息仍尽量返回)"""
     if not access_token:
         logger.error(f"错误: 项目 {project_id} 未配置访问令牌。")
         return None, None
@@ -121,7 +222,7 @@ def get_gitlab_mr_changes(project_id, mr_iid, access_token):
 
     try:
         logger.info(f"从以下地址获取 MR 版本: {versions_url}")
-        response = requests.get(versions_url, headers=headers, timeout=60)
+        response = _get_with_job_deadline(versions_url, headers=headers, timeout=60)
         response.raise_for_status()
         versions_data = response.json()
 
@@ -134,16 +235,35 @@ def get_gitlab_mr_changes(project_id, mr_iid, access_token):
             }
             latest_version_id = latest_version.get("id")
             logger.info(f"从最新版本 (ID: {latest_version_id}) 提取的位置信息: {position_info}")
-
-            # current_gitlab_instance_url is already defined above using project-specific or global config
-            version_detail_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/versions/{latest_version_id}"
-            logger.info(f"从以下地址获取版本 ID {latest_version_id} 的详细信息: {version_detail_url}")
-            version_detail_response = requests.get(version_detail_url, headers=headers, timeout=60)
-            version_detail_response.raise_for_status()
-            version_detail_data = version_detail_response.json()
-
-            api_diffs = version_detail_data.get('diffs', [])
-            logger.info(f"从 API 收到版本 ID {latest_version_id} 的 {len(api_diffs)} 个文件 diff。")
+            # 较早版本的 head SHA (从新到旧)，用于增量审查时查找上一次已审查的版本
+            position_info["previous_head_shas"] = [
+                v.get("head_commit_sha") for v in versions_data[1:] if v.get("head_commit_sha")
+            ]
+
+            api_diffs = None
+            if _is_full_diff_fetch_mode():
+                raw_diffs_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/raw_diffs"
+                raw_diffs_response = _open_full_diff_stream(raw_diffs_url, headers)
+                if raw_diffs_response is not None:
+                    api_diffs = ({
+                        "diff": file_diff["diff_text"],
+                        "new_path": file_diff["new_path"] or file_diff["old_path"],
+                        "old_path": file_diff["old_path"] or file_diff["new_path"],
+                        "renamed_file": file_diff["status"] == FILE_STATUS_RENAMED,
+                        "new_file": file_diff["status"] == FILE_STATUS_ADDED,
+                        "deleted_file": file_diff["status"] == FILE_STATUS_REMOVED,
+                    } for file_diff in _iter_response_file_diffs(raw_diffs_response))
+
+            if api_diffs is None:
+                # current_gitlab_instance_url is already defined above using project-specific or global config
+                version_detail_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/versions/{latest_version_id}"
+                logger.info(f"从以下地址获取版本 ID {latest_version_id} 的详细信息: {version_detail_url}")
+                version_detail_response = _get_with_job_deadline(version_detail_url, headers=headers, timeout=60)
+                version_detail_response.raise_for_status()
+                version_detail_data = version_detail_response.json()
+
+                api_diffs = version_detail_data.get('diffs', [])
+                logger.info(f"从 API 收到版本 ID {latest_version_id} 的 {len(api_diffs)} 个文件 diff。")
 
             for diff_item in api_diffs:
                 file_diff_text = diff_item.get('diff')
@@ -174,24 +294,141 @@ def get_gitlab_mr_changes(project_id, mr_iid, access_token):
         else:
             logger.info(f"GitLab 对项目 {project_id} 的 MR {mr_iid} 的初始响应中未找到版本。")
 
+    # 出错时已解析的可能只是部分文件 (如完整 diff 在流式读取中途断开)，返回 None 让调用方中止审查
     except requests.exceptions.RequestException as e:
-        request_url = locals().get('version_detail_url') or locals().get('versions_url', 'GitLab API')
+        request_url = locals().get('version_detail_url') or locals().get('raw_diffs_url') or locals().get('versions_url', 'GitLab API')
         error_response = locals().get('version_detail_response') or locals().get('response')
         logger.error(f"从 {request_url} 获取数据时出错: {e}")
         if error_response is not None:
             logger.error(f"响应状态: {error_response.status_code}, 响应体: {error_response.text[:500]}...")
+        return None, position_info
     except json.JSONDecodeError as json_e:
         request_url = locals().get('version_detail_url') or locals().get('versions_url', 'GitLab API')
         error_response = locals().get('version_detail_response') or locals().get('response')
         logger.error(f"解码来自 {request_url} 的 JSON 响应时出错: {json_e}")
         if error_response is not None:
             logger.error(f"响应文本: {error_response.text[:500]}...")
+        return None, position_info
+    except (ReviewJobAborted, ReviewJobDeadlineExceeded):
+        raise
     except Exception as e:
         logger.exception(f"获取/解析项目 {project_id} 中 MR {mr_iid} 的 diff 时发生意外错误:")
+        return None, position_info
 
     return structured_changes, position_info
 
 
+def get_github_changed_files_between(owner, repo_name, base_sha, head_sha, access_token):
+    """
+    使用 GitHub compare API 获取两个提交之间内容发生变化的文件路径集合 (包含重命名前的路径)。
+    如果比较失败、历史已分叉 (例如 force push) 或结果可能被截断，返回 None，调用方应回退到全量审查。
+    """
+    if not access_token or not base_sha or not head_sha:
+        return None
+
+    current_github_api_url = app_configs.get("GITHUB_API_URL", "https://api.github.com")
+    compare_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/compare/{base_sha}...{head_sha}"
+    headers = {
+        "Authorization": f"token {access_token}",
+        "Accept": "application/vnd.github.v3+json"
+    }
+    try:
+        logger.info(f"从以下地址获取提交比较结果 (增量审查): {compare_url}")
+        response = _get_with_job_deadline(compare_url, headers=headers, timeout=60)
+        response.raise_for_status()
+        compare_data = response.json()
+    except requests.exceptions.RequestException as e:
+        logger.error(f"从 GitHub API ({compare_url}) 获取提交比较结果时出错: {e}")
+        return None
+    except json.JSONDecodeError as json_e:
+        logger.error(f"解码来自 GitHub API ({compare_url}) 的比较结果 JSON 时出错: {json_e}")
+        return None
+
+    status = compare_data.get("status")
+    if status not in ("ahead", "identical"):
+        logger.info(f"提交 {base_sha[:7]}...{head_sha[:7]} 的比较状态为 '{status}' (非线性历史)，不使用增量审查。")
+        return None
+    files = compare_data.get("files", [])
+    if len(files) >= 300:  # compare API 最多返回 300 个文件，结果可能不完整
+        logger.info(f"提交比较结果包含 {len(files)} 个文件，可能已被截断，不使用增量审查。")
+        return None
+
+    changed_paths = set()
+    for file_item in files:
+        if file_item.get("filename"):
+            changed_paths.add(file_item["filename"])
+        if file_item.get("previous_filename"):
+            changed_paths.add(file_item["previous_filename"])
+    logger.info(f"提交 {base_sha[:7]}...{head_sha[:7]} 之间共有 {len(changed_paths)} 个文件路径发生变化。")
+    return changed_paths
+
+
+def get_gitlab_changed_files_between(project_id, base_sha, head_sha, access_token):
+    """
+    使用 GitLab compare API 获取两个提交之间内容发生变化的文件路径集合 (包含重命名前的路径)。
+    如果比较失败或超时，返回 None，调用方应回退到全量审查。
+    """
+    if not access_token or not base_sha or not head_sha:
+        return None
+
+    project_config = gitlab_project_configs.get(str(project_id), {})
+    current_gitlab_instance_url = project_config.get("instance_url") or app_configs.get("GITLAB_INSTANCE_URL", "https://gitlab.com")
+    compare_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/repository/compare"
+    headers = {"PRIVATE-TOKEN": access_token}
+    params = {"from": base_sha, "to": head_sha, "straight": "true"}
+    try:
+        logger.info(f"从以下地址获取提交比较结果 (增量审查): {compare_url} ({base_sha[:7]}..{head_sha[:7]})")
+        response = _get_with_job_deadline(compare_url, headers=headers, params=params, timeout=60)
+        response.raise_for_status()
+        compare_data = response.json()
+    except requests.exceptions.RequestException as e:
+        logger.error(f"从 GitLab API ({compare_url}) 获取提交比较结果时出错: {e}")
+        return None
+    except json.JSONDecodeError as json_e:
+        logger.error(f"解码来自 GitLab API ({compare_url}) 的比较结果 JSON 时出错: {json_e}")
+        return None
+
+    if compare_data.get("compare_timeout"):
+        logger.info("GitLab 提交比较超时，结果可能不完整，不使用增量审查。")
+        return None
+
+    changed_paths = set()
+    for diff_item in compare_data.get("diffs", []):
+        if diff_item.get("new_path"):
+            changed_paths.add(diff_item["new_path"])
+        if diff_item.get("old_path"):
+            changed_paths.add(diff_item["old_path"])
+    logger.info(f"提交 {base_sha[:7]}..{head_sha[:7]} 之间共有 {len(changed_paths)} 个文件路径发生变化。")
+    return changed_paths
+
+
+def fetch_file_contents_concurrently(fetch_requests: list, task_description: str) -> list:
+    """
+    以有界并发获取多个文件的内容，按输入顺序返回结果列表 (与 _fetch_file_content_from_url 的返回值一致，失败时为 None)。
+    fetch_requests 的每一项为 _fetch_file_content_from_url 的关键字参数 (url、headers，可选 is_github、max_size_bytes)，
+    可额外包含 cache_key: (repo_key, ref_sha, path)，此时先查文件内容缓存，获取到真实内容后写入缓存 (见 file_content_cache)；
+    获取失败、空内容和超过大小限制的占位文本不写入缓存 (缓存键不含 max_size_bytes)，超过本次大小限制的缓存内容也不使用。
+    单个任务内的并发数为 VCS_FETCH_MAX_CONCURRENCY，且每个主机同时进行的请求不超过 HTTP_MAX_CONCURRENT_PER_HOST (所有任务共享)。
+    """
+    def _fetch(fetch_request):
+        fetch_kwargs = dict(fetch_request)
+        cache_key = fetch_kwargs.pop("cache_key", None)
+        max_size_bytes = fetch_kwargs.get("max_size_bytes")
+        if cache_key:
+            cached_content = get_cached_file_content(*cache_key)
+            if cached_content is not None and (
+                    max_size_bytes is None or len(cached_content.encode('utf-8')) <= max_size_bytes):
+                return cached_content
+        with http_host_slot(fetch_kwargs["url"]):
+            content = _fetch_file_content_from_url(**fetch_kwargs)
+        if cache_key and content and not content.startswith(_CONTENT_NOT_FETCHED_PREFIX):
+            store_cached_file_content(*cache_key, content)
+        return content
+
+    return run_concurrently(_fetch, fetch_requests, max(1, get_int_config("VCS_FETCH_MAX_CONCURRENCY", 8)),
+                            task_description, default=None)
+
+
 def _fetch_file_content_from_url(url: str, headers: dict, is_github: bool = False, max_size_bytes: int = None):
     """
     通用辅助函数，用于从给定 URL 获取文件内容。
@@ -199,7 +436,7 @@ def _fetch_file_content_from_url(url: str, headers: dict, is_github: bool = Fals
     增加了 max_size_bytes 参数用于限制通过 API 获取的文件大小。
     """
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        response = _get_with_job_deadline(url, headers=headers, timeout=30)
         response.raise_for_status()
 
         if is_github and "application/vnd.github.v3.raw" in headers.get("Accept", ""): # GitHub raw URL
@@ -219,7 +456,7 @@ def _fetch_file_content_from_url(url: str, headers: dict, is_github: bool = Fals
             file_size = data.get('size')
             if file_size is not None and max_size_bytes is not None and file_size > max_size_bytes:
                 logger.warning(f"文件 {url} 过大 ({file_size} 字节，限制 {max_size_bytes} 字节)。跳过获取内容。")
-                return f"[Content not fetched: File size ({file_size} bytes) exceeds limit {max_size_bytes} bytes]"
+                return f"{_CONTENT_NOT_FETCHED_PREFIX} File size ({file_size} bytes) exceeds limit {max_size_bytes} bytes]"
 
             if data.get("encoding") == "base64" and data.get("content"):
                 content_bytes = base64.b64decode(data["content"])
@@ -245,10 +482,27 @@ def _fetch_file_content_from_url(url: str, headers: dict, is_github: bool = Fals
         return None
 
 
-def get_github_pr_data_for_general_review(owner: str, repo_name: str, pull_number: int, access_token: str, pr_data: dict):
+def _fetch_old_contents_for_review(file_entries: list, old_content_requests: dict, file_filter, target_description: str,
+                                   base_sha: str) -> list:
+    """先用 file_filter 筛选文件条目，再并发获取保留条目的旧内容 (old_content_requests 按 id(条目) 索引)。返回保留的条目。"""
+    if file_filter is not None:
+        file_entries = file_filter(file_entries)
+    fetch_entries = [entry for entry in file_entries if id(entry) in old_content_requests]
+    logger.info(f"并发获取 {target_description} 中 {len(fetch_entries)} 个文件的旧内容 (ref: {base_sha})。")
+    old_contents = fetch_file_contents_concurrently(
+        [old_content_requests[id(entry)] for entry in fetch_entries], f"{target_description} 旧内容获取")
+    for entry, old_content in zip(fetch_entries, old_contents):
+        entry["old_content"] = old_content
+    return file_entries
+
+
+def get_github_pr_data_for_general_review(owner: str, repo_name: str, pull_number: int, access_token: str, pr_data: dict,
+                                          file_filter=None):
     """
     为 GitHub PR 获取粗粒度审查所需的数据：文件列表、每个文件的 diff、旧内容和新内容。
     pr_data 是 GitHub PR webhook 负载中的 'pull_request' 对象。
+    file_filter 为可选的回调：接收尚未获取旧内容的文件条目列表，返回需要审查的条目 (如预过滤，见 review_prefilter)，
+    只为返回的条目获取旧内容。
     """
     if not access_token:
         logger.error(f"错误: 仓库 {owner}/{repo_name} 未配置访问令牌。")
@@ -273,18 +527,11 @@ def get_github_pr_data_for_general_review(owner: str, repo_name: str, pull_numbe
     }
 
     general_review_data = []
+    old_content_requests = {}  # id(文件条目) -> 获取旧内容的请求参数
 
     try:
         logger.info(f"从 {files_url} 获取 PR 文件列表 (用于粗粒度审查)。")
-        response = requests.get(files_url, headers=headers_files_api, timeout=60)
-        response.raise_for_status()
-        files_api_data = response.json()
-
-        if not files_api_data:
-            logger.info(f"在 {owner}/{repo_name} 的 PR {pull_number} 中未找到文件。")
-            return []
-
-        for file_item in files_api_data:
+        for file_item in _iter_github_pr_file_items(files_url, headers_files_api):
             file_path = file_item.get('filename')
             status = file_item.get('status') # 'added', 'modified', 'removed', 'renamed'
             diff_text = file_item.get('patch', '')
@@ -304,14 +551,24 @@ def get_github_pr_data_for_general_review(owner: str, repo_name: str, pull_numbe
                 # Check size if available (GitHub files API doesn't give old size directly)
                 # We'll attempt to fetch and let _fetch_file_content_from_url handle large/binary via its internal JSON parsing if not raw
                 old_content_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/contents/{path_for_old_content}?ref={base_sha}"
-                logger.info(f"获取旧内容: {path_for_old_content} (ref: {base_sha}) 从 {old_content_url}")
-                file_data_entry["old_content"] = _fetch_file_content_from_url(old_content_url, headers_content_api, is_github=False, max_size_bytes=1024*1024) # Not raw, expect JSON, add size limit
+                old_content_requests[id(file_data_entry)] = {
+                    "url": old_content_url, "headers": headers_content_api, "is_github": False,
+                    "max_size_bytes": 1024*1024, # Not raw, expect JSON, add size limit
+                    "cache_key": (f"github:{current_github_api_url}/{owner}/{repo_name}", base_sha, path_for_old_content)}
 
             general_review_data.append(file_data_entry)
 
+        if not general_review_data:
+            logger.info(f"在 {owner}/{repo_name} 的 PR {pull_number} 中未找到文件。")
+
+        general_review_data = _fetch_old_contents_for_review(
+            general_review_data, old_content_requests, file_filter, f"GitHub PR {pull_number}", base_sha)
+
     except requests.exceptions.RequestException as e:
         logger.error(f"从 GitHub API ({files_url}) 获取粗粒度审查数据时出错: {e}")
         return None # Indicate error
+    except (ReviewJobAborted, ReviewJobDeadlineExceeded):
+        raise
     except Exception as e:
         logger.exception(f"为 {owner}/{repo_name} PR {pull_number} 准备粗粒度审查数据时发生意外错误:")
         return None
@@ -319,11 +576,13 @@ def get_github_pr_data_for_general_review(owner: str, repo_name: str, pull_numbe
     return general_review_data
 
 
-def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_token: str, mr_attrs: dict, position_info: dict):
+def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_token: str, mr_attrs: dict, position_info: dict,
+                                          file_filter=None):
     """
     为 GitLab MR 获取粗粒度审查所需的数据：文件列表、每个文件的 diff、旧内容和新内容。
     mr_attrs 是 GitLab MR webhook 负载中的 'object_attributes'。
     position_info 包含 'base_commit_sha', 'start_commit_sha', 'head_commit_sha'。
+    file_filter 含义同 get_github_pr_data_for_general_review。
     """
     if not access_token:
         logger.error(f"错误: 项目 {project_id} 未配置访问令牌。")
@@ -344,6 +603,7 @@ def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_t
 
     headers = {"PRIVATE-TOKEN": access_token}
     general_review_data = []
+    old_content_requests = {}  # id(文件条目) -> 获取旧内容的请求参数
 
     # GitLab MR changes are typically fetched via versions API then details of latest version
     # This gives us the diffs. We then fetch content for each file.
@@ -352,7 +612,7 @@ def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_t
         versions_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/versions"
         try:
             logger.info(f"从 {versions_url} 获取 MR 版本 (用于粗粒度审查)。")
-            versions_response = requests.get(versions_url, headers=headers, timeout=30)
+            versions_response = _get_with_job_deadline(versions_url, headers=headers, timeout=30)
             versions_response.raise_for_status()
             versions_data = versions_response.json()
             if versions_data:
@@ -367,7 +627,7 @@ def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_t
     version_detail_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/versions/{latest_version_id}"
     try:
         logger.info(f"从 {version_detail_url} 获取 MR 版本详情 (用于粗粒度审查)。")
-        detail_response = requests.get(version_detail_url, headers=headers, timeout=60)
+        detail_response = _get_with_job_deadline(version_detail_url, headers=headers, timeout=60)
         detail_response.raise_for_status()
         version_detail_data = detail_response.json()
         api_diffs = version_detail_data.get('diffs', [])
@@ -400,14 +660,20 @@ def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_t
             if not is_new and path_for_old_content:
                 encoded_old_path = requests.utils.quote(path_for_old_content, safe='')
                 old_content_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/repository/files/{encoded_old_path}?ref={base_sha}"
-                logger.info(f"获取旧内容 (GitLab): {path_for_old_content} (ref: {base_sha})")
-                file_data_entry["old_content"] = _fetch_file_content_from_url(old_content_url, headers, max_size_bytes=1024*1024)
+                old_content_requests[id(file_data_entry)] = {
+                    "url": old_content_url, "headers": headers, "max_size_bytes": 1024*1024,
+                    "cache_key": (f"gitlab:{current_gitlab_instance_url}/{project_id}", base_sha, path_for_old_content)}
             
             general_review_data.append(file_data_entry)
 
+        general_review_data = _fetch_old_contents_for_review(
+            general_review_data, old_content_requests, file_filter, f"GitLab MR {mr_iid}", base_sha)
+
     except requests.exceptions.RequestException as e:
         logger.error(f"从 GitLab API ({version_detail_url}) 获取粗粒度审查数据时出错: {e}")
         return None
+    except (ReviewJobAborted, ReviewJobDeadlineExceeded):
+        raise
     except Exception as e:
         logger.exception(f"为 GitLab MR {project_id}#{mr_iid} 准备粗粒度审查数据时发生意外错误:")
         return None
@@ -417,6 +683,7 @@ def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_t
 
 def add_github_pr_comment(owner, repo_name, pull_number, access_token, review, head_sha):
     """向 GitHub Pull Request 的特定行添加评论"""
+    check_job_active("发表评论", allow_expired=True)  # 超时后仍发表已得到的部分结果，只在任务被取消时停止
     if not access_token:
         logger.error("错误: 无法添加评论，缺少访问令牌。")
         return False
@@ -475,7 +742,7 @@ def add_github_pr_comment(owner, repo_name, pull_number, access_token, review, h
         logger.info(f"尝试向 {target_desc} 添加行评论")
 
     try:
-        response = requests.post(current_url_to_use, headers=headers, json=current_payload_to_use, timeout=30)
+        response = get_http_session(current_url_to_use).post(current_url_to_use, headers=headers, json=current_payload_to_use, timeout=30)
         response.raise_for_status()
         logger.info(f"成功向 GitHub PR #{pull_number} ({target_desc}) 添加评论")
         return True
@@ -491,8 +758,8 @@ def add_github_pr_comment(owner, repo_name, pull_number, access_token, review, h
             general_comment_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/issues/{pull_number}/comments"
             fallback_payload = {"body": f"**(评论原针对 {target_desc})**\n\n{body}"}
             try:
-                fallback_response = requests.post(general_comment_url, headers=headers, json=fallback_payload,
-                                                  timeout=30)
+                fallback_response = get_http_session(general_comment_url).post(general_comment_url, headers=headers,
+                                                                               json=fallback_payload, timeout=30)
                 fallback_response.raise_for_status()
                 logger.info(f"行评论失败后，成功作为通用 PR 讨论添加评论。")
                 return True
@@ -510,6 +777,7 @@ def add_github_pr_comment(owner, repo_name, pull_number, access_token, review, h
 
 def add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_info):
     """向 GitLab Merge Request 的特定行添加评论"""
+    check_job_active("发表评论", allow_expired=True)
     if not access_token:
         logger.error("错误: 无法添加评论，缺少访问令牌。")
         return False
@@ -581,7 +849,7 @@ def add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_inf
 
     response_obj = None  # Define response_obj to ensure it's available in except block
     try:
-        response_obj = requests.post(comment_url, headers=headers, json=payload, timeout=30)
+        response_obj = get_http_session(comment_url).post(comment_url, headers=headers, json=payload, timeout=30)
         response_obj.raise_for_status()
         logger.info(f"成功向 GitLab MR {mr_iid} ({target_desc}) 添加评论")
         return True
@@ -596,7 +864,7 @@ def add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_inf
             fallback_payload = {"body": f"**(评论原针对 {target_desc})**\n\n{body}"}
             fallback_response_obj = None
             try:
-                fallback_response_obj = requests.post(comment_url, headers=headers, json=fallback_payload, timeout=30)
+                fallback_response_obj = get_http_session(comment_url).post(comment_url, headers=headers, json=fallback_payload, timeout=30)
                 fallback_response_obj.raise_for_status()
                 logger.info(f"位置评论失败后，成功作为通用讨论添加评论。")
                 return True
@@ -614,6 +882,7 @@ def add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_inf
 
 def add_github_pr_general_comment(owner: str, repo_name: str, pull_number: int, access_token: str, review_text: str):
     """向 GitHub Pull Request 添加一个通用的粗粒度审查评论。"""
+    check_job_active("发表评论", allow_expired=True)
     if not access_token:
         logger.error("错误: 无法添加粗粒度评论，缺少访问令牌。")
         return False
@@ -632,7 +901,7 @@ def add_github_pr_general_comment(owner: str, repo_name: str, pull_number: int,
     payload = {"body": review_text}
 
     try:
-        response = requests.post(comment_url, headers=headers, json=payload, timeout=30)
+        response = get_http_session(comment_url).post(comment_url, headers=headers, json=payload, timeout=30)
         response.raise_for_status()
         logger.info(f"成功向 GitHub PR #{pull_number} 添加粗粒度审查评论。")
         return True
@@ -649,6 +918,7 @@ def add_github_pr_general_comment(owner: str, repo_name: str, pull_number: int,
 
 def add_gitlab_mr_general_comment(project_id: str, mr_iid: int, access_token: str, review_text: str):
     """向 GitLab Merge Request 添加一个通用的粗粒度审查讨论/评论。"""
+    check_job_active("发表评论", allow_expired=True)
     if not access_token:
         logger.error("错误: 无法添加粗粒度评论，缺少访问令牌。")
         return False
@@ -667,7 +937,7 @@ def add_gitlab_mr_general_comment(project_id: str, mr_iid: int, access_token: st
     
     response_obj = None
     try:
-        response_obj = requests.post(comment_url, headers=headers, json=payload, timeout=30)
+        response_obj = get_http_session(comment_url).post(comment_url, headers=headers, json=payload, timeout=30)
         response_obj.raise_for_status()
         logger.info(f"成功向 GitLab MR {mr_iid} 添加粗粒度审查评论。")
         return True
@@ -86,6 +86,168 @@ def parse_single_file_diff(diff_text, file_path, old_file_path=None):
     return file_changes
 
 
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 数，用于在发送前控制请求大小 (不依赖具体模型的分词器)。
+    按经验值估算：ASCII 字符约 4 个对应 1 个 token，CJK 等非 ASCII 字符约 1 个字符对应 1 个 token。
+    """
+    if not text:
+        return 0
+    non_ascii_count = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii_count + 3) // 4 + non_ascii_count
+
+
+def _estimate_change_tokens(change: dict) -> int:
+    # 每个变更项在 JSON 序列化后还有字段名等固定开销，按约 20 个 token 计
+    return estimate_tokens(change.get("content") or "") + 20
+
+
+def _group_changes_into_blocks(changes: list) -> list:
+    """
+    将 changes 按 diff 中的连续性分组为变更块：中间没有上下文行间隔的相邻变更属于同一块。
+    通过累计 新增-删除 的行号偏移量，把每个变更映射到新文件中的位置来判断连续性。
+    """
+    blocks = []
+    current_block = []
+    offset = 0  # 新文件行号 - 原文件行号
+    expected_position = None
+    for change in changes:
+        if change.get("type") == "delete" and change.get("old_line") is not None:
+            position = change["old_line"] + offset
+            next_position = position
+            offset -= 1
+        elif change.get("new_line") is not None:
+            position = change["new_line"]
+            next_position = position + 1
+            offset += 1
+        else:
+            position = next_position = None
+
+        if current_block and (position is None or position != expected_position):
+            blocks.append(current_block)
+            current_block = []
+        current_block.append(change)
+        expected_position = next_position
+    if current_block:
+        blocks.append(current_block)
+    return blocks
+
+
+def _filter_context_for_changes(context_text: str, changes: list, margin: int = 10) -> str:
+    """只保留位于本组变更行号范围附近的上下文行 (上下文行格式为 "旧行号 -> 新行号: 内容")。"""
+    if isinstance(context_text, list):
+        context_text = "\n".join(context_text)
+    if not context_text:
+        return ""
+    old_lines = [c["old_line"] for c in changes if c.get("old_line") is not None]
+    new_lines = [c["new_line"] for c in changes if c.get("new_line") is not None]
+    kept_lines = []
+    for context_line in context_text.split("\n"):
+        match = re.match(r'(\d+) -> (\d+): ', context_line)
+        if not match:
+            continue
+        old_num, new_num = int(match.group(1)), int(match.group(2))
+        if (new_lines and min(new_lines) - margin <= new_num <= max(new_lines) + margin) or \
+                (old_lines and min(old_lines) - margin <= old_num <= max(old_lines) + margin):
+            kept_lines.append(context_line)
+    return "\n".join(kept_lines)
+
+
+def split_file_changes_into_chunks(file_changes: dict, max_tokens: int) -> list:
+    """
+    将 parse_single_file_diff 的结果按变更块 (hunk) 对齐切分为多个分片，使每个分片的 changes 估算 token 数不超过 max_tokens。
+    每个分片与原结构相同 (path/old_path/changes/context/lines_changed)，行号保持为文件中的真实行号，
+    因此各分片的审查意见可直接合并。单个变更块本身超过预算时，才会在块内按行切分。
+    未超过预算时返回只包含原对象的列表。
+    """
+    changes = file_changes.get("changes", [])
+    if sum(_estimate_change_tokens(c) for c in changes) <= max_tokens:
+        return [file_changes]
+
+    chunk_change_lists = []
+    current_changes = []
+    current_tokens = 0
+    for block in _group_changes_into_blocks(changes):
+        block_tokens = sum(_estimate_change_tokens(c) for c in block)
+        if current_changes and current_tokens + block_tokens > max_tokens:
+            chunk_change_lists.append(current_changes)
+            current_changes, current_tokens = [], 0
+        if block_tokens <= max_tokens:
+            current_changes.extend(block)
+            current_tokens += block_tokens
+            continue
+        for change in block:  # 超大变更块：只能在块内按行切分
+            change_tokens = _estimate_change_tokens(change)
+            if current_changes and current_tokens + change_tokens > max_tokens:
+                chunk_change_lists.append(current_changes)
+                current_changes, current_tokens = [], 0
+            current_changes.append(change)
+            current_tokens += change_tokens
+    if current_changes:
+        chunk_change_lists.append(current_changes)
+
+    context = file_changes.get("context") or {}
+    chunks = []
+    for chunk_changes in chunk_change_lists:
+        chunks.append({
+            "path": file_changes.get("path"),
+            "old_path": file_changes.get("old_path"),
+            "changes": chunk_changes,
+            "context": {
+                "old": _filter_context_for_changes(context.get("old", ""), chunk_changes),
+                "new": _filter_context_for_changes(context.get("new", ""), chunk_changes),
+            },
+            "lines_changed": len([c for c in chunk_changes if c['type'] in ['add', 'delete']])
+        })
+    return chunks
+
+
+def format_file_changes_compact(file_changes: dict) -> str:
+    """
+    将 parse_single_file_diff 的结果编码为紧凑的带行号 diff 文本 (LLM_DIFF_FORMAT=compact 时使用)，
+    相比逐行 JSON 对象省去了重复的字段名和缩进。格式:
+        FILE: 路径
+        OLD_PATH: 原路径 (仅重命名时)
+        LINES_CHANGED: 变更行数
+        CONTEXT: (旧/新上下文相同时只输出一份，否则分别为 CONTEXT_OLD: / CONTEXT_NEW:)
+        旧行号 -> 新行号: 内容
+        CHANGES:
+        @@                (每个连续变更块之前)
+        -旧行号: 被删除的内容
+        +新行号: 新增的内容
+    """
+    lines = [f"FILE: {file_changes.get('path')}"]
+    if file_changes.get("old_path"):
+        lines.append(f"OLD_PATH: {file_changes['old_path']}")
+    changes = file_changes.get("changes") or []
+    lines.append(f"LINES_CHANGED: {file_changes.get('lines_changed', len(changes))}")
+
+    context = file_changes.get("context") or {}
+    context_old, context_new = context.get("old") or "", context.get("new") or ""
+    if isinstance(context_old, list):
+        context_old = "\n".join(context_old)
+    if isinstance(context_new, list):
+        context_new = "\n".join(context_new)
+    if context_old == context_new:
+        if context_new:
+            lines.extend(["CONTEXT:", context_new])
+    else:
+        if context_old:
+            lines.extend(["CONTEXT_OLD:", context_old])
+        if context_new:
+            lines.extend(["CONTEXT_NEW:", context_new])
+
+    lines.append("CHANGES:")
+    for block in _group_changes_into_blocks(changes):
+        lines.append("@@")
+        for change in block:
+            if change.get("type") == "delete":
+                lines.append(f"-{change.get('old_line')}: {change.get('content', '')}")
+            else:
+                lines.append(f"+{change.get('new_line')}: {change.get('content', '')}")
+    return "\n".join(lines)
+
+
 def require_admin_key(f):
     """装饰器：验证请求头中是否包含正确的 Admin API Key"""
 
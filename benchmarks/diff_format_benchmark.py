@@ -0,0 +1,140 @@
+"""
+对比详细审查的两种 diff 编码格式 (json / compact) 的输入 token 数和 LLM 延迟。
+
+语料为真实的 git diff：默认取当前仓库最近 N 个提交的 diff，也可以通过 --diff-dir 指定一个包含 *.diff / *.patch 文件的目录。
+
+用法:
+    python benchmarks/diff_format_benchmark.py                        # 只统计 token (离线)
+    python benchmarks/diff_format_benchmark.py --commits 50 --repo /path/to/repo
+    python benchmarks/diff_format_benchmark.py --diff-dir ./diffs
+    python benchmarks/diff_format_benchmark.py --live --max-files 10  # 额外调用 LLM 测量延迟 (使用 OPENAI_* 环境变量)
+
+token 数默认使用 api.utils.estimate_tokens 估算；安装了 tiktoken 时同时给出 cl100k_base 分词器的精确计数。
+"""
+import argparse
+import glob
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.utils import parse_single_file_diff, estimate_tokens  # noqa: E402
+from api.prompt.prompt_loader import get_prompt  # noqa: E402
+from api.services.llm_review_detailed_service import (  # noqa: E402
+    DIFF_FORMAT_JSON, DIFF_FORMAT_COMPACT, _build_detailed_review_user_prompt, _get_detailed_review_prompt_key
+)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken 是可选依赖
+    _ENCODING = None
+
+
+def _count_tokens(text: str) -> dict:
+    counts = {"estimated": estimate_tokens(text)}
+    if _ENCODING is not None:
+        counts["tiktoken"] = len(_ENCODING.encode(text))
+    return counts
+
+
+def _split_git_diff(diff_text: str) -> list:
+    """将多文件的 git diff 拆分为 [(path, old_path, 单文件 diff 文本), ...]，跳过二进制文件。"""
+    files = []
+    for section in re.split(r'^diff --git ', diff_text, flags=re.MULTILINE)[1:]:
+        header_match = re.match(r'a/(\S+) b/(\S+)', section)
+        if not header_match or "\n@@ " not in section:
+            continue
+        old_path, new_path = header_match.group(1), header_match.group(2)
+        files.append((new_path, old_path if old_path != new_path else None, section[section.index("\n@@ ") + 1:]))
+    return files
+
+
+def _load_corpus(args) -> list:
+    diff_texts = []
+    if args.diff_dir:
+        for diff_file in sorted(glob.glob(os.path.join(args.diff_dir, "*.diff")) + glob.glob(os.path.join(args.diff_dir, "*.patch"))):
+            with open(diff_file, encoding="utf-8", errors="replace") as f:
+                diff_texts.append(f.read())
+    else:
+        revisions = subprocess.run(
+            ["git", "-C", args.repo, "rev-list", "--no-merges", f"--max-count={args.commits}", "HEAD"],
+            capture_output=True, text=True, check=True).stdout.split()
+        for revision in revisions:
+            diff_texts.append(subprocess.run(
+                ["git", "-C", args.repo, "show", "--format=", "--unified=3", revision],
+                capture_output=True, text=True, errors="replace").stdout)
+
+    corpus = []
+    for diff_text in diff_texts:
+        for path, old_path, file_diff in _split_git_diff(diff_text):
+            file_data = parse_single_file_diff(file_diff, path, old_path)
+            if file_data["changes"]:
+                corpus.append((path, file_data))
+    return corpus
+
+
+def _measure_latency(file_items: list, diff_format: str) -> list:
+    from openai import OpenAI
+    client = OpenAI(base_url=os.environ.get("OPENAI_API_BASE_URL"), api_key=os.environ.get("OPENAI_API_KEY"))
+    model = os.environ.get("OPENAI_MODEL", "gpt-4o")
+    system_prompt = get_prompt(_get_detailed_review_prompt_key(diff_format))
+    latencies = []
+    for file_path, file_data in file_items:
+        user_prompt = _build_detailed_review_user_prompt([(file_path, file_data)], diff_format)
+        start_time = time.perf_counter()
+        client.chat.completions.create(model=model, messages=[
+            {"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}])
+        latencies.append(time.perf_counter() - start_time)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repo", default=".", help="从该 git 仓库的历史提交中取 diff (默认当前目录)")
+    parser.add_argument("--commits", type=int, default=30, help="取最近多少个提交 (默认 30)")
+    parser.add_argument("--diff-dir", help="改为读取该目录下的 *.diff / *.patch 文件")
+    parser.add_argument("--live", action="store_true", help="调用 LLM 测量两种格式的请求延迟")
+    parser.add_argument("--max-files", type=int, default=10, help="--live 模式下最多请求多少个文件 (默认 10)")
+    args = parser.parse_args()
+
+    corpus = _load_corpus(args)
+    if not corpus:
+        print("语料中没有可用的文本 diff。")
+        return
+
+    totals = {DIFF_FORMAT_JSON: {}, DIFF_FORMAT_COMPACT: {}}
+    ratios = []
+    for file_path, file_data in corpus:
+        per_format = {}
+        for diff_format in totals:
+            counts = _count_tokens(_build_detailed_review_user_prompt([(file_path, file_data)], diff_format))
+            per_format[diff_format] = counts
+            for counter, value in counts.items():
+                totals[diff_format][counter] = totals[diff_format].get(counter, 0) + value
+        ratios.append(per_format[DIFF_FORMAT_COMPACT]["estimated"] / max(1, per_format[DIFF_FORMAT_JSON]["estimated"]))
+
+    print(f"语料: {len(corpus)} 个文件变更, {sum(len(d['changes']) for _, d in corpus)} 个变更行")
+    for counter in totals[DIFF_FORMAT_JSON]:
+        json_total, compact_total = totals[DIFF_FORMAT_JSON][counter], totals[DIFF_FORMAT_COMPACT][counter]
+        print(f"[{counter}] 输入 token: json {json_total}, compact {compact_total}, "
+              f"节省 {json_total - compact_total} ({(1 - compact_total / max(1, json_total)) * 100:.1f}%)")
+    print(f"单文件 compact/json 比例: 中位数 {statistics.median(ratios):.2f}, 最差 {max(ratios):.2f}")
+    for diff_format in totals:
+        prompt_tokens = _count_tokens(get_prompt(_get_detailed_review_prompt_key(diff_format)))
+        print(f"System Prompt ({diff_format}) token: {prompt_tokens}")
+
+    if args.live:
+        sample = corpus[:args.max_files]
+        for diff_format in totals:
+            latencies = _measure_latency(sample, diff_format)
+            print(f"LLM 延迟 ({diff_format}, {len(sample)} 个文件): 中位数 {statistics.median(latencies):.2f}s, "
+                  f"总计 {sum(latencies):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from api.prompt import prompt_loader
+
+
+class TestPromptLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.prompt_file = os.path.join(self.temp_dir.name, "prompts.yml")
+        self._write("a:\n  system_prompt: |-\n    first\n")
+        self.patchers = [
+            patch.object(prompt_loader, "_PROMPT_FILE_PATH", self.prompt_file),
+            patch.object(prompt_loader, "_PROMPTS", None),
+            patch.object(prompt_loader, "_PROMPT_VERSIONS", {}),
+            patch.object(prompt_loader, "_PROMPT_FILE_MTIME", None),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        self.temp_dir.cleanup()
+
+    def _write(self, text, mtime_offset=0):
+        with open(self.prompt_file, "w", encoding="utf-8") as f:
+            f.write(text)
+        stat = os.stat(self.prompt_file)
+        os.utime(self.prompt_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_offset))
+
+    def test_reloads_on_mtime_change_and_bumps_version(self):
+        self.assertEqual(prompt_loader.get_prompt("a"), "first")
+        first_version = prompt_loader.get_prompt_version("a")
+        self.assertEqual(first_version["version"], 1)
+
+        self._write("a:\n  system_prompt: |-\n    second\n", mtime_offset=10 ** 9)
+
+        self.assertEqual(prompt_loader.get_prompt("a"), "second")
+        second_version = prompt_loader.get_prompt_version("a")
+        self.assertEqual(second_version["version"], 2)
+        self.assertNotEqual(second_version["hash"], first_version["hash"])
+
+    def test_invalid_reload_keeps_previous_prompts(self):
+        self.assertEqual(prompt_loader.get_prompt("a"), "first")
+        self._write("a: [unclosed\n", mtime_offset=10 ** 9)
+        self.assertEqual(prompt_loader.get_prompt("a"), "first")
+        self.assertEqual(prompt_loader.get_prompt_version("a")["version"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
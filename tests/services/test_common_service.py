@@ -14,5 +14,10 @@ class TestCommonService(unittest.TestCase):
         expected_text = "本次AI代码审查已完成，审核模型:「gpt-4o」 修改意见仅供参考，具体修改请根据实际场景进行调整。"
         self.assertEqual(get_final_summary_comment_text(), expected_text)
 
+    @patch('api.services.common_service.app_configs', {"OPENAI_MODEL": "gpt-test"})
+    def test_get_final_summary_comment_text_with_extra_notes(self):
+        text = get_final_summary_comment_text(["增量审查说明", ""])
+        self.assertTrue(text.endswith("具体修改请根据实际场景进行调整。\n\n增量审查说明"))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,30 @@
+import time
+import unittest
+from api.services.concurrency_service import run_concurrently
+
+
+class TestConcurrencyService(unittest.TestCase):
+
+    def test_run_concurrently_preserves_input_order(self):
+        def slow_identity(x):
+            time.sleep(0.01 * (5 - x))  # 先提交的项目反而更晚完成
+            return x * 10
+
+        result = run_concurrently(slow_identity, range(5), max_workers=5, task_description="test")
+        self.assertEqual(result, [0, 10, 20, 30, 40])
+
+    def test_run_concurrently_uses_default_on_error(self):
+        def fail_on_two(x):
+            if x == 2:
+                raise ValueError("boom")
+            return x
+
+        result = run_concurrently(fail_on_two, [1, 2, 3], max_workers=2, task_description="test", default=[])
+        self.assertEqual(result, [1, [], 3])
+
+    def test_run_concurrently_empty_input(self):
+        self.assertEqual(run_concurrently(lambda x: x, [], max_workers=4, task_description="test"), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from api.services.diff_stream_splitter import UnifiedDiffSplitter, iter_file_diffs
+from api.utils import parse_single_file_diff
+
+FULL_DIFF = (
+    "diff --git a/src/app.py b/src/app.py\n"
+    "index 83db48f..bf269f4 100644\n"
+    "--- a/src/app.py\n"
+    "+++ b/src/app.py\n"
+    "@@ -1,3 +1,3 @@\n"
+    " import os\n"
+    "-x = 1\n"
+    "+x = 2\n"
+    " print(x)\n"
+    "diff --git a/new.txt b/new.txt\n"
+    "new file mode 100644\n"
+    "index 0000000..e69de29\n"
+    "--- /dev/null\n"
+    "+++ b/new.txt\n"
+    "@@ -0,0 +1 @@\n"
+    "+hello\n"
+    "diff --git a/old.txt b/old.txt\n"
+    "deleted file mode 100644\n"
+    "--- a/old.txt\n"
+    "+++ /dev/null\n"
+    "@@ -1 +0,0 @@\n"
+    "-bye\n"
+    "diff --git a/a b/c.py b/a b/d.py\n"
+    "similarity index 90%\n"
+    "rename from a b/c.py\n"
+    "rename to a b/d.py\n"
+    "--- a/a b/c.py\n"
+    "+++ b/a b/d.py\n"
+    "@@ -1 +1 @@\n"
+    "-y = 1\n"
+    "+y = 2\n"
+    "diff --git \"a/\\344\\270\\255.png\" \"b/\\344\\270\\255.png\"\n"
+    "Binary files \"a/\\344\\270\\255.png\" and \"b/\\344\\270\\255.png\" differ\n"
+)
+
+
+class TestUnifiedDiffSplitter(unittest.TestCase):
+
+    def test_splits_files_with_status_and_paths(self):
+        files = list(iter_file_diffs([FULL_DIFF.encode('utf-8')]))
+
+        self.assertEqual([(f["old_path"], f["new_path"], f["status"]) for f in files], [
+            ("src/app.py", "src/app.py", "modified"),
+            (None, "new.txt", "added"),
+            ("old.txt", None, "removed"),
+            ("a b/c.py", "a b/d.py", "renamed"),
+            (None, None, "modified"),
+        ])
+        self.assertEqual(files[0]["diff_text"], "@@ -1,3 +1,3 @@\n import os\n-x = 1\n+x = 2\n print(x)\n")
+        self.assertTrue(files[4]["is_binary"])
+        self.assertEqual(files[4]["diff_text"], "")
+
+    def test_files_are_emitted_as_chunks_arrive(self):
+        splitter = UnifiedDiffSplitter()
+        data = FULL_DIFF.encode('utf-8')
+        emitted_at = []
+        for offset in range(0, len(data), 7):  # 片段边界可能切断行或多字节字符
+            for file_diff in splitter.feed(data[offset:offset + 7]):
+                emitted_at.append((file_diff["new_path"] or file_diff["old_path"], offset))
+        emitted_at.extend((f["new_path"], None) for f in splitter.close())
+
+        self.assertEqual([path for path, _ in emitted_at], ["src/app.py", "new.txt", "old.txt", "a b/d.py", None])
+        self.assertLess(emitted_at[0][1], data.index(b"diff --git a/old.txt"))
+
+    def test_pieces_feed_single_file_parser(self):
+        first = next(iter_file_diffs([FULL_DIFF]))
+        parsed = parse_single_file_diff(first["diff_text"], first["new_path"], None)
+        self.assertEqual([(c["type"], c["old_line"], c["new_line"]) for c in parsed["changes"]],
+                         [("delete", 2, None), ("add", None, 2)])
+
+    def test_unquotes_non_ascii_paths(self):
+        diff = "diff --git \"a/\\344\\270\\255.py\" \"b/\\344\\270\\255.py\"\n--- \"a/\\344\\270\\255.py\"\n" \
+               "+++ \"b/\\344\\270\\255.py\"\n@@ -1 +1 @@\n-a\n+b\n"
+        self.assertEqual(next(iter_file_diffs([diff]))["new_path"], "中.py")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import zlib
+from unittest.mock import MagicMock, patch
+from api.services import file_content_cache
+from api.services.file_content_cache import get_cached_file_content, store_cached_file_content, _ByteBoundedLRU
+
+SHA = "a" * 40
+
+
+def _fake_redis():
+    store = {}
+    mock_redis = MagicMock()
+    mock_redis.get.side_effect = lambda key: store.get(key)
+    mock_redis.set.side_effect = lambda key, value, ex=None: store.__setitem__(key, value)
+    return mock_redis, store
+
+
+@patch.dict('api.core_config.app_configs', {"FILE_CONTENT_CACHE_ENABLED": True, "FILE_CONTENT_CACHE_MEMORY_MB": 1})
+class TestFileContentCache(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.object(file_content_cache, '_memory_cache', _ByteBoundedLRU())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lru_is_bounded_by_bytes(self):
+        lru = _ByteBoundedLRU()
+        lru.put("a", "x" * 40, 100)
+        lru.put("b", "y" * 40, 100)
+        lru.get("a")
+        lru.put("c", "z" * 40, 100)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("a"), "x" * 40)
+        self.assertEqual(lru.get_usage(), {"entries": 2, "bytes": 80})
+        lru.put("huge", "h" * 200, 100)
+        self.assertIsNone(lru.get("huge"))
+
+    def test_redis_tier_is_compressed_and_backfills_memory(self):
+        mock_redis, store = _fake_redis()
+        with patch('api.core_config.redis_client', mock_redis):
+            store_cached_file_content("github:o/r", SHA, "a.py", "print('hi')\n" * 100)
+            self.assertEqual(zlib.decompress(next(iter(store.values()))).decode('utf-8'), "print('hi')\n" * 100)
+
+            file_content_cache._memory_cache = _ByteBoundedLRU()  # 模拟另一个副本
+            self.assertEqual(get_cached_file_content("github:o/r", SHA, "a.py"), "print('hi')\n" * 100)
+            mock_redis.get.reset_mock()
+            self.assertEqual(get_cached_file_content("github:o/r", SHA, "a.py"), "print('hi')\n" * 100)
+            mock_redis.get.assert_not_called()
+            self.assertIsNone(get_cached_file_content("github:o/r", SHA, "b.py"))
+            self.assertIsNone(get_cached_file_content("github:other/r", SHA, "a.py"))
+
+    @patch('api.core_config.redis_client', None)
+    def test_mutable_refs_are_not_cached(self):
+        store_cached_file_content("github:o/r", "main", "a.py", "x")
+        self.assertIsNone(get_cached_file_content("github:o/r", "main", "a.py"))
+
+    @patch('api.services.vcs_service._fetch_file_content_from_url', return_value="old")
+    @patch('api.core_config.redis_client', None)
+    def test_concurrent_fetcher_uses_cache(self, mock_fetch):
+        from api.services.vcs_service import fetch_file_contents_concurrently
+        fetch_request = {"url": "https://api.github.com/c/a.py", "headers": {}, "cache_key": ("github:o/r", SHA, "a.py")}
+        self.assertEqual(fetch_file_contents_concurrently([fetch_request], "test"), ["old"])
+        self.assertEqual(fetch_file_contents_concurrently([fetch_request], "test"), ["old"])
+        self.assertEqual(mock_fetch.call_count, 1)
+        self.assertNotIn("cache_key", mock_fetch.call_args.kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
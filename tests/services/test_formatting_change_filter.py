@@ -0,0 +1,72 @@
+import unittest
+from api.utils import parse_single_file_diff
+from api.services.formatting_change_filter import (
+    is_formatting_only_block, strip_formatting_only_changes, is_formatting_only_diff
+)
+
+
+class TestFormattingChangeFilter(unittest.TestCase):
+
+    def test_python_black_reformat_is_formatting_only(self):
+        removed = ["    result = call_api(user_id,'name', retries = 3)"]
+        added = ["    result = call_api(", "        user_id,", '        "name",', "        retries=3,", "    )"]
+        self.assertTrue(is_formatting_only_block("svc.py", removed, added))
+
+    def test_python_semantic_changes_are_kept(self):
+        self.assertFalse(is_formatting_only_block("a.py", ["x = (1,)"], ["x = (1)"]))
+        self.assertFalse(is_formatting_only_block("a.py", ["x = 1"], ["    x = 1"]))
+        self.assertFalse(is_formatting_only_block("a.py", ["x = 1  # old"], ["x = 1  # new"]))
+        # 单独修改的 def 行也能按 AST 比较
+        self.assertTrue(is_formatting_only_block("a.py", ["def f(a,b):"], ["def f(a, b):"]))
+        self.assertFalse(is_formatting_only_block("a.py", ["def f(a,b):"], ["def f(a, c):"]))
+
+    def test_whitespace_insensitive_languages(self):
+        self.assertTrue(is_formatting_only_block(
+            "app.ts", ["const x = foo(a,b)"], ["const x = foo(", "  a,", "  b,", ")"]))
+        self.assertFalse(is_formatting_only_block("app.ts", ['log("a  b")'], ['log("a b")']))
+        self.assertTrue(is_formatting_only_block("app.ts", ["x = 1;", "", "y = 2;"], ["x = 1;", "y = 2;"]))
+
+    def test_newlines_with_semantic_meaning_are_kept(self):
+        # 自动分号插入：return 后换行会返回 undefined
+        self.assertFalse(is_formatting_only_diff(
+            "a.js", "@@ -1 +1,2 @@\n-return a + b;\n+return\n+a + b;\n"))
+        # 行注释到行尾为止：合并两行后 "+ b" 落入注释
+        self.assertFalse(is_formatting_only_diff(
+            "a.js", "@@ -1,2 +1 @@\n-x = a // note\n-+ b;\n+x = a // note + b;\n"))
+        # 换行断开的语句合并后变成函数调用
+        self.assertFalse(is_formatting_only_diff(
+            "a.js", "@@ -1,2 +1 @@\n-let y = a\n-(b)\n+let y = a(b)\n"))
+
+    def test_space_between_operator_characters_is_kept(self):
+        self.assertFalse(is_formatting_only_block("a.js", ["if (a & &b) {}"], ["if (a&&b) {}"]))
+        self.assertFalse(is_formatting_only_block("a.js", ["y = x - -z;"], ["y = x--z;"]))
+        self.assertTrue(is_formatting_only_block("a.js", ["y = x - -z;"], ["y=x - -z;"]))
+
+    def test_css_whitespace_is_significant(self):
+        self.assertFalse(is_formatting_only_block("a.css", [".a .b {}"], [".a.b {}"]))
+
+    def test_other_files_only_ignore_trailing_whitespace(self):
+        self.assertTrue(is_formatting_only_block("conf.yml", ["key: 1   ", ""], ["key: 1"]))
+        self.assertFalse(is_formatting_only_block("conf.yml", ["  key: 1"], ["key: 1"]))
+
+    def test_strip_keeps_real_hunks(self):
+        diff_text = (
+            "@@ -1,3 +1,3 @@\n"
+            "-x=1\n"
+            "+x = 1\n"
+            " keep\n"
+            "-y = 2\n"
+            "+y = 3\n"
+        )
+        file_data = parse_single_file_diff(diff_text, "m.py")
+        stripped, dropped = strip_formatting_only_changes("m.py", file_data)
+        self.assertEqual(dropped, 1)
+        self.assertEqual([c["content"] for c in stripped["changes"]], ["y = 2", "y = 3"])
+        self.assertEqual(stripped["lines_changed"], 2)
+
+        self.assertTrue(is_formatting_only_diff("m.py", "@@ -1 +1 @@\n-x=1\n+x = 1\n"))
+        self.assertFalse(is_formatting_only_diff("m.py", diff_text))
+
+
+if __name__ == '__main__':
+    unittest.main()
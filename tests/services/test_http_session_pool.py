@@ -0,0 +1,75 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from api.services import http_session_pool
+from api.services.http_session_pool import get_http_session, get_http_pool_stats
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _SetCookieHandler(_KeepAliveHandler):
+    received_cookies = []
+
+    def do_GET(self):
+        self.received_cookies.append(self.headers.get("Cookie"))
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Set-Cookie", "_gitlab_session=secret; Path=/")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@patch.dict(http_session_pool._sessions, clear=True)
+class TestHttpSessionPool(unittest.TestCase):
+
+    def test_sessions_are_shared_per_host(self):
+        session = get_http_session("https://api.github.com/repos/o/r/pulls/1/files")
+        self.assertIs(session, get_http_session("https://API.github.com/repos/o/r/issues/1/comments"))
+        self.assertIsNot(session, get_http_session("https://gitlab.com/api/v4/projects/1"))
+
+    def test_connections_are_reused(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/files"
+            for _ in range(3):
+                self.assertEqual(get_http_session(url).get(url, timeout=5).json(), [])
+            stats = get_http_pool_stats()[f"http://127.0.0.1:{server.server_address[1]}"]
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["connections_opened"], 1)
+        self.assertEqual(stats["reused"], 2)
+
+    def test_cookies_are_not_shared_between_requests(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _SetCookieHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/projects"
+            session = get_http_session(url)
+            session.get(url, headers={"PRIVATE-TOKEN": "tenant-a"}, timeout=5)
+            session.get(url, headers={"PRIVATE-TOKEN": "tenant-b"}, timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(_SetCookieHandler.received_cookies, [None, None])
+        self.assertEqual(len(session.cookies), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.concurrency_service import run_concurrently, ReviewJobCancelled, ReviewJobDeadlineExceeded
+from api.services.job_context import review_job_context, check_job_active, get_request_timeout, is_job_timed_out
+from api.services.llm_client_manager import execute_llm_chat_completion
+
+
+class TestJobContext(unittest.TestCase):
+
+    def test_no_job_means_no_limits(self):
+        check_job_active("任意阶段")
+        self.assertEqual(get_request_timeout(60), 60)
+        self.assertFalse(is_job_timed_out())
+
+    def test_request_timeout_bounded_by_remaining_time(self):
+        with review_job_context("test", 10):
+            self.assertLessEqual(get_request_timeout(60), 10)
+            self.assertEqual(get_request_timeout(5), 5)
+
+    @patch('api.services.job_context.time.monotonic')
+    def test_expired_job_abandons_stage_but_allows_posting(self, mock_monotonic):
+        mock_monotonic.return_value = 1000.0
+        with review_job_context("test", 30) as job:
+            mock_monotonic.return_value = 1031.0
+            with self.assertRaises(ReviewJobDeadlineExceeded):
+                check_job_active("文件 a.py 的细粒度审查")
+            check_job_active("发表评论", allow_expired=True)
+            self.assertTrue(is_job_timed_out())
+            self.assertEqual(job.abandoned_stages, ["文件 a.py 的细粒度审查"])
+            self.assertEqual(get_request_timeout(60), 1.0)
+
+    def test_cancelled_job_stops_every_stage(self):
+        with review_job_context("test", 0) as job:
+            job.cancel("有新的提交")
+            with self.assertRaises(ReviewJobCancelled):
+                check_job_active("发表评论", allow_expired=True)
+            self.assertFalse(is_job_timed_out())
+
+    def test_budget_is_capped_per_job(self):
+        with review_job_context("test", 0) as job:
+            self.assertEqual([job.try_consume_budget("llm_hedge", 2) for _ in range(3)], [True, True, False])
+
+    def test_run_concurrently_keeps_completed_results_after_deadline(self):
+        def _review(item):
+            if item == "late":
+                raise ReviewJobDeadlineExceeded("超时")
+            return item.upper()
+
+        self.assertEqual(run_concurrently(_review, ["a", "late", "b"], 3, "test", default=""), ["A", "", "B"])
+
+    @patch('api.services.job_context.time.monotonic')
+    def test_llm_call_not_sent_after_deadline(self, mock_monotonic):
+        mock_monotonic.return_value = 1000.0
+        mock_client = MagicMock()
+        with review_job_context("test", 30):
+            mock_monotonic.return_value = 1031.0
+            with self.assertRaises(ReviewJobDeadlineExceeded):
+                execute_llm_chat_completion(mock_client, "gpt-test", "sys", "user", "文件 a.py 的细粒度审查")
+            self.assertTrue(is_job_timed_out())
+        mock_client.chat.completions.create.assert_not_called()
+
+    def test_llm_request_timeout_follows_job_deadline(self):
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content="[]"))])
+        with review_job_context("test", 120):
+            self.assertEqual(execute_llm_chat_completion(mock_client, "gpt-test", "sys", "user", "test"), "[]")
+        self.assertLessEqual(mock_client.chat.completions.create.call_args.kwargs["timeout"], 120)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.json_repair import (parse_llm_json_tolerantly, repair_json_text, record_json_repair_outcome,
+                                      JSON_PARSE_STRICT, JSON_PARSE_EXTRACTED, JSON_PARSE_REPAIRED,
+                                      JSON_PARSE_PARTIAL, JSON_PARSE_FAILED)
+from api.services.llm_review_detailed_service import get_openai_detailed_reviews
+
+
+def _review(path, line=1, analysis="问题"):
+    return {"file": path, "lines": {"old": None, "new": line}, "category": "正确性",
+            "severity": "high", "analysis": analysis, "suggestion": "建议"}
+
+
+class TestJsonRepair(unittest.TestCase):
+
+    def test_strict_and_extracted(self):
+        self.assertEqual(parse_llm_json_tolerantly('[{"a": 1}]'), ([{"a": 1}], JSON_PARSE_STRICT))
+        text = '以下是审查结果：\n```json\n[{"a": 1}]\n```\n如有疑问请告知。'
+        self.assertEqual(parse_llm_json_tolerantly(text), ([{"a": 1}], JSON_PARSE_EXTRACTED))
+
+    def test_trailing_commas_and_comments_are_repaired(self):
+        text = '[\n  {"a": "x, }", "b": [1, 2,],},  // 注释\n  /* 块注释 */ {"c": "http://example.com"},\n]'
+        value, method = parse_llm_json_tolerantly(text)
+        self.assertEqual(method, JSON_PARSE_REPAIRED)
+        self.assertEqual(value, [{"a": "x, }", "b": [1, 2]}, {"c": "http://example.com"}])
+
+    def test_repair_leaves_string_contents_untouched(self):
+        self.assertEqual(repair_json_text('{"a": "[1,]", "b": "// x"}'), '{"a": "[1,]", "b": "// x"}')
+
+    def test_truncated_array_recovers_complete_elements(self):
+        text = json.dumps([_review("a.py"), _review("a.py", 2)], ensure_ascii=False)
+        truncated = text[:len(text) - 20]
+        value, method = parse_llm_json_tolerantly(truncated)
+        self.assertEqual(method, JSON_PARSE_PARTIAL)
+        self.assertEqual(value, [_review("a.py")])
+
+    def test_unrecoverable_output(self):
+        self.assertEqual(parse_llm_json_tolerantly("此文件未发现问题。"), (None, JSON_PARSE_FAILED))
+        self.assertEqual(parse_llm_json_tolerantly('[{"a": 1 "b": 2}'), (None, JSON_PARSE_FAILED))
+        self.assertEqual(parse_llm_json_tolerantly(""), (None, JSON_PARSE_FAILED))
+
+    @patch('api.core_config.redis_client')
+    def test_outcome_is_counted_in_redis(self, mock_redis):
+        record_json_repair_outcome(JSON_PARSE_PARTIAL, "test")
+        self.assertEqual(mock_redis.hincrby.call_args.args[1:], (JSON_PARSE_PARTIAL, 1))
+
+
+@patch.dict('api.core_config.app_configs', {"LLM_BATCH_MAX_TOKENS": 0, "LLM_JSON_REASK_ENABLED": True})
+@patch('api.services.llm_review_detailed_service.record_json_repair_outcome')
+@patch('api.services.llm_review_detailed_service.get_cached_review', return_value=None)
+@patch('api.services.llm_review_detailed_service.store_cached_review')
+class TestDetailedReviewJsonRepair(unittest.TestCase):
+
+    def _changes(self):
+        return {"a.py": {"path": "a.py", "old_path": None, "lines_changed": 1, "context": {"old": "", "new": ""},
+                         "changes": [{"type": "add", "old_line": None, "new_line": 1, "content": "x = 1"}]}}
+
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion')
+    def test_repaired_output_is_used_without_reask(self, mock_execute, mock_store, _get, mock_record):
+        mock_execute.return_value = "审查结果:\n" + json.dumps([_review("a.py")], ensure_ascii=False)[:-1] + ",]"
+
+        result = get_openai_detailed_reviews(self._changes(), MagicMock(), "gpt-test")
+
+        self.assertEqual(mock_execute.call_count, 1)
+        self.assertEqual(result["a.py"], [_review("a.py")])
+        self.assertEqual(mock_record.call_args.args[0], JSON_PARSE_REPAIRED)
+        self.assertEqual(json.loads(mock_store.call_args.args[3]), [_review("a.py")])
+
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion')
+    def test_partial_output_is_not_cached(self, mock_execute, mock_store, _get, mock_record):
+        text = json.dumps([_review("a.py"), _review("a.py", 2)], ensure_ascii=False)
+        mock_execute.return_value = text[:len(text) - 20]
+
+        result = get_openai_detailed_reviews(self._changes(), MagicMock(), "gpt-test")
+
+        self.assertEqual(result["a.py"], [_review("a.py")])
+        self.assertEqual(mock_record.call_args.args[0], JSON_PARSE_PARTIAL)
+        mock_store.assert_not_called()
+
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion')
+    def test_reask_when_repair_fails(self, mock_execute, mock_store, _get, mock_record):
+        mock_execute.side_effect = ['[{"file": "a.py" "lines": 1}]', json.dumps([_review("a.py")])]
+
+        result = get_openai_detailed_reviews(self._changes(), MagicMock(), "gpt-test")
+
+        self.assertEqual(mock_execute.call_count, 2)
+        self.assertEqual(mock_execute.call_args_list[1].args[3], '[{"file": "a.py" "lines": 1}]')
+        self.assertEqual(result["a.py"], [_review("a.py")])
+        self.assertEqual(mock_record.call_args.args[0], "reask")
+
+    @patch.dict('api.core_config.app_configs', {"LLM_JSON_REASK_ENABLED": False})
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion', return_value="无法审查")
+    def test_reask_disabled(self, mock_execute, mock_store, _get, mock_record):
+        result = get_openai_detailed_reviews(self._changes(), MagicMock(), "gpt-test")
+
+        self.assertEqual(mock_execute.call_count, 1)
+        self.assertEqual(result["a.py"], [])
+        self.assertEqual(mock_record.call_args.args[0], JSON_PARSE_FAILED)
+        mock_store.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+from api.services.json_stream_parser import IncrementalJSONArrayParser
+
+
+def _feed_in_pieces(text, size):
+    parser = IncrementalJSONArrayParser()
+    results = []
+    for i in range(0, len(text), size):
+        results.extend(parser.feed(text[i:i + size]))
+    return parser, results
+
+
+class TestIncrementalJSONArrayParser(unittest.TestCase):
+
+    def test_emits_objects_regardless_of_chunk_boundaries(self):
+        text = '[{"file": "a.py", "analysis": "含有 } 和 \\" 的字符串"}, {"file": "b.py", "lines": {"new": [1]}}]'
+        for size in (1, 5, len(text)):
+            parser, results = _feed_in_pieces(text, size)
+            self.assertEqual(results, [
+                {"file": "a.py", "analysis": "含有 } 和 \" 的字符串"},
+                {"file": "b.py", "lines": {"new": [1]}},
+            ])
+            self.assertTrue(parser.finished)
+
+    def test_skips_think_block_and_wrapper_object(self):
+        text = '<think>先看看 [1, {2}]</think>```json\n{"reviews": [{"a": 1}]}\n```'
+        _, results = _feed_in_pieces(text, 3)
+        self.assertEqual(results, [{"a": 1}])
+
+    def test_invalid_element_is_skipped(self):
+        _, results = _feed_in_pieces('[{bad}, {"ok": true}]', 4)
+        self.assertEqual(results, [{"ok": True}])
+
+    def test_object_is_emitted_before_array_closes(self):
+        parser = IncrementalJSONArrayParser()
+        self.assertEqual(parser.feed('[{"a": 1}, {"b"'), [{"a": 1}])
+        self.assertFalse(parser.finished)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from openai import APIConnectionError, APIStatusError, RateLimitError
+from api.services.concurrency_service import run_concurrently
+from api.services.job_context import review_job_context
+from api.services.llm_circuit_breaker import LLMCircuitBreaker, LLMCircuitOpenError
+from api.services.llm_client_manager import execute_llm_chat_completion
+
+
+def _server_error():
+    return APIStatusError("unavailable", response=MagicMock(status_code=503, headers={}), body=None)
+
+
+@patch.dict('api.core_config.app_configs', {"LLM_CIRCUIT_FAILURE_THRESHOLD": 2, "LLM_CIRCUIT_OPEN_SECONDS": 30})
+class TestLlmCircuitBreaker(unittest.TestCase):
+
+    def test_opens_after_consecutive_failures_and_fails_fast(self):
+        breaker = LLMCircuitBreaker()
+        breaker.before_call()
+        breaker.record_failure(_server_error())
+        self.assertEqual(breaker.get_status()["state"], "closed")
+        breaker.before_call()
+        breaker.record_failure(APIConnectionError(request=MagicMock()))
+
+        self.assertEqual(breaker.get_status()["state"], "open")
+        with self.assertRaises(LLMCircuitOpenError) as ctx:
+            breaker.before_call()
+        self.assertGreater(ctx.exception.retry_after_seconds, 0)
+
+    def test_rate_limit_errors_neither_count_nor_reset(self):
+        rate_limited = RateLimitError("rate limited", response=MagicMock(status_code=429, headers={}), body=None)
+        breaker = LLMCircuitBreaker()
+        breaker.record_failure(_server_error())
+        for _ in range(3):
+            breaker.record_failure(rate_limited)
+        self.assertEqual(breaker.get_status()["state"], "closed")
+        self.assertEqual(breaker.get_status()["consecutive_failures"], 1)
+        breaker.record_failure(_server_error())
+        self.assertEqual(breaker.get_status()["state"], "open")
+
+    @patch('api.services.llm_circuit_breaker.time.monotonic')
+    def test_rate_limited_probe_keeps_breaker_half_open(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        breaker = LLMCircuitBreaker()
+        breaker.record_failure(_server_error())
+        breaker.record_failure(_server_error())
+
+        mock_monotonic.return_value = 131.0
+        holds_probe = breaker.before_call()
+        breaker.record_failure(
+            RateLimitError("rate limited", response=MagicMock(status_code=429, headers={}), body=None), holds_probe)
+
+        self.assertEqual(breaker.get_status()["state"], "half_open")
+        self.assertEqual(breaker.get_status()["consecutive_failures"], 2)
+        self.assertTrue(breaker.before_call())  # 探测名额已释放，下一个请求重新探测
+
+    @patch('api.services.llm_circuit_breaker.time.monotonic')
+    def test_half_open_allows_single_probe(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        breaker = LLMCircuitBreaker()
+        breaker.record_failure(_server_error())
+        breaker.record_failure(_server_error())
+
+        mock_monotonic.return_value = 131.0
+        self.assertIsNone(breaker.get_retry_after_seconds())
+        breaker.before_call()  # 探测请求
+        with self.assertRaises(LLMCircuitOpenError):
+            breaker.before_call()
+        breaker.record_failure(_server_error())
+        self.assertEqual(breaker.get_status()["state"], "open")
+
+        mock_monotonic.return_value = 162.0
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.get_status()["state"], "closed")
+        breaker.before_call()
+
+    def test_open_error_aborts_run_concurrently(self):
+        def review(item):
+            if item == 1:
+                raise LLMCircuitOpenError(10)
+            return item
+
+        with self.assertRaises(LLMCircuitOpenError):
+            run_concurrently(review, [0, 1, 2], max_workers=1, task_description="test")
+
+    @patch('api.services.llm_circuit_breaker.time.monotonic', return_value=200.0)
+    def test_probe_is_claimed_after_rate_limit_wait(self, _monotonic):
+        breaker = LLMCircuitBreaker()
+        breaker.record_failure(_server_error())
+        breaker.record_failure(_server_error())
+        breaker._opened_at = 100.0  # 已过打开时长，下一次 before_call 进入半开状态
+        probe_taken_during_wait = []
+
+        def _wait_for_rate_limit(estimated_tokens, context_description):
+            # 本请求等待限流期间，其他任务可以取得探测名额
+            probe_taken_during_wait.append(breaker.before_call())
+            return estimated_tokens
+
+        client = MagicMock()
+        with patch('api.services.llm_client_manager.llm_circuit_breaker', breaker), \
+                patch('api.services.llm_client_manager.acquire_llm_rate_limit', side_effect=_wait_for_rate_limit):
+            with self.assertRaises(LLMCircuitOpenError):
+                execute_llm_chat_completion(client, "m", "s", "u", "test")
+
+        self.assertEqual(probe_taken_during_wait, [True])
+        client.chat.completions.create.assert_not_called()
+        with self.assertRaises(LLMCircuitOpenError):
+            breaker.before_call()  # 其他任务的探测名额没有被释放
+
+    def test_requeued_run_skips_comment_locations_posted_before_abort(self):
+        from api.routes.webhook_helpers import ReviewCommentPoster
+        earlier = {"file": "a.py", "lines": {"old": None, "new": 3}, "analysis": "措辞一"}
+        rephrased = dict(earlier, analysis="措辞二")
+        new_finding = {"file": "a.py", "lines": {"old": None, "new": 9}, "analysis": "新问题"}
+
+        with review_job_context("first run") as job:
+            poster = ReviewCommentPoster(lambda review: True, "test")
+            poster.finish([earlier])
+            posted_comments = job.posted_comments
+
+        posted = []
+        with review_job_context("requeued run", previously_posted_comments=posted_comments) as job:
+            poster = ReviewCommentPoster(lambda review: posted.append(review) or True, "test")
+            poster.finish([rephrased, new_finding])
+
+        self.assertEqual(posted, [new_finding])
+        self.assertEqual(len(job.posted_comments), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
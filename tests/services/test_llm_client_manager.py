@@ -1,7 +1,13 @@
 import unittest
 import re
 from unittest.mock import MagicMock, patch
-from api.services.llm_client_manager import initialize_openai_client, get_openai_client, execute_llm_chat_completion
+from openai import APIStatusError, BadRequestError
+from api.services import concurrency_service
+from api.services.job_context import review_job_context
+from api.services.llm_rate_limiter import LLMRateLimitExceeded
+from api.services.llm_client_manager import (
+    initialize_openai_client, get_openai_client, execute_llm_chat_completion, _make_hedge_starter
+)
 
 class TestLlmClientManager(unittest.TestCase):
 
@@ -48,7 +54,8 @@ class TestLlmClientManager(unittest.TestCase):
         initialize_openai_client()
         mock_OpenAI_class.assert_called_once_with(
             base_url="https://api.example.com/v1", # 这些值来自被 patch.dict 修改的 app_configs
-            api_key="test_key"
+            api_key="test_key",
+            max_retries=0
         )
         self.assertIsNotNone(get_openai_client())
 
@@ -117,5 +124,91 @@ class TestLlmClientManager(unittest.TestCase):
                 self.assertEqual(result, expected_result)
 
 
+    @patch.dict('api.core_config.app_configs', {"LLM_STREAMING_ENABLED": True})
+    def test_execute_llm_chat_completion_streaming_emits_findings(self):
+        pieces = ['```json\n[{"file": "a.py", ', '"n": 1}, {"fi', 'le": "b.py"}]\n```']
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value = [
+            MagicMock(choices=[MagicMock(delta=MagicMock(content=piece))]) for piece in pieces
+        ]
+        findings = []
+
+        result = execute_llm_chat_completion(
+            client=mock_client, model_name="test-model", system_prompt="s", user_prompt="u",
+            context_description="Test context", on_finding=findings.append
+        )
+        self.assertEqual(findings, [{"file": "a.py", "n": 1}, {"file": "b.py"}])
+        self.assertEqual(result, '[{"file": "a.py", "n": 1}, {"file": "b.py"}]')
+        self.assertTrue(mock_client.chat.completions.create.call_args.kwargs["stream"])
+
+    @patch.dict('api.core_config.app_configs', {"LLM_RETRY_MAX_ATTEMPTS_RATE_LIMIT": 1, "LLM_RETRY_MAX_ATTEMPTS_SERVER_ERROR": 0})
+    @patch('api.services.llm_client_manager.time.sleep')
+    @patch('api.services.llm_client_manager.release_llm_token_reservation')
+    @patch('api.services.llm_client_manager.acquire_llm_rate_limit')
+    def test_rate_limit_exhaustion_and_failures_do_not_send_or_keep_reservations(self, mock_acquire, mock_release, mock_sleep):
+        mock_client = MagicMock()
+        mock_acquire.side_effect = LLMRateLimitExceeded("exhausted", retry_after_seconds=5)
+
+        result = execute_llm_chat_completion(mock_client, "m", "s", "u", "ctx")
+
+        self.assertTrue(result.startswith("Error:"))
+        self.assertEqual(mock_acquire.call_count, 2)  # 按限流错误重试一次
+        mock_client.chat.completions.create.assert_not_called()
+
+        mock_acquire.side_effect = None
+        mock_acquire.return_value = 300
+        mock_client.chat.completions.create.side_effect = APIStatusError(
+            "unavailable", response=MagicMock(status_code=503, headers={}), body=None)
+        with patch('api.services.llm_client_manager.llm_circuit_breaker'):
+            result = execute_llm_chat_completion(mock_client, "m", "s", "u", "ctx")
+
+        self.assertTrue(result.startswith("Error:"))
+        mock_release.assert_called_with(300, "ctx")
+
+    @patch.dict('api.core_config.app_configs', {"LLM_STREAMING_ENABLED": True, "LLM_STREAM_INCLUDE_USAGE": True})
+    def test_streaming_retries_without_rejected_stream_options(self):
+        rejected = BadRequestError(
+            "Unrecognized request argument supplied: stream_options",
+            response=MagicMock(status_code=400, headers={}), body=None)
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.side_effect = [
+            rejected, [MagicMock(choices=[MagicMock(delta=MagicMock(content='[{"file": "a.py"}]'))])]]
+        findings = []
+
+        result = execute_llm_chat_completion(
+            client=mock_client, model_name="test-model", system_prompt="s", user_prompt="u",
+            context_description="Test context", on_finding=findings.append
+        )
+
+        self.assertEqual(result, '[{"file": "a.py"}]')
+        self.assertEqual(findings, [{"file": "a.py"}])
+        first_call, second_call = mock_client.chat.completions.create.call_args_list
+        self.assertEqual(first_call.kwargs["stream_options"], {"include_usage": True})
+        self.assertNotIn("stream_options", second_call.kwargs)
+
+    @patch.dict('api.core_config.app_configs', {"LLM_HEDGE_MAX_PER_JOB": 3, "LLM_MAX_CONCURRENT_REQUESTS": 2})
+    @patch('api.services.llm_client_manager.record_llm_usage')
+    @patch('api.services.llm_client_manager.record_llm_token_usage')
+    @patch('api.services.llm_client_manager.try_acquire_llm_rate_limit', return_value=120)
+    def test_hedge_counts_against_concurrency_and_rate_limits(self, mock_rate_limit, mock_token_usage, mock_usage):
+        limiter = concurrency_service._global_llm_limiter
+        with review_job_context("test"):
+            start_hedge = _make_hedge_starter("test-model", 100, "ctx")
+            with concurrency_service.llm_call_slot():
+                finish_hedge = start_hedge()
+                self.assertIsNotNone(finish_hedge)
+                self.assertEqual(limiter.active, 2)
+                self.assertIsNone(start_hedge())  # 全局并发名额已满，不再对冲
+            discarded = MagicMock(usage=MagicMock(total_tokens=90))
+            finish_hedge(discarded)
+
+            self.assertEqual(limiter.active, 0)
+            mock_token_usage.assert_called_once_with(120, discarded.usage, "ctx (对冲)")
+            mock_usage.assert_called_once_with(discarded.usage, "test-model", "ctx (对冲)")
+
+            mock_rate_limit.return_value = None  # 集群限流名额不足
+            self.assertIsNone(start_hedge())
+            self.assertEqual(limiter.active, 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,120 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+from openai import APIConnectionError, BadRequestError
+from api.services.llm_endpoint_pool import LLMEndpointPool, LLMPoolMember, parse_endpoint_pool_config
+
+
+def _connection_error():
+    return APIConnectionError(request=MagicMock())
+
+
+class TestLlmEndpointPool(unittest.TestCase):
+
+    def test_parse_endpoint_pool_config(self):
+        raw = '[{"base_url": "https://a/v1", "api_key": "k1"}, {"base_url": "https://b/v1"}]'
+        entries = parse_endpoint_pool_config(raw)
+        self.assertEqual(len(entries), 1)  # 缺少 api_key 的条目被跳过
+        self.assertEqual(entries[0]["api_key"], "k1")
+        self.assertEqual(parse_endpoint_pool_config("not json"), [])
+        self.assertEqual(parse_endpoint_pool_config(""), [])
+
+    def test_least_outstanding_prefers_idle_member(self):
+        busy = LLMPoolMember("busy", MagicMock())
+        idle = LLMPoolMember("idle", MagicMock())
+        busy.outstanding = 3
+        pool = LLMEndpointPool([busy, idle])
+        self.assertIs(pool.acquire_member(), idle)
+
+    def test_member_marked_unhealthy_after_consecutive_failures(self):
+        flaky_client = MagicMock()
+        flaky_client.chat.completions.create.side_effect = _connection_error()
+        flaky = LLMPoolMember("flaky", flaky_client)
+        healthy = LLMPoolMember("healthy", MagicMock())
+        pool = LLMEndpointPool([flaky, healthy], failure_threshold=2)
+
+        for _ in range(2):
+            member = pool.acquire_member(exclude=(healthy,))
+            pool.release_member(member, _connection_error())
+
+        status = {s["name"]: s for s in pool.get_status()}
+        self.assertFalse(status["flaky"]["healthy"])
+        for _ in range(3):
+            self.assertIs(pool.acquire_member(), healthy)
+
+    def test_request_errors_do_not_affect_health(self):
+        member = LLMPoolMember("m", MagicMock())
+        pool = LLMEndpointPool([member], failure_threshold=1)
+        acquired = pool.acquire_member()
+        error = BadRequestError("bad", response=MagicMock(status_code=400), body=None)
+        pool.release_member(acquired, error)
+        self.assertTrue(pool.get_status()[0]["healthy"])
+        self.assertEqual(pool.get_status()[0]["outstanding_requests"], 0)
+
+    def test_member_model_override(self):
+        client = MagicMock()
+        pool = LLMEndpointPool([LLMPoolMember("m", client, model="local-model")])
+        pool.create_chat_completion(model="gpt-4o", messages=[])
+        client.chat.completions.create.assert_called_once_with(model="local-model", messages=[])
+
+    def test_latency_percentile_requires_enough_samples(self):
+        client = MagicMock()
+        pool = LLMEndpointPool([LLMPoolMember("m", client)])
+        pool.create_chat_completion(messages=[])
+        self.assertIsNone(pool.get_latency_percentile(95))
+        for _ in range(30):
+            pool.create_chat_completion(messages=[])
+        self.assertIsNotNone(pool.get_latency_percentile(95))
+        pool.create_chat_completion(messages=[], stream=True)  # 流式请求的耗时不计入统计
+        self.assertEqual(len(pool._recent_latencies), 31)
+
+    def test_hedged_request_returns_first_success(self):
+        release_slow = threading.Event()
+        slow_client, fast_client = MagicMock(), MagicMock()
+        slow_client.chat.completions.create.side_effect = lambda **kwargs: release_slow.wait(5) and "slow"
+        fast_client.chat.completions.create.return_value = "fast"
+        slow, fast = LLMPoolMember("slow", slow_client), LLMPoolMember("fast", fast_client)
+        fast.outstanding = 1  # 使首个请求落在 slow 上
+        pool = LLMEndpointPool([slow, fast])
+        discarded = []
+        finished = threading.Event()
+
+        def _finish_hedge(response):
+            discarded.append(response)
+            finished.set()
+
+        try:
+            self.assertEqual(pool.create_hedged_chat_completion(0.05, lambda: _finish_hedge, messages=[]), "fast")
+            self.assertEqual(discarded, [])  # 落后的请求结束前不释放对冲名额
+        finally:
+            release_slow.set()
+        self.assertTrue(finished.wait(5))
+        self.assertEqual(discarded, ["slow"])  # 落后请求的响应交给调用方记录用量
+        status = {s["name"]: s for s in pool.get_status()}
+        self.assertEqual((status["fast"]["hedge_requests"], status["fast"]["hedge_wins"]), (1, 1))
+
+    def test_no_hedge_without_budget(self):
+        slow_client, other_client = MagicMock(), MagicMock()
+        slow_client.chat.completions.create.side_effect = lambda **kwargs: threading.Event().wait(0.1) or "slow"
+        slow, other = LLMPoolMember("slow", slow_client), LLMPoolMember("other", other_client)
+        other.outstanding = 1
+        pool = LLMEndpointPool([slow, other])
+
+        self.assertEqual(pool.create_hedged_chat_completion(0.01, lambda: None, messages=[]), "slow")
+        other_client.chat.completions.create.assert_not_called()
+
+    def test_no_hedge_when_other_members_are_cooling_down(self):
+        slow_client, cooling_client = MagicMock(), MagicMock()
+        slow_client.chat.completions.create.side_effect = lambda **kwargs: threading.Event().wait(0.1) or "slow"
+        slow, cooling = LLMPoolMember("slow", slow_client), LLMPoolMember("cooling", cooling_client)
+        pool = LLMEndpointPool([slow, cooling], failure_threshold=1)
+        pool.release_member(pool.acquire_member(exclude=(slow,)), _connection_error())
+        start_hedge = MagicMock()
+
+        self.assertEqual(pool.create_hedged_chat_completion(0.01, start_hedge, messages=[]), "slow")
+        start_hedge.assert_not_called()
+        cooling_client.chat.completions.create.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
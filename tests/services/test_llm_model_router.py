@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import patch
+from api.services.llm_model_router import parse_routing_rules, route_file_review, route_file_reviews
+
+_RULES = [
+    {"name": "docs", "model": "cheap-model", "extensions": [".md", ".TXT"]},
+    {"name": "config", "model": "cheap-model", "path_patterns": ["config/*"], "max_lines_changed": 50},
+    {"name": "small", "model": "cheap-model", "max_lines_changed": 5},
+]
+
+
+class TestLlmModelRouter(unittest.TestCase):
+
+    def test_parse_routing_rules(self):
+        self.assertEqual(parse_routing_rules('[{"model": "m"}, {"name": "no-model"}]'), [{"model": "m"}])
+        self.assertEqual(parse_routing_rules("not json"), [])
+        self.assertEqual(parse_routing_rules(""), [])
+
+    def test_rules_with_invalid_conditions_are_skipped(self):
+        rules = parse_routing_rules([
+            {"model": "m", "min_lines_changed": "abc"},
+            {"model": "m", "extensions": ".md"},
+            {"model": "m", "path_patterns": [1]},
+            {"name": "ok", "model": "m", "max_lines_changed": "20"},
+        ])
+        self.assertEqual(rules, [{"name": "ok", "model": "m", "max_lines_changed": 20}])
+        self.assertEqual(route_file_review("a.py", {"lines_changed": 30}, "big-model", rules)["model"], "big-model")
+
+    def test_first_matching_rule_wins(self):
+        decision = route_file_review("README.md", {"lines_changed": 500}, "big-model", _RULES)
+        self.assertEqual((decision["model"], decision["rule"]), ("cheap-model", "docs"))
+        decision = route_file_review("notes.txt", {"lines_changed": 1}, "big-model", _RULES)
+        self.assertEqual(decision["rule"], "docs")  # 扩展名不区分大小写
+        decision = route_file_review("config/app.yml", {"lines_changed": 20}, "big-model", _RULES)
+        self.assertEqual(decision["rule"], "config")
+
+    def test_unmatched_file_uses_default_model(self):
+        decision = route_file_review("src/core.py", {"lines_changed": 200}, "big-model", _RULES)
+        self.assertEqual(decision, {"model": "big-model", "rule": None, "lines_changed": 200})
+
+    @patch.dict('api.core_config.app_configs', {"LLM_ROUTING_RULES": ""})
+    def test_no_rules_configured(self):
+        decisions = route_file_reviews({"a.md": {"lines_changed": 1}}, "big-model")
+        self.assertEqual(decisions["a.md"]["model"], "big-model")
+
+
+if __name__ == '__main__':
+    unittest.main()
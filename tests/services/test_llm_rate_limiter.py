@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.llm_rate_limiter import (
+    acquire_llm_rate_limit, record_llm_token_usage, release_llm_token_reservation, LLMRateLimitExceeded
+)
+
+
+@patch.dict('api.core_config.app_configs', {"LLM_RATE_LIMIT_RPM": 60, "LLM_RATE_LIMIT_TPM": 1000,
+                                            "LLM_RATE_LIMIT_MAX_WAIT_SECONDS": 10})
+class TestLlmRateLimiter(unittest.TestCase):
+
+    @patch('api.core_config.redis_client', None)
+    def test_disabled_without_redis(self):
+        self.assertEqual(acquire_llm_rate_limit(100, "test"), 0)
+
+    @patch('api.services.llm_rate_limiter.time.sleep')
+    def test_waits_until_bucket_has_capacity(self, mock_sleep):
+        mock_redis = MagicMock()
+        mock_redis.eval.side_effect = [250, 0]  # 第一次需要等待 250ms
+        with patch('api.core_config.redis_client', mock_redis):
+            self.assertEqual(acquire_llm_rate_limit(5000, "test"), 1000)  # 超过容量的预估按容量扣减
+        mock_sleep.assert_called_once_with(0.25)
+        self.assertEqual(mock_redis.eval.call_args.args[-4:], (60, 1, 1000, 1000))
+
+    @patch('api.services.llm_rate_limiter.time.sleep')
+    def test_raises_when_wait_exceeds_limit(self, mock_sleep):
+        mock_redis = MagicMock()
+        mock_redis.eval.return_value = 60000
+        with patch('api.core_config.redis_client', mock_redis):
+            with self.assertRaises(LLMRateLimitExceeded) as raised:
+                acquire_llm_rate_limit(10, "test")
+        self.assertEqual(raised.exception.retry_after_seconds, 60)
+        mock_sleep.assert_not_called()
+
+    def test_usage_correction(self):
+        mock_redis = MagicMock()
+        with patch('api.core_config.redis_client', mock_redis):
+            record_llm_token_usage(100, MagicMock(total_tokens=350), "test")
+            record_llm_token_usage(100, None, "test")
+        mock_redis.eval.assert_called_once()
+        self.assertEqual(mock_redis.eval.call_args.args[-2:], (1000, 250))
+
+    def test_release_reservation_refunds_tokens(self):
+        mock_redis = MagicMock()
+        with patch('api.core_config.redis_client', mock_redis):
+            release_llm_token_reservation(120, "test")
+            release_llm_token_reservation(0, "test")
+        mock_redis.eval.assert_called_once()
+        self.assertEqual(mock_redis.eval.call_args.args[-2:], (1000, -120))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from openai import APIConnectionError, BadRequestError, RateLimitError
+from api.services.llm_retry_policy import LLMRetryPolicy, get_retry_after_seconds
+from api.services.job_context import review_job_context
+from api.services.llm_client_manager import execute_llm_chat_completion
+
+
+def _rate_limit_error(headers=None):
+    return RateLimitError("rate limited", response=MagicMock(status_code=429, headers=headers or {}), body=None)
+
+
+class TestLlmRetryPolicy(unittest.TestCase):
+
+    def test_retry_after_headers(self):
+        self.assertEqual(get_retry_after_seconds({"retry-after-ms": "1500"}), 1.5)
+        self.assertEqual(get_retry_after_seconds({"retry-after": "3"}), 3.0)
+        self.assertEqual(get_retry_after_seconds({
+            "x-ratelimit-remaining-requests": "10", "x-ratelimit-reset-requests": "20ms",
+            "x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "1m2s",
+        }), 62.0)
+        self.assertIsNone(get_retry_after_seconds({}))
+
+    @patch.dict('api.core_config.app_configs', {"LLM_RETRY_MAX_ATTEMPTS_RATE_LIMIT": 2})
+    def test_per_class_budget_and_non_retryable_errors(self):
+        policy = LLMRetryPolicy("test")
+        self.assertIsNotNone(policy.get_retry_delay(_rate_limit_error()))
+        self.assertIsNotNone(policy.get_retry_delay(_rate_limit_error()))
+        self.assertIsNone(policy.get_retry_delay(_rate_limit_error()))
+        # 其他错误类别的预算不受影响
+        self.assertIsNotNone(policy.get_retry_delay(APIConnectionError(request=MagicMock())))
+        self.assertIsNone(policy.get_retry_delay(
+            BadRequestError("bad", response=MagicMock(status_code=400, headers={}), body=None)))
+
+    def test_server_delay_honoured_and_bounded_by_job_deadline(self):
+        delay = LLMRetryPolicy("test").get_retry_delay(_rate_limit_error({"retry-after": "5"}))
+        self.assertGreaterEqual(delay, 5)
+        with review_job_context("test", 2):
+            self.assertIsNone(LLMRetryPolicy("test").get_retry_delay(_rate_limit_error({"retry-after": "5"})))
+
+    @patch('api.services.llm_client_manager.time.sleep')
+    def test_execute_retries_transient_errors(self, mock_sleep):
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock(message=MagicMock(content="[]"))]
+        mock_client.chat.completions.create.side_effect = [_rate_limit_error({"retry-after": "0"}), mock_response]
+
+        result = execute_llm_chat_completion(mock_client, "m", "s", "u", "test")
+
+        self.assertEqual(result, "[]")
+        self.assertEqual(mock_client.chat.completions.create.call_count, 2)
+        mock_sleep.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
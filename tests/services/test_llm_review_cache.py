@@ -0,0 +1,45 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.llm_review_cache import (
+    build_review_cache_key, get_cached_review, store_cached_review
+)
+
+
+class TestLlmReviewCache(unittest.TestCase):
+
+    def test_cache_key_depends_on_model_prompt_and_input(self):
+        key = build_review_cache_key("gpt-4o", "system", "input")
+        self.assertEqual(key, build_review_cache_key("gpt-4o", "system", "input"))
+        self.assertNotEqual(key, build_review_cache_key("gpt-4o-mini", "system", "input"))
+        self.assertNotEqual(key, build_review_cache_key("gpt-4o", "system v2", "input"))
+        self.assertNotEqual(key, build_review_cache_key("gpt-4o", "system", "input2"))
+
+    @patch('api.core_config.redis_client', None)
+    def test_cache_disabled_without_redis(self):
+        self.assertIsNone(get_cached_review("m", "s", "u"))
+
+    def test_cache_hit_and_miss_counters(self):
+        mock_redis = MagicMock()
+        with patch('api.core_config.redis_client', mock_redis):
+            mock_redis.get.return_value = b'[]'
+            self.assertEqual(get_cached_review("m", "s", "u"), "[]")
+            mock_redis.hincrby.assert_called_with("ai_code_review_helper:llm_review_cache:stats", "hits", 1)
+
+            mock_redis.get.return_value = None
+            self.assertIsNone(get_cached_review("m", "s", "u"))
+            mock_redis.hincrby.assert_called_with("ai_code_review_helper:llm_review_cache:stats", "misses", 1)
+
+    @patch.dict('api.core_config.app_configs', {"LLM_REVIEW_CACHE_MAX_ENTRIES": 10})
+    def test_store_evicts_oldest_entries_over_limit(self):
+        mock_redis = MagicMock()
+        pipe = MagicMock()
+        pipe.execute.return_value = [True, 1, 1, 0, 12]  # 最后一项为 zcard
+        mock_redis.pipeline.return_value = pipe
+        mock_redis.zpopmin.return_value = [(b"old1", 1.0), (b"old2", 2.0)]
+        with patch('api.core_config.redis_client', mock_redis):
+            store_cached_review("m", "s", "u", "[]")
+        mock_redis.zpopmin.assert_called_once_with("ai_code_review_helper:llm_review_cache:index", 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
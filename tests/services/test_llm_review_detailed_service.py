@@ -0,0 +1,120 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.llm_review_detailed_service import get_openai_detailed_reviews
+
+
+def _file_data(path, content="x = 1"):
+    return {
+        "path": path,
+        "old_path": None,
+        "changes": [{"type": "add", "old_line": None, "new_line": 1, "content": content}],
+        "context": {"old": "", "new": ""},
+        "lines_changed": 1
+    }
+
+
+def _review(path, line=1):
+    return {"file": path, "lines": {"old": None, "new": line}, "category": "正确性",
+            "severity": "high", "analysis": "问题", "suggestion": "建议"}
+
+
+@patch('api.services.llm_review_detailed_service.get_cached_review', return_value=None)
+@patch('api.services.llm_review_detailed_service.store_cached_review')
+class TestLlmReviewDetailedService(unittest.TestCase):
+
+    @patch.dict('api.core_config.app_configs', {"LLM_BATCH_MAX_TOKENS": 4000, "LLM_BATCH_MAX_FILES": 10})
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion')
+    def test_small_files_are_batched_and_split_back(self, mock_execute, _store, _get):
+        mock_execute.return_value = json.dumps([_review("a.py"), _review("b.py", 2), _review("unknown.py")])
+        changes = {"a.py": _file_data("a.py"), "b.py": _file_data("b.py")}
+
+        result = get_openai_detailed_reviews(changes, MagicMock(), "gpt-test")
+
+        self.assertEqual(mock_execute.call_count, 1)
+        self.assertEqual(list(result.keys()), ["a.py", "b.py"])
+        self.assertEqual([r["file"] for r in result["a.py"]], ["a.py"])
+        self.assertEqual(result["b.py"][0]["lines"]["new"], 2)
+
+    @patch.dict('api.core_config.app_configs', {"LLM_BATCH_MAX_TOKENS": 4000, "LLM_BATCH_MAX_FILES": 10})
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion')
+    def test_batch_failure_falls_back_to_single_file_reviews(self, mock_execute, _store, _get):
+        mock_execute.side_effect = ["Error: boom", json.dumps([_review("a.py")]), "[]"]
+        changes = {"a.py": _file_data("a.py"), "b.py": _file_data("b.py")}
+
+        result = get_openai_detailed_reviews(changes, MagicMock(), "gpt-test")
+
+        self.assertEqual(mock_execute.call_count, 3)
+        self.assertEqual(len(result["a.py"]), 1)
+        self.assertEqual(result["b.py"], [])
+
+    @patch.dict('api.core_config.app_configs', {"LLM_BATCH_MAX_TOKENS": 4000, "LLM_BATCH_MAX_FILES": 10})
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion')
+    def test_batch_failure_after_streamed_findings_rereviews_without_reposting(self, mock_execute, _store, _get):
+        def _execute(client, model, system_prompt, user_prompt, context, response_format_type=None, on_finding=None):
+            if mock_execute.call_count == 1:
+                on_finding(_review("a.py"))  # 流式输出中途断开，a.py 的其余意见尚未输出
+                return "Error: stream broken"
+            path = "a.py" if "a.py" in user_prompt else "b.py"
+            reviews = [_review("a.py"), _review("a.py", 5)] if path == "a.py" else [_review("b.py", 3)]
+            for review in reviews:
+                on_finding(review)
+            return json.dumps(reviews)
+
+        mock_execute.side_effect = _execute
+        posted = []
+        changes = {"a.py": _file_data("a.py"), "b.py": _file_data("b.py")}
+
+        result = get_openai_detailed_reviews(
+            changes, MagicMock(), "gpt-test", on_review=lambda path, review: posted.append((path, review["lines"]["new"])))
+
+        self.assertEqual(mock_execute.call_count, 3)
+        self.assertEqual(sorted(posted), [("a.py", 1), ("a.py", 5), ("b.py", 3)])
+        self.assertEqual([r["lines"]["new"] for r in result["a.py"]], [1, 5])
+        self.assertEqual(result["b.py"][0]["lines"]["new"], 3)
+
+    @patch.dict('api.core_config.app_configs', {"LLM_BATCH_MAX_TOKENS": 0})
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion')
+    def test_single_file_stream_failure_keeps_streamed_findings(self, mock_execute, _store, _get):
+        def _execute(client, model, system_prompt, user_prompt, context, response_format_type=None, on_finding=None):
+            on_finding(_review("a.py"))
+            return "Error: stream broken"
+
+        mock_execute.side_effect = _execute
+        posted = []
+
+        result = get_openai_detailed_reviews(
+            {"a.py": _file_data("a.py")}, MagicMock(), "gpt-test", on_review=lambda path, review: posted.append(path))
+
+        self.assertEqual(mock_execute.call_count, 1)
+        self.assertEqual(posted, ["a.py"])
+        self.assertEqual(len(result["a.py"]), 1)
+
+    @patch.dict('api.core_config.app_configs', {"LLM_BATCH_MAX_TOKENS": 0})
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion', return_value="[]")
+    def test_batching_disabled(self, mock_execute, _store, _get):
+        changes = {"a.py": _file_data("a.py"), "b.py": _file_data("b.py")}
+        get_openai_detailed_reviews(changes, MagicMock(), "gpt-test")
+        self.assertEqual(mock_execute.call_count, 2)
+
+    @patch.dict('api.core_config.app_configs', {"LLM_BATCH_MAX_TOKENS": 4000, "LLM_BATCH_MAX_FILES": 10})
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion', return_value="[]")
+    def test_files_routed_to_different_models_are_not_batched(self, mock_execute, _store, _get):
+        changes = {"a.md": _file_data("a.md"), "b.py": _file_data("b.py")}
+        get_openai_detailed_reviews(changes, MagicMock(), "big-model", model_by_path={"a.md": "cheap-model"})
+        self.assertEqual(sorted(call.args[1] for call in mock_execute.call_args_list), ["big-model", "cheap-model"])
+
+    @patch.dict('api.core_config.app_configs', {"LLM_BATCH_MAX_TOKENS": 0, "LLM_DIFF_FORMAT": "json"})
+    @patch('api.services.llm_review_detailed_service.get_prompt', side_effect=lambda key, sub_key='system_prompt': key)
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion', return_value="[]")
+    def test_compact_diff_format_uses_compact_prompt(self, mock_execute, _prompt, _store, _get):
+        get_openai_detailed_reviews({"a.py": _file_data("a.py")}, MagicMock(), "gpt-test", diff_format="compact")
+        _, _, system_prompt, user_prompt, _ = mock_execute.call_args.args
+        self.assertEqual(system_prompt, "detailed_review_compact")
+        self.assertIn("FILE: a.py", user_prompt)
+        self.assertIn("+1: x = 1", user_prompt)
+        self.assertNotIn('"changes"', user_prompt)
+
+
+if __name__ == '__main__':
+    unittest.main()
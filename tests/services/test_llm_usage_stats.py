@@ -0,0 +1,30 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.llm_usage_stats import get_cached_prompt_tokens, record_llm_usage
+
+
+class TestLlmUsageStats(unittest.TestCase):
+
+    def test_cached_tokens_from_provider_usage_fields(self):
+        openai_usage = MagicMock(prompt_tokens_details=MagicMock(cached_tokens=1024))
+        self.assertEqual(get_cached_prompt_tokens(openai_usage), 1024)
+        deepseek_usage = MagicMock(prompt_tokens_details=None, prompt_cache_hit_tokens=512)
+        self.assertEqual(get_cached_prompt_tokens(deepseek_usage), 512)
+        self.assertIsNone(get_cached_prompt_tokens(None))
+
+    @patch('api.core_config.redis_client')
+    def test_record_usage_accumulates_in_redis(self, mock_redis):
+        pipe = mock_redis.pipeline.return_value
+        usage = MagicMock(prompt_tokens=2000, completion_tokens=100,
+                          prompt_tokens_details=MagicMock(cached_tokens=1536))
+
+        record_llm_usage(usage, "gpt-test", "test")
+
+        increments = {call.args[1]: call.args[2] for call in pipe.hincrby.call_args_list}
+        self.assertEqual(increments, {"requests": 1, "prompt_tokens": 2000, "completion_tokens": 100,
+                                      "cached_prompt_tokens": 1536})
+        pipe.execute.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
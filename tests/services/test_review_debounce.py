@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import redis
+from api.services.review_debounce import record_review_event, claim_review_event, get_review_debounce_seconds
+
+
+def _fake_redis():
+    store = {}
+    mock_redis = MagicMock()
+    mock_redis.set.side_effect = lambda key, value, ex=None: store.__setitem__(key, value)
+
+    def _claim(script, num_keys, key, token):
+        if store.get(key) == token:
+            del store[key]
+            return 1
+        return 0
+
+    mock_redis.eval.side_effect = _claim
+    return mock_redis
+
+
+class TestReviewDebounce(unittest.TestCase):
+
+    def test_only_latest_event_in_burst_is_claimed(self):
+        with patch('api.core_config.redis_client', _fake_redis()):
+            tokens = [record_review_event('github', 'o/r', '1', 10) for _ in range(3)]
+            other_pr_token = record_review_event('github', 'o/r', '2', 10)
+            self.assertEqual([claim_review_event('github', 'o/r', '1', t) for t in tokens], [False, False, True])
+            # 已认领的事件不能再被认领 (例如另一个副本的定时器)
+            self.assertFalse(claim_review_event('github', 'o/r', '1', tokens[-1]))
+            self.assertTrue(claim_review_event('github', 'o/r', '2', other_pr_token))
+
+    def test_redis_unavailable_reviews_immediately(self):
+        with patch('api.core_config.redis_client', None):
+            self.assertIsNone(record_review_event('github', 'o/r', '1', 10))
+        mock_redis = MagicMock()
+        mock_redis.eval.side_effect = redis.exceptions.ConnectionError("down")
+        with patch('api.core_config.redis_client', mock_redis):
+            self.assertTrue(claim_review_event('github', 'o/r', '1', 'token'))
+
+    @patch.dict('api.core_config.app_configs', {"REVIEW_DEBOUNCE_SECONDS": 10})
+    def test_repo_config_overrides_window(self):
+        self.assertEqual(get_review_debounce_seconds(None), 10)
+        self.assertEqual(get_review_debounce_seconds({"debounce_seconds": 0}), 0)
+        self.assertEqual(get_review_debounce_seconds({"debounce_seconds": 30}), 30)
+
+    @patch('api.routes.webhook_helpers.register_review_job')
+    @patch('api.routes.webhook_helpers.executor')
+    @patch('api.routes.webhook_helpers.threading.Timer')
+    def test_burst_submits_single_job(self, mock_timer, mock_executor, _register):
+        from api.routes.webhook_helpers import _submit_review_job
+        process_func = MagicMock(__name__="_process_test")
+        with patch('api.core_config.redis_client', _fake_redis()):
+            for sha in ('aaa', 'bbb', 'ccc'):
+                _submit_review_job(process_func, ('github', 'o/r', '1', sha), debounce_seconds=5, head_sha=sha)
+            for timer_call in mock_timer.call_args_list:
+                timer_call.args[1]()
+        self.assertEqual(mock_executor.submit.call_count, 1)
+        self.assertEqual(mock_executor.submit.call_args.kwargs["head_sha"], 'ccc')
+
+
+if __name__ == '__main__':
+    unittest.main()
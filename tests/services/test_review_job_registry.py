@@ -0,0 +1,82 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.concurrency_service import ReviewJobCancelled
+from api.services.job_context import review_job_context, check_job_active
+from api.services.review_job_registry import register_review_job, get_superseding_sha, watch_for_supersession
+
+
+def _fake_redis():
+    store = {}
+    mock_redis = MagicMock()
+    mock_redis.get.side_effect = lambda key: store.get(key)
+
+    def _register(script, num_keys, sha_key, time_key, head_sha, event_time, ttl):
+        previous = store.get(sha_key)
+        current_time = store.get(time_key)
+        if event_time and current_time and float(event_time) < float(current_time):
+            return [0, previous]
+        store[sha_key] = head_sha.encode('utf-8')
+        if event_time:
+            store[time_key] = event_time.encode('utf-8')
+        return [1, previous]
+
+    mock_redis.eval.side_effect = _register
+    return mock_redis
+
+
+@patch.dict('api.core_config.app_configs', {"REVIEW_CANCEL_SUPERSEDED_ENABLED": True})
+class TestReviewJobRegistry(unittest.TestCase):
+
+    def test_newer_push_supersedes_older_sha(self):
+        with patch('api.core_config.redis_client', _fake_redis()):
+            register_review_job('github', 'o/r', '1', 'aaa1111')
+            self.assertIsNone(get_superseding_sha('github', 'o/r', '1', 'aaa1111'))
+            register_review_job('github', 'o/r', '1', 'bbb2222')
+            self.assertEqual(get_superseding_sha('github', 'o/r', '1', 'aaa1111'), 'bbb2222')
+            self.assertIsNone(get_superseding_sha('github', 'o/r', '1', 'bbb2222'))
+            # 其他 PR 及通用审查互不影响
+            self.assertIsNone(get_superseding_sha('github', 'o/r', '2', 'aaa1111'))
+            self.assertIsNone(get_superseding_sha('github_general', 'o/r', '1', 'aaa1111'))
+
+    def test_out_of_order_older_event_does_not_supersede(self):
+        with patch('api.core_config.redis_client', _fake_redis()):
+            register_review_job('github', 'o/r', '1', 'bbb2222', event_time='2024-01-02T03:05:00Z')
+            # 较早推送的事件晚到
+            register_review_job('github', 'o/r', '1', 'aaa1111', event_time='2024-01-02T03:04:00Z')
+            self.assertIsNone(get_superseding_sha('github', 'o/r', '1', 'bbb2222'))
+            self.assertEqual(get_superseding_sha('github', 'o/r', '1', 'aaa1111'), 'bbb2222')
+            # GitLab 的时间格式
+            register_review_job('github', 'o/r', '1', 'ccc3333', event_time='2024-01-02 03:06:00 UTC')
+            self.assertEqual(get_superseding_sha('github', 'o/r', '1', 'bbb2222'), 'ccc3333')
+
+    @patch('api.core_config.redis_client', None)
+    def test_no_redis_means_never_superseded(self):
+        register_review_job('github', 'o/r', '1', 'aaa1111')
+        self.assertIsNone(get_superseding_sha('github', 'o/r', '1', 'aaa1111'))
+
+    @patch('api.services.job_context.time.monotonic')
+    def test_running_job_is_cancelled_once_superseded(self, mock_monotonic):
+        mock_monotonic.return_value = 1000.0
+        with patch('api.core_config.redis_client', _fake_redis()):
+            register_review_job('gitlab', '42', '7', 'aaa1111')
+            with review_job_context("test", 0) as job:
+                watch_for_supersession(job, 'gitlab', '42', '7', 'aaa1111')
+                check_job_active("拉取变更")
+                register_review_job('gitlab', '42', '7', 'bbb2222')
+                # 检查间隔内不再查询 Redis
+                check_job_active("LLM 请求")
+                mock_monotonic.return_value = 1010.0
+                with self.assertRaises(ReviewJobCancelled):
+                    check_job_active("发表评论", allow_expired=True)
+                self.assertIn("bbb2222", job.cancel_reason)
+
+    @patch('api.routes.webhook_helpers.get_superseding_sha', return_value='bbb2222')
+    def test_queued_job_is_skipped_when_superseded(self, _superseding):
+        from api.routes.webhook_helpers import _run_review_job
+        process_func = MagicMock(__name__="_process_test")
+        self.assertIsNone(_run_review_job(process_func, _review_target=('github', 'o/r', '1', 'aaa1111'), x=1))
+        process_func.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
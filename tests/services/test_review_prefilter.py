@@ -0,0 +1,60 @@
+import unittest
+from unittest.mock import patch
+from api.services.review_prefilter import (
+    get_prefilter_skip_reason, prefilter_structured_changes, prefilter_general_file_items,
+    SKIP_REASON_LOCKFILE, SKIP_REASON_GENERATED, SKIP_REASON_VENDORED, SKIP_REASON_LONG_LINES, SKIP_REASON_REPO_RULE
+)
+
+
+def _file_data(path, added_lines):
+    return {"path": path, "old_path": None, "context": {"old": "", "new": ""}, "lines_changed": len(added_lines),
+            "changes": [{"type": "add", "old_line": None, "new_line": i + 1, "content": line}
+                        for i, line in enumerate(added_lines)]}
+
+
+class TestReviewPrefilter(unittest.TestCase):
+
+    def test_builtin_rules(self):
+        self.assertEqual(get_prefilter_skip_reason("web/package-lock.json", ["{}"]), SKIP_REASON_LOCKFILE)
+        self.assertEqual(get_prefilter_skip_reason("static/app.min.js", ["x"]), SKIP_REASON_GENERATED)
+        self.assertEqual(get_prefilter_skip_reason("proto/user_pb2.py", ["x"]), SKIP_REASON_GENERATED)
+        self.assertEqual(get_prefilter_skip_reason("vendor/github.com/x/y.go", ["x"]), SKIP_REASON_VENDORED)
+        self.assertEqual(get_prefilter_skip_reason("gen/api.go", ["// Code generated by protoc. DO NOT EDIT."]),
+                         SKIP_REASON_GENERATED)
+        self.assertEqual(get_prefilter_skip_reason("src/schema.ts", ["/* @generated */"]), SKIP_REASON_GENERATED)
+        self.assertIsNone(get_prefilter_skip_reason("src/vendor_client.py", ["import os"]))
+
+    @patch.dict('api.core_config.app_configs', {"REVIEW_PREFILTER_MAX_LINE_LENGTH": 100})
+    def test_long_lines(self):
+        self.assertEqual(get_prefilter_skip_reason("assets/bundle.js", ["a" * 101]), SKIP_REASON_LONG_LINES)
+        self.assertIsNone(get_prefilter_skip_reason("assets/app.js", ["a" * 100]))
+
+    def test_repo_rules(self):
+        rules = {"exclude_globs": ["migrations/*"], "exclude_regexes": [r"\.snap$"], "include_globs": ["vendor/ours/*"]}
+        self.assertEqual(get_prefilter_skip_reason("migrations/0001_init.py", ["x"], rules), SKIP_REASON_REPO_RULE)
+        self.assertEqual(get_prefilter_skip_reason("tests/__snapshots__/a.snap", ["x"], rules), SKIP_REASON_REPO_RULE)
+        self.assertIsNone(get_prefilter_skip_reason("vendor/ours/lib.py", ["x"], rules))
+
+    def test_prefilter_both_pipelines(self):
+        kept, skipped = prefilter_structured_changes({
+            "app.py": _file_data("app.py", ["print(1)"]),
+            "yarn.lock": _file_data("yarn.lock", ["foo@1:"]),
+        })
+        self.assertEqual(list(kept), ["app.py"])
+        self.assertEqual(skipped, {"yarn.lock": SKIP_REASON_LOCKFILE})
+
+        kept_items, skipped = prefilter_general_file_items([
+            {"file_path": "app.py", "diff_text": "@@ -0,0 +1 @@\n+print(1)"},
+            {"file_path": "gen/model.py", "diff_text": "@@ -0,0 +1 @@\n+# @generated by tool"},
+        ])
+        self.assertEqual([item["file_path"] for item in kept_items], ["app.py"])
+        self.assertEqual(skipped, {"gen/model.py": SKIP_REASON_GENERATED})
+
+    @patch.dict('api.core_config.app_configs', {"REVIEW_PREFILTER_ENABLED": False})
+    def test_disabled(self):
+        changes = {"yarn.lock": _file_data("yarn.lock", ["foo@1:"])}
+        self.assertEqual(prefilter_structured_changes(changes), (changes, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
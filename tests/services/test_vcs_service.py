@@ -0,0 +1,210 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+import requests
+from api.services import http_session_pool
+from api.services.vcs_service import (
+    iter_github_pr_files, get_github_pr_changes, get_gitlab_mr_changes, fetch_file_contents_concurrently,
+    get_github_pr_data_for_general_review
+)
+
+
+def _page(items, next_url=None):
+    response = MagicMock()
+    response.json.return_value = items
+    response.links = {"next": {"url": next_url}} if next_url else {}
+    return response
+
+
+def _file(name):
+    return {"filename": name, "status": "modified", "patch": "@@ -1,1 +1,1 @@\n-a\n+b"}
+
+
+class TestGithubPrFilePagination(unittest.TestCase):
+
+    @patch('api.services.vcs_service._get_with_job_deadline')
+    def test_follows_link_header_across_pages(self, mock_get):
+        mock_get.side_effect = [
+            _page([_file(f"a{i}.py") for i in range(100)], "https://api.github.com/x/files?per_page=100&page=2"),
+            _page([_file("b.py")]),
+        ]
+
+        names = [item["filename"] for item in iter_github_pr_files("https://api.github.com/x/files", {})]
+
+        self.assertEqual(len(names), 101)
+        self.assertEqual(mock_get.call_args_list[0].kwargs["params"], {"per_page": 100})
+        self.assertEqual(mock_get.call_args_list[1].args[0], "https://api.github.com/x/files?per_page=100&page=2")
+        self.assertIsNone(mock_get.call_args_list[1].kwargs["params"])
+
+    @patch('api.services.vcs_service._get_with_job_deadline')
+    def test_pages_are_fetched_lazily(self, mock_get):
+        mock_get.side_effect = [_page([_file("a.py")], "https://api.github.com/x/files?page=2"), _page([_file("b.py")])]
+
+        files = iter_github_pr_files("https://api.github.com/x/files", {})
+        self.assertEqual(next(files)["filename"], "a.py")
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch('api.services.vcs_service._get_with_job_deadline')
+    def test_changes_include_files_beyond_first_page(self, mock_get):
+        mock_get.side_effect = [_page([_file("a.py")], "https://api.github.com/x/files?page=2"), _page([_file("b.py")])]
+
+        self.assertEqual(set(get_github_pr_changes("o", "r", 1, "token")), {"a.py", "b.py"})
+
+    @patch('api.services.vcs_service._get_with_job_deadline')
+    def test_failed_later_page_returns_none_instead_of_partial_changes(self, mock_get):
+        failed_page = MagicMock()
+        failed_page.raise_for_status.side_effect = requests.exceptions.HTTPError("502 Bad Gateway")
+        mock_get.side_effect = [_page([_file("a.py")], "https://api.github.com/x/files?page=2"), failed_page]
+
+        self.assertIsNone(get_github_pr_changes("o", "r", 1, "token"))
+
+    @patch('api.services.vcs_service._get_with_job_deadline')
+    def test_malformed_later_page_returns_none(self, mock_get):
+        bad_json = MagicMock()
+        bad_json.json.side_effect = requests.exceptions.JSONDecodeError("Expecting value", "<html>", 0)
+        mock_get.side_effect = [_page([_file("a.py")], "https://api.github.com/x/files?page=2"), bad_json]
+
+        self.assertIsNone(get_github_pr_changes("o", "r", 1, "token"))
+
+
+@patch.dict('api.core_config.app_configs', {"VCS_DIFF_FETCH_MODE": "full_diff"})
+class TestFullDiffFetchMode(unittest.TestCase):
+
+    @patch('api.services.vcs_service._get_with_job_deadline')
+    def test_github_changes_from_single_streamed_diff(self, mock_get):
+        diff_response = MagicMock()
+        diff_response.__enter__.return_value = diff_response
+        diff_response.iter_content.return_value = [
+            b"diff --git a/a.py b/a.py\n--- a/a.py\n+++ b/a.py\n@@ -1 +1 @@\n-a\n",
+            b"+b\ndiff --git a/b.py b/b.py\nnew file mode 100644\n--- /dev/null\n+++ b/b.py\n@@ -0,0 +1 @@\n+c\n"]
+        mock_get.return_value = diff_response
+
+        changes = get_github_pr_changes("o", "r", 1, "token")
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(mock_get.call_args.args[0], "https://api.github.com/repos/o/r/pulls/1")
+        self.assertEqual(mock_get.call_args.kwargs["headers"]["Accept"], "application/vnd.github.v3.diff")
+        self.assertEqual(set(changes), {"a.py", "b.py"})
+        self.assertEqual(len(changes["a.py"]["changes"]), 2)
+
+    @patch('api.services.vcs_service._get_with_job_deadline')
+    def test_falls_back_to_file_list_when_diff_rejected(self, mock_get):
+        too_large = MagicMock()
+        too_large.raise_for_status.side_effect = requests.exceptions.HTTPError("406 diff too large")
+        mock_get.side_effect = [too_large, _page([_file("a.py")])]
+
+        self.assertEqual(set(get_github_pr_changes("o", "r", 1, "token")), {"a.py"})
+        self.assertTrue(mock_get.call_args.args[0].endswith("/pulls/1/files"))
+
+    @staticmethod
+    def _broken_diff_stream():
+        def _chunks(chunk_size=None):
+            yield b"diff --git a/a.py b/a.py\n--- a/a.py\n+++ b/a.py\n@@ -1 +1 @@\n-a\n+b\n"
+            yield b"diff --git a/b.py b/b.py\n--- a/b.py\n+++ b/b.py\n"
+            raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+        diff_response = MagicMock()
+        diff_response.__enter__.return_value = diff_response
+        diff_response.iter_content.side_effect = _chunks
+        return diff_response
+
+    @patch('api.services.vcs_service._get_with_job_deadline')
+    def test_github_stream_broken_midway_returns_none(self, mock_get):
+        mock_get.return_value = self._broken_diff_stream()
+
+        self.assertIsNone(get_github_pr_changes("o", "r", 1, "token"))
+
+    @patch('api.services.vcs_service._get_with_job_deadline')
+    def test_gitlab_stream_broken_midway_returns_none_with_position_info(self, mock_get):
+        versions = MagicMock()
+        versions.json.return_value = [
+            {"id": 2, "base_commit_sha": "base", "start_commit_sha": "start", "head_commit_sha": "head"}]
+        mock_get.side_effect = [versions, self._broken_diff_stream()]
+
+        changes, position_info = get_gitlab_mr_changes("1", 5, "token")
+
+        self.assertIsNone(changes)
+        self.assertEqual(position_info["head_sha"], "head")
+        self.assertTrue(mock_get.call_args.args[0].endswith("/merge_requests/5/raw_diffs"))
+
+
+class TestGeneralReviewData(unittest.TestCase):
+
+    @patch('api.services.vcs_service.fetch_file_contents_concurrently')
+    @patch('api.services.vcs_service._get_with_job_deadline')
+    def test_old_contents_fetched_only_for_files_kept_by_filter(self, mock_get, mock_fetch):
+        mock_get.return_value = _page([_file("a.py"), _file("package-lock.json")])
+        mock_fetch.side_effect = lambda requests_list, description: ["old"] * len(requests_list)
+        pr_data = {"base": {"sha": "base"}, "head": {"sha": "head"}}
+
+        file_items = get_github_pr_data_for_general_review(
+            "o", "r", 1, "token", pr_data,
+            file_filter=lambda items: [item for item in items if item["file_path"] != "package-lock.json"])
+
+        self.assertEqual([item["file_path"] for item in file_items], ["a.py"])
+        self.assertEqual(file_items[0]["old_content"], "old")
+        fetch_requests = mock_fetch.call_args.args[0]
+        self.assertEqual(len(fetch_requests), 1)
+        self.assertIn("a.py", fetch_requests[0]["url"])
+
+
+class TestConcurrentFileContentFetch(unittest.TestCase):
+
+    @patch.dict(http_session_pool._host_semaphores, clear=True)
+    @patch.dict('api.core_config.app_configs', {"VCS_FETCH_MAX_CONCURRENCY": 8, "HTTP_MAX_CONCURRENT_PER_HOST": 2})
+    @patch('api.services.vcs_service._fetch_file_content_from_url')
+    def test_results_in_order_with_per_host_limit(self, mock_fetch):
+        lock = threading.Lock()
+        active = {"github": 0, "gitlab": 0}
+        peak = {"github": 0, "gitlab": 0}
+
+        def _fetch(url, headers, max_size_bytes=None):
+            host = "github" if "github" in url else "gitlab"
+            with lock:
+                active[host] += 1
+                peak[host] = max(peak[host], active[host])
+            time.sleep(0.02)
+            with lock:
+                active[host] -= 1
+            return None if url.endswith("missing") else url.rsplit("/", 1)[1]
+
+        mock_fetch.side_effect = _fetch
+        urls = [f"https://api.github.com/f/{i}" for i in range(6)] + \
+               ["https://gitlab.com/f/missing"] + [f"https://gitlab.com/f/{i}" for i in range(3)]
+
+        results = fetch_file_contents_concurrently([{"url": url, "headers": {}} for url in urls], "test")
+
+        self.assertEqual(results, [str(i) for i in range(6)] + [None] + [str(i) for i in range(3)])
+        self.assertEqual(peak["github"], 2)
+        self.assertLessEqual(peak["gitlab"], 2)
+
+    @patch('api.services.vcs_service.store_cached_file_content')
+    @patch('api.services.vcs_service.get_cached_file_content')
+    @patch('api.services.vcs_service._fetch_file_content_from_url')
+    def test_only_real_contents_are_cached(self, mock_fetch, mock_get_cached, mock_store):
+        mock_get_cached.return_value = None
+        mock_fetch.side_effect = lambda url, headers, max_size_bytes=None: {
+            "big": "[Content not fetched: File size (2000 bytes) exceeds limit 1024 bytes]",
+            "empty": "", "failed": None, "ok": "x = 1"}[url.rsplit("/", 1)[1]]
+        fetch_requests = [{"url": f"https://gitlab.com/f/{name}", "headers": {}, "max_size_bytes": 1024,
+                           "cache_key": ("gitlab:repo", "sha", name)} for name in ("big", "empty", "failed", "ok")]
+
+        fetch_file_contents_concurrently(fetch_requests, "test")
+
+        mock_store.assert_called_once_with("gitlab:repo", "sha", "ok", "x = 1")
+
+    @patch('api.services.vcs_service.get_cached_file_content', return_value="x" * 2000)
+    @patch('api.services.vcs_service._fetch_file_content_from_url', return_value="[Content not fetched: too big]")
+    def test_cached_content_over_size_limit_is_not_used(self, mock_fetch, _get_cached):
+        results = fetch_file_contents_concurrently(
+            [{"url": "https://gitlab.com/f/a", "headers": {}, "max_size_bytes": 1024, "cache_key": ("r", "s", "a")},
+             {"url": "https://gitlab.com/f/b", "headers": {}, "max_size_bytes": 4096, "cache_key": ("r", "s", "b")}],
+            "test")
+
+        self.assertEqual(results, ["[Content not fetched: too big]", "x" * 2000])
+        self.assertEqual(mock_fetch.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
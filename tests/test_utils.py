@@ -1,5 +1,5 @@
 import unittest
-from api.utils import parse_single_file_diff
+from api.utils import parse_single_file_diff, split_file_changes_into_chunks, estimate_tokens, format_file_changes_compact
 
 class TestUtils(unittest.TestCase):
 
@@ -92,5 +92,52 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(result["path"], file_path)
         self.assertEqual(result["old_path"], old_file_path)
 
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("abcdefgh"), 2)
+        self.assertEqual(estimate_tokens("中文"), 2)
+
+    def test_split_file_changes_small_file_not_split(self):
+        result = parse_single_file_diff("@@ -1,1 +1,1 @@\n-old\n+new", "small.py")
+        self.assertEqual(split_file_changes_into_chunks(result, 1000), [result])
+
+    def test_split_file_changes_hunk_aligned(self):
+        long_line = "x" * 400  # 约 100 tokens
+        diff_text = (
+            "@@ -1,2 +1,2 @@\n"
+            f"-{long_line}\n"
+            f"+{long_line}\n"
+            " context_line\n"
+            "@@ -20,1 +20,2 @@\n"
+            f"+{long_line}\n"
+            f"+{long_line}\n"
+        )
+        result = parse_single_file_diff(diff_text, "big.py")
+        chunks = split_file_changes_into_chunks(result, 300)
+        self.assertEqual(len(chunks), 2)
+        # 第一个变更块 (删除+新增) 不被拆开，行号保持为文件中的真实行号
+        self.assertEqual([(c["old_line"], c["new_line"]) for c in chunks[0]["changes"]], [(1, None), (None, 1)])
+        self.assertEqual([c["new_line"] for c in chunks[1]["changes"]], [20, 21])
+        self.assertIn("2 -> 2: context_line", chunks[0]["context"]["new"])
+        self.assertEqual(chunks[1]["context"]["new"], "")
+        self.assertEqual(sum(c["lines_changed"] for c in chunks), result["lines_changed"])
+
+    def test_format_file_changes_compact(self):
+        diff_text = "@@ -1,2 +1,2 @@\n keep\n-old\n+new\n@@ -10,1 +10,2 @@\n+added\n"
+        result = parse_single_file_diff(diff_text, "new.py", "old.py")
+        self.assertEqual(format_file_changes_compact(result), "\n".join([
+            "FILE: new.py",
+            "OLD_PATH: old.py",
+            "LINES_CHANGED: 3",
+            "CONTEXT:",
+            "1 -> 1: keep",
+            "CHANGES:",
+            "@@",
+            "-2: old",
+            "+2: new",
+            "@@",
+            "+10: added",
+        ]))
+
 if __name__ == '__main__':
     unittest.main()